@@ -0,0 +1,125 @@
+"""
+Agregados mensais da fato_lancamento para os dashboards do Metabase.
+
+Uso:
+    python agregados.py --reconstruir    # recalcula todo o histórico
+    python agregados.py --verificar      # compara com a fato (status 1 se divergir)
+
+agg_lancamento_mensal guarda total e quantidade de lançamentos por mês, tipo,
+grupo, categoria e classificação. O ETL recalcula só os meses tocados por cada
+carga (atualizar_agregados), na mesma transação da fato.
+"""
+import argparse
+import sys
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from logger import get_logger
+from metricas import executar_sql
+
+logger = get_logger(__name__)
+
+SQL_AGREGAR = """
+INSERT INTO agg_lancamento_mensal
+    (id_tempo, id_tipo, id_grupo, id_categoria, id_classificacao, valor_total, quantidade)
+SELECT id_tempo, id_tipo, id_grupo, id_categoria, id_classificacao, SUM(valor), COUNT(*)
+FROM fato_lancamento
+{filtro}
+GROUP BY id_tempo, id_tipo, id_grupo, id_categoria, id_classificacao
+"""
+
+# Diferenças entre o agregado e a fato, na granularidade do agregado (vazio = consistente)
+SQL_VERIFICAR = """
+WITH fato AS (
+    SELECT id_tempo, id_tipo, id_grupo, id_categoria, id_classificacao,
+           SUM(valor) AS valor_total, COUNT(*) AS quantidade
+    FROM fato_lancamento
+    GROUP BY id_tempo, id_tipo, id_grupo, id_categoria, id_classificacao
+)
+SELECT id_tempo, id_tipo, id_grupo, id_categoria, id_classificacao,
+       f.valor_total AS valor_fato, a.valor_total AS valor_agregado,
+       f.quantidade AS quantidade_fato, a.quantidade AS quantidade_agregado
+FROM fato f
+FULL JOIN agg_lancamento_mensal a USING (id_tempo, id_tipo, id_grupo, id_categoria, id_classificacao)
+WHERE f.valor_total IS DISTINCT FROM a.valor_total
+   OR f.quantidade IS DISTINCT FROM a.quantidade
+ORDER BY id_tempo, id_tipo, id_grupo, id_categoria, id_classificacao
+"""
+
+
+def _bloquear(conn: Connection) -> None:
+    # Cargas simultâneas recalculam um mês por vez; leituras do Metabase seguem liberadas
+    conn.execute(text("LOCK TABLE agg_lancamento_mensal IN EXCLUSIVE MODE"))
+
+
+def atualizar_agregados(conn: Connection, meses: list) -> int:
+    """
+    Recalcula as fatias (ano, mes) informadas (chaves YYYYMM da dim_tempo)
+    a partir da fato. Roda na transação de `conn`, normalmente a mesma da
+    carga da fato.
+
+    :return: linhas gravadas no agregado
+    """
+    if not meses:
+        return 0
+    meses = sorted(int(m) for m in meses)
+    _bloquear(conn)
+    conn.execute(text("DELETE FROM agg_lancamento_mensal WHERE id_tempo = ANY(:meses)"), {"meses": meses})
+    linhas = executar_sql(conn, SQL_AGREGAR.format(filtro="WHERE id_tempo = ANY(:meses)"), {"meses": meses})
+    logger.info(f"Agregados mensais atualizados para {len(meses)} meses ({linhas} linhas)")
+    return linhas
+
+
+def reconstruir_agregados(engine: Engine) -> int:
+    """
+    Recalcula o agregado inteiro a partir da fato.
+    """
+    with engine.begin() as conn:
+        _bloquear(conn)
+        conn.execute(text("DELETE FROM agg_lancamento_mensal"))
+        linhas = executar_sql(conn, SQL_AGREGAR.format(filtro=""))
+    logger.info(f"Agregados mensais reconstruídos ({linhas} linhas)")
+    return linhas
+
+
+def verificar_agregados(engine: Engine) -> pd.DataFrame:
+    """
+    Confere totais e quantidades do agregado contra a fato.
+
+    :return: linhas divergentes (vazio quando consistente)
+    """
+    with engine.connect() as conn:
+        resultado = conn.execute(text(SQL_VERIFICAR))
+        divergencias = pd.DataFrame(resultado.all(), columns=list(resultado.keys()))
+    if divergencias.empty:
+        logger.info("Agregados mensais consistentes com a fato")
+    else:
+        logger.error(f"Agregados mensais divergentes em {len(divergencias)} linhas")
+    return divergencias
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Manutenção dos agregados mensais.")
+    parser.add_argument("--reconstruir", action="store_true", help="recalcula todo o histórico")
+    parser.add_argument("--verificar", action="store_true", help="compara o agregado com a fato")
+    args = parser.parse_args(argv)
+    if not (args.reconstruir or args.verificar):
+        parser.error("informe --reconstruir e/ou --verificar")
+
+    from db import get_engine
+    engine = get_engine()
+
+    if args.reconstruir:
+        reconstruir_agregados(engine)
+    if args.verificar:
+        divergencias = verificar_agregados(engine)
+        if not divergencias.empty:
+            print(divergencias.to_string(index=False))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,17 @@
-import streamlit as st
+import os
+import time
+
 import pandas as pd
+import streamlit as st
 from db import get_engine
-from sqlalchemy import NUMERIC
-from etl import run_etl
+from etl import limpar_stagings_orfas
 from logger import get_logger
+from metricas import carregar_etapas
 
-from utils import normalize_valor, gerar_hash
+from cache_uploads import cache_uploads, chave_conteudo
+from ingestao import formato_arquivo, ler_arquivo, verificar_campos, preparar_upload
+from jobs import enfileirar, iniciar_worker, obter_job
+from simulacao import DIMENSOES, simular_arquivo, simular_carga
 
 logger = get_logger(__name__)
 
@@ -14,80 +20,231 @@ st.set_page_config(page_title="Ingestão Financeira", page_icon="📊")
 st.title("📊 Inserir dados Dashboard")
 st.write("Faça upload da planilha mensal para carregar no banco e atualizar o DW.")
 
-uploaded_file = st.file_uploader("Escolha um arquivo CSV", type=["csv"])
+uploaded_file = st.file_uploader("Escolha um arquivo CSV ou planilha Excel", type=["csv", "xlsx"])
+substituir_meses = st.checkbox(
+    "Substituir os meses do arquivo",
+    help="Os meses presentes na planilha são recarregados por inteiro: lançamentos corrigidos "
+         "substituem os antigos em vez de serem somados a eles.",
+)
+
+
+@st.cache_resource
+def engine_compartilhada():
+    """
+    Engine (e pool de conexões) reaproveitada entre os reruns do script.
+    Na criação, descarta stagings deixadas por cargas interrompidas e inicia
+    o worker que executa os jobs do ETL em segundo plano.
+    """
+    engine = get_engine()
+    limpar_stagings_orfas(engine)
+    iniciar_worker(engine)
+    return engine
+
+
+# Já no carregamento da página: jobs pendentes ou abandonados numa queda
+# voltam a andar sem depender de um novo upload
+engine_compartilhada()
+
+
+def mostrar_metricas(detalhes):
+    """
+    Exibe tempo, linhas afetadas e pico de memória de cada etapa do ETL.
+    """
+    st.write(f"**Tempo por etapa** (total {detalhes['segundos'].sum():.2f}s):")
+    st.bar_chart(detalhes, x="etapa", y="segundos")
+    st.dataframe(detalhes, hide_index=True)
+
+
+def mostrar_erros_validacao(validacao):
+    """
+    Resumo por regra e coluna, amostra limitada e CSV completo para download.
+    """
+    st.error(f"🚫 Encontrados {validacao.registros_invalidos} registros inválidos!")
+    st.write("**Registros com problema por regra e coluna:**")
+    st.dataframe(validacao.resumo(), hide_index=True)
+    st.write(f"**Primeiros {len(validacao.amostra)} registros com problemas:**")
+    st.dataframe(validacao.amostra, hide_index=True)
+    st.download_button(
+        "Baixar todos os registros com erro (CSV)",
+        data=validacao.csv_erros(),
+        file_name="registros_com_erro.csv",
+        mime="text/csv",
+    )
+    st.error(" Não é possível processar o arquivo com registros inválidos. Corrija os dados e faça upload novamente.")
+    st.stop()
+
+# Arquivos maiores que este limite são processados em blocos (modo streaming)
+LIMITE_STREAMING_MB = float(os.getenv("LIMITE_STREAMING_MB", "50"))
+
+
+def formatar_meses(meses) -> str:
+    return ", ".join(f"{m % 100:02d}/{m // 100}" for m in meses)
+
+
+def mostrar_simulacao(simulacao):
+    """
+    Prévia do impacto da carga (dry-run): membros de dimensão e lançamentos
+    novos, já carregados e, na substituição, removidos.
+    """
+    st.write(f"**Simulação da carga** (nada foi gravado, {simulacao.segundos:.2f}s):")
+    st.dataframe(simulacao.resumo(), hide_index=True)
+    if simulacao.substituir_meses and simulacao.registros_substituidos:
+        st.caption(f"Meses que serão substituídos: {formatar_meses(sorted(simulacao.registros_substituidos))}")
+    for dimensao, rotulo in DIMENSOES.items():
+        if simulacao.membros_novos[dimensao]:
+            with st.expander(f"{rotulo} novos ({len(simulacao.membros_novos[dimensao])})"):
+                exemplos = simulacao.exemplos(dimensao)
+                if dimensao == "dim_tempo":
+                    exemplos = [formatar_meses([int(m)]) for m in exemplos]
+                st.write(", ".join(exemplos))
+
+
+def processar(conteudo: bytes, substituir_meses: bool, formato: str):
+    """
+    Enfileira a carga; a execução segue no worker mesmo que a página
+    recarregue ou o navegador desconecte.
+    """
+    engine = engine_compartilhada()
+    st.session_state["id_job"] = enfileirar(engine, conteudo, substituir_meses, formato)
+
+
+def acompanhar_job(id_job: int):
+    """
+    Mostra o andamento do job (etapa atual e linhas) e consulta de novo a
+    cada segundo até que ele termine.
+    """
+    engine = engine_compartilhada()
+    job = obter_job(engine, id_job)
+    if job is None:
+        st.session_state.pop("id_job", None)
+        return
 
-if uploaded_file is not None:
+    if job["status"] in ("pendente", "executando"):
+        if job["status"] == "pendente":
+            st.info(f"⏳ Carga #{id_job} na fila, aguardando um worker livre...")
+        else:
+            linhas, total = job["linhas_processadas"] or 0, job["linhas_total"] or 0
+            etapa = job["etapa"] or "iniciando"
+            contagem = f"{linhas} de ~{total} linhas" if total else f"{linhas} linhas"
+            st.progress(min(linhas / total, 1.0) if total else 0.0,
+                        text=f"⚙️ Carga #{id_job}: etapa {etapa} ({contagem})")
+        time.sleep(1)
+        st.rerun()
+
+    resultado = job["resultado"] or {}
+    if job["status"] == "erro":
+        st.error(f"❌ Ocorreu um erro no processamento dos dados: {job['erro']}")
+        if resultado.get("resumo_validacao"):
+            st.dataframe(pd.DataFrame(resultado["resumo_validacao"]), hide_index=True)
+            if os.path.exists(resultado["arquivo_erros"]):
+                with open(resultado["arquivo_erros"], "rb") as f:
+                    st.download_button("Baixar todos os registros com erro (CSV)", data=f.read(),
+                                       file_name="registros_com_erro.csv", mime="text/csv")
+        return
+
+    if job["parametros"].get("substituir_meses"):
+        meses = formatar_meses(resultado.get("meses_substituidos", [])) or "nenhum (meses novos)"
+        st.info(f"🔁 {resultado.get('registros', 0)} registros carregados; meses substituídos por inteiro: {meses}")
+    else:
+        novos = resultado.get("registros_novos", resultado.get("registros", 0))
+        existentes = resultado.get("registros_existentes", resultado.get("existentes", 0))
+        st.info(f"📥 {novos} registros novos carregados; {existentes} já carregados foram ignorados")
+
+    st.success("✅ Dados carregados e base de dados atualizado com sucesso!")
+    if job["id_run"] is not None:
+        mostrar_metricas(carregar_etapas(engine, job["id_run"]))
+    if st.session_state.get("comemorado") != id_job:
+        st.session_state["comemorado"] = id_job
+        st.balloons()  # 🎉 efeito visual
+
+
+def ingestao_streaming(arquivo, formato, substituir_meses=False):
+    """
+    Modo streaming: mostra só uma prévia; ao confirmar, o job valida, gera
+    hash, normaliza e carrega a staging bloco a bloco, sem ler o arquivo inteiro.
+    """
+    previa = ler_arquivo(arquivo, formato, nrows=10)
+    campos_faltando = verificar_campos(previa.columns)
+    if campos_faltando:
+        st.error(f"❌ Campos obrigatórios não encontrados: {', '.join(campos_faltando)}")
+        st.stop()
+
+    st.info(f"📦 Arquivo grande ({arquivo.size / 1024 ** 2:.0f} MB): será validado e carregado em blocos.")
+    st.write("Pré-visualização dos dados:")
+    st.dataframe(previa)
+
+    # Arquivo grande: a simulação lê o arquivo inteiro, então só sob demanda.
+    # Chave pelo conteúdo: outro arquivo com mesmo nome e tamanho não reaproveita
+    chave_simulacao = (chave_conteudo(arquivo.getvalue()), substituir_meses)
+    if st.button("Simular carga (sem gravar)"):
+        try:
+            with st.spinner("Simulando a carga..."):
+                # A prévia avançou a posição de leitura do arquivo
+                arquivo.seek(0)
+                validacao, simulacao = simular_arquivo(arquivo, engine_compartilhada(), formato, substituir_meses)
+        except Exception as e:
+            logger.exception("Erro ao simular a carga")
+            st.error(f"❌ Não foi possível simular a carga: {e}")
+            st.stop()
+        if simulacao is None:
+            mostrar_erros_validacao(validacao)
+        st.session_state["simulacao"] = (chave_simulacao, simulacao)
+    if st.session_state.get("simulacao", (None,))[0] == chave_simulacao:
+        mostrar_simulacao(st.session_state["simulacao"][1])
+
+    if st.button("Processar e carregar na base de dados", type="primary"):
+        processar(arquivo.getvalue(), substituir_meses, formato)
+
+
+if uploaded_file is not None and uploaded_file.size > LIMITE_STREAMING_MB * 1024 ** 2:
+    ingestao_streaming(uploaded_file, formato_arquivo(uploaded_file.name), substituir_meses)
+
+elif uploaded_file is not None:
+    formato = formato_arquivo(uploaded_file.name)
     try:
-        # Ler CSV (tratando decimal brasileiro)
-        df = pd.read_csv(uploaded_file, sep=",", quotechar='"', decimal=",")
-
-        # Validar campos obrigatórios usando pandas
-        campos_obrigatorios = ["Descrição", "Tipo", "Grupo", "Categoria", "Classificação", "Data", "Valor"]
-        
-        # Verificar se todos os campos obrigatórios existem
-        campos_faltando = [campo for campo in campos_obrigatorios if campo not in df.columns]
+        # Verificar se todos os campos obrigatórios existem (só o cabeçalho)
+        campos_faltando = verificar_campos(ler_arquivo(uploaded_file, formato, nrows=0).columns)
         if campos_faltando:
             st.error(f"❌ Campos obrigatórios não encontrados: {', '.join(campos_faltando)}")
             st.stop()
-        
-        # Normalizar strings vazias e espaços para NaN usando pandas
-        df_validacao = df[campos_obrigatorios].copy()
-        df_validacao = df_validacao.replace('', pd.NA)  # Converte strings vazias para NA
-        df_validacao = df_validacao.replace(r'^\s*$', pd.NA, regex=True)  # Converte strings só com espaços para NA
-
-        # Usar pandas para encontrar registros com valores nulos
-        registros_com_nulos = df_validacao.isnull().any(axis=1)
-        
-        if registros_com_nulos.any():
-            indices_problemas = df_validacao[registros_com_nulos].index.tolist()
-            st.error(f"🚫 Encontrados {len(indices_problemas)} registros com valores nulos!")
-            
-            st.write("**Registros com problemas:**")
-            
-            # Mostrar registros problemáticos
-            df_problemas = df.iloc[indices_problemas]
-            st.dataframe(df_problemas)
-            
-            # Usar pandas para mostrar quais campos estão nulos
-            st.write("**Campos com valores nulos por registro:**")
-            campos_nulos_por_registro = df_validacao[registros_com_nulos].isnull()
-            
-            for idx in indices_problemas:
-                campos_nulos = campos_nulos_por_registro.loc[idx]
-                campos_com_problema = campos_nulos[campos_nulos].index.tolist()
-                if campos_com_problema:
-                    st.write(f"Registro {idx + 1}: {', '.join(campos_com_problema)}")
-            
-            st.error(" Não é possível processar o arquivo com valores nulos. Corrija os dados e faça upload novamente.")
-            st.stop()
 
-        # Se chegou até aqui, não há valores nulos
-        df["Valor"] = df["Valor"].fillna("0")
-        df["id_hash"] = df.apply(gerar_hash, axis=1)
-        df = normalize_valor(df)
+        # Leitura, validação, hash e normalização uma vez por conteúdo: os
+        # reruns do Streamlit (e uploads idênticos) reaproveitam o resultado
+        upload, reaproveitado = cache_uploads.preparar(
+            uploaded_file.getvalue(), lambda conteudo: preparar_upload(conteudo, formato)
+        )
+        # Só avisa no primeiro rerun de um novo upload, não a cada interação
+        if reaproveitado and st.session_state.get("upload_atual") != upload.chave:
+            st.info("♻️ Arquivo idêntico a um upload recente: validação e preparo reaproveitados.")
+        st.session_state["upload_atual"] = upload.chave
+        if upload.carregado_em is not None:
+            st.warning(f"⚠️ Este arquivo já foi carregado na base em {upload.carregado_em:%d/%m/%Y %H:%M}.")
 
-        st.success("✅ Arquivo carregado com sucesso!")
-        st.success("✅ Validação de campos obrigatórios: OK!")
-        st.write("Pré-visualização dos dados:")
-        st.dataframe(df.head(10))
+        if not upload.validacao.ok:
+            mostrar_erros_validacao(upload.validacao)
 
-        if st.button("Processar e carregar na base de dados", type="primary"):
-            try:
-                engine = get_engine()
+        # Se chegou até aqui, todos os registros são válidos
+        df = upload.df
 
-                # Carregar staging
-                df.to_sql("staging_lancamentos", engine, if_exists="replace", index=False, dtype={"Valor": NUMERIC(15,2)})
-                logger.info(f"{len(df)} registros inseridos em staging_lancamentos")
-                st.info(f"📥 {len(df)} registros inseridos em staging_lancamentos")
+        st.success("✅ Arquivo carregado com sucesso!")
+        st.success("✅ Validação dos registros: OK!")
+        st.write("Pré-visualização dos dados:")
+        st.dataframe(df.head(10).assign(Valor=lambda d: d["valor_centavos"] / 100).drop(columns=["valor_centavos", "id_tempo"]))
 
-                run_etl()
+        # Dry-run refeito só quando muda o arquivo, o modo ou após uma carga dele
+        chave_simulacao = (upload.chave, substituir_meses, upload.carregado_em)
+        if st.session_state.get("simulacao", (None,))[0] != chave_simulacao:
+            simulacao = simular_carga(df, engine_compartilhada(), substituir_meses)
+            st.session_state["simulacao"] = (chave_simulacao, simulacao)
+        mostrar_simulacao(st.session_state["simulacao"][1])
 
-                st.success("✅ Dados carregados e base de dados atualizado com sucesso!")
-                st.balloons()  # 🎉 efeito visual
-            except Exception as e:
-                logger.exception("Erro durante o processamento")
-                st.error(f"❌ Ocorreu um erro no processamento dos dados: {e}")
+        if st.button("Processar e carregar na base de dados", type="primary"):
+            # O worker reaproveita o DataFrame preparado (mesmo conteúdo, mesmo processo)
+            processar(uploaded_file.getvalue(), substituir_meses, formato)
 
     except Exception as e:
-        logger.exception("Erro ao carregar CSV")
+        logger.exception("Erro ao carregar arquivo")
         st.error(f"❌ Não foi possível carregar o arquivo: {e}")
+
+if "id_job" in st.session_state:
+    acompanhar_job(st.session_state["id_job"])
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import pandas as pd
+
+from logger import get_logger
+from validacao import ResultadoValidacao
+
+logger = get_logger(__name__)
+
+# Memória máxima ocupada pelos uploads preparados (soma dos DataFrames)
+CACHE_UPLOADS_MB = float(os.getenv("CACHE_UPLOADS_MB", "512"))
+
+# Tempo de vida de cada upload no cache, em segundos
+CACHE_UPLOADS_TTL = float(os.getenv("CACHE_UPLOADS_TTL", "1800"))
+
+
+@dataclass
+class UploadPreparado:
+    chave: str
+    validacao: ResultadoValidacao
+    df: pd.DataFrame | None = None        # só para arquivos válidos (já com hash e valor normalizado)
+    tamanho_bytes: int = 0
+    criado_em: float = field(default_factory=time.monotonic)
+    carregado_em: datetime | None = None  # última carga bem-sucedida no DW
+
+
+def chave_conteudo(conteudo: bytes) -> str:
+    """
+    Chave do cache: SHA-256 dos bytes enviados (mesmo arquivo, mesma chave,
+    independentemente do nome).
+    """
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+class CacheUploads:
+    """
+    Uploads já validados e preparados, endereçados pelo conteúdo. O Streamlit
+    reexecuta o script a cada interação; com o cache, a prévia e a carga
+    reaproveitam o mesmo DataFrame. Eviction LRU limitada pela memória dos
+    DataFrames e expiração por TTL.
+    """
+
+    def __init__(
+        self,
+        limite_mb: float = CACHE_UPLOADS_MB,
+        ttl: float = CACHE_UPLOADS_TTL,
+        relogio=time.monotonic,   # injetável nos testes de expiração
+    ):
+        self._lock = threading.Lock()
+        self._itens = OrderedDict()   # chave -> UploadPreparado, do menos ao mais recente
+        self._ocupado = 0
+        self.limite_bytes = int(limite_mb * 1024 ** 2)
+        self.ttl = ttl
+        self._relogio = relogio
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._itens.clear()
+            self._ocupado = 0
+
+    def _remover(self, chave: str) -> None:
+        item = self._itens.pop(chave)
+        self._ocupado -= item.tamanho_bytes
+
+    def _expirar(self) -> None:
+        agora = self._relogio()
+        for chave in [c for c, item in self._itens.items() if agora - item.criado_em > self.ttl]:
+            self._remover(chave)
+
+    def obter(self, chave: str) -> UploadPreparado | None:
+        with self._lock:
+            self._expirar()
+            item = self._itens.get(chave)
+            if item is not None:
+                self._itens.move_to_end(chave)
+            return item
+
+    def guardar(self, item: UploadPreparado) -> UploadPreparado:
+        if item.df is not None:
+            item.tamanho_bytes = int(item.df.memory_usage(deep=True).sum())
+
+        with self._lock:
+            if item.chave in self._itens:
+                self._remover(item.chave)
+            self._expirar()
+            # Um upload maior que o cache inteiro não é guardado
+            if item.tamanho_bytes > self.limite_bytes:
+                logger.info(f"Upload {item.chave[:12]} maior que o cache ({item.tamanho_bytes / 1024 ** 2:.0f} MB)")
+                return item
+            while self._itens and self._ocupado + item.tamanho_bytes > self.limite_bytes:
+                chave, _ = next(iter(self._itens.items()))
+                self._remover(chave)
+                logger.info(f"Upload {chave[:12]} removido do cache (LRU)")
+            self._itens[item.chave] = item
+            self._ocupado += item.tamanho_bytes
+        return item
+
+    def marcar_carregado(self, chave: str) -> None:
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None:
+                item.carregado_em = datetime.now()
+
+    def preparar(self, conteudo: bytes, preparar_df) -> tuple:
+        """
+        Devolve o upload preparado e se ele já estava no cache. Em caso de
+        falta, `preparar_df(conteudo)` deve devolver (validacao, df).
+
+        :return: (UploadPreparado, reaproveitado)
+        """
+        chave = chave_conteudo(conteudo)
+        item = self.obter(chave)
+        if item is not None:
+            logger.info(f"Upload {chave[:12]} reaproveitado do cache")
+            return item, True
+
+        validacao, df = preparar_df(conteudo)
+        item = UploadPreparado(chave=chave, validacao=validacao, df=df, criado_em=self._relogio())
+        return self.guardar(item), False
+
+
+cache_uploads = CacheUploads()
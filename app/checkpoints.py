@@ -0,0 +1,70 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class Checkpoints:
+    """
+    Etapas (e lotes da fato) já concluídas de uma carga, gravadas em
+    etl_checkpoint. Cada checkpoint é gravado na mesma transação do trabalho
+    que ele registra: ou os dois ficam, ou nenhum. Uma execução retomada
+    (etl.retomar_etl) pula o que já consta aqui e continua no primeiro
+    trecho pendente.
+
+    `id_run` é o da execução original; as retomadas gravam no mesmo id.
+    """
+
+    def __init__(self, id_run: int, concluidos: dict | None = None):
+        self.id_run = id_run
+        self._concluidos = concluidos or {}   # (etapa, lote) -> (pagina_inicial, pagina_final)
+
+    @classmethod
+    def carregar(cls, engine: Engine, id_run: int) -> "Checkpoints":
+        with engine.connect() as conn:
+            linhas = conn.execute(
+                text("SELECT etapa, lote, pagina_inicial, pagina_final FROM etl_checkpoint WHERE id_run = :id_run"),
+                {"id_run": id_run},
+            ).all()
+        checkpoints = cls(id_run, {(etapa, lote): (inicio, fim) for etapa, lote, inicio, fim in linhas})
+        if linhas:
+            logger.info(f"Retomando a carga {id_run}: {len(linhas)} checkpoints já gravados")
+        return checkpoints
+
+    def concluida(self, etapa: str, lote: int = 0) -> bool:
+        """
+        lote=0 é a etapa inteira; lotes da fato começam em 1.
+        """
+        return (etapa, lote) in self._concluidos
+
+    def paginas_por_lote(self, etapa: str, padrao: int) -> int:
+        """
+        Tamanho dos lotes de uma etapa. Numa retomada vale o da execução
+        original, para que os lotes pendentes cubram exatamente as mesmas
+        páginas da staging.
+        """
+        for (nome, lote), (inicio, fim) in self._concluidos.items():
+            if nome == etapa and lote > 0:
+                return fim - inicio
+        return padrao
+
+    def registrar(
+        self,
+        conn: Connection,
+        etapa: str,
+        lote: int = 0,
+        paginas: tuple | None = None,
+        linhas: int | None = None,
+    ) -> None:
+        inicio, fim = paginas or (None, None)
+        conn.execute(
+            text("""
+            INSERT INTO etl_checkpoint (id_run, etapa, lote, pagina_inicial, pagina_final, linhas)
+            VALUES (:id_run, :etapa, :lote, :inicio, :fim, :linhas)
+            ON CONFLICT (id_run, etapa, lote) DO NOTHING
+            """),
+            {"id_run": self.id_run, "etapa": etapa, "lote": lote, "inicio": inicio, "fim": fim, "linhas": linhas},
+        )
+        self._concluidos[(etapa, lote)] = (inicio, fim)
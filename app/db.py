@@ -1,4 +1,5 @@
 import os
+import threading
 from sqlalchemy import create_engine
 from sqlalchemy.engine import Engine
 from logger import get_logger
@@ -7,26 +8,74 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Engine (e pool) único por processo, compartilhado entre reruns do Streamlit
+_engine = None
+_engine_lock = threading.Lock()
+
+def montar_url(db_name: str | None = None) -> str:
+    """
+    Monta a URL de conexão a partir das variáveis de ambiente.
+    `db_name` substitui DB_NAME (útil para scripts que administram outros bancos).
+    """
+    user = os.getenv("DB_USER","postgres")
+    password = os.getenv("DB_PASSWORD", "postgres")
+    host = os.getenv("DB_HOST","localhost")
+    port = os.getenv("DB_PORT", "5432")
+    db_name = db_name or os.getenv("DB_NAME", "loretto_dw")
+
+    return f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{db_name}"
+
 def get_engine() -> Engine:
 
     logger = get_logger(__name__)
 
     """
-    Cria e retorna a conexão (engine) com o Postgres.
-    As credenciais são buscadas de variáveis de ambiente
+    Retorna a engine com o Postgres compartilhada pelo processo.
+    Criada na primeira chamada; as credenciais e o pool são configurados
+    por variáveis de ambiente (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE, DB_CONNECT_TIMEOUT e DB_STATEMENT_TIMEOUT_MS).
 
     :return: Engine
     """
-    user = os.getenv("DB_USER","postgres")
-    password = os.getenv("DB_PASSWORD", "postgres")
-    host = os.getenv("DB_HOST","localhost")
-    port = os.getenv("DB_PORT", "5432")
-    db_name = os.getenv("DB_NAME", "loretto_dw")
+    global _engine
+    if _engine is not None:
+        return _engine
+
+    with _engine_lock:
+        if _engine is not None:
+            return _engine
 
-    url = f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{db_name}"
+        host = os.getenv("DB_HOST","localhost")
+        port = os.getenv("DB_PORT", "5432")
+        db_name = os.getenv("DB_NAME", "loretto_dw")
 
-    logger.info(f"Conectando ao banco {db_name} em {host}:{port}...")
+        url = montar_url()
 
-    return create_engine(url, pool_pre_ping=True)
+        connect_args = {"connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", "10"))}
+        statement_timeout = os.getenv("DB_STATEMENT_TIMEOUT_MS")
+        if statement_timeout:
+            connect_args["options"] = f"-c statement_timeout={int(statement_timeout)}"
 
+        logger.info(f"Conectando ao banco {db_name} em {host}:{port}...")
 
+        _engine = create_engine(
+            url,
+            pool_pre_ping=True,
+            pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "5")),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            connect_args=connect_args,
+        )
+        return _engine
+
+
+def dispose_engine() -> None:
+    """
+    Fecha o pool compartilhado (a próxima chamada a get_engine cria outro).
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
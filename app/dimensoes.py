@@ -0,0 +1,283 @@
+import threading
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from logger import get_logger
+from utils import COLUNAS_CATEGORICAS, chaves_tempo, combinar_codigos
+
+logger = get_logger(__name__)
+
+TABELAS_DIMENSAO = ["dim_tipo", "dim_grupo", "dim_categoria", "dim_classificacao", "dim_tempo"]
+
+# Assinatura do schema das dimensões: muda com ALTER/DROP/CREATE e também com
+# TRUNCATE (que troca o relfilenode), invalidando os ids guardados no cache.
+SQL_ASSINATURA = """
+SELECT md5(string_agg(
+           c.relname || ':' || c.oid || ':' || c.relfilenode || ':' || cols.definicao,
+           '|' ORDER BY c.relname))
+FROM pg_class c
+JOIN (
+    SELECT table_name, string_agg(column_name || ' ' || data_type, ',' ORDER BY ordinal_position) AS definicao
+    FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name = ANY(:tabelas)
+    GROUP BY table_name
+) cols ON cols.table_name = c.relname
+WHERE c.relnamespace = current_schema()::regnamespace;
+"""
+
+
+class CacheDimensoes:
+    """
+    Mapas chave natural -> id das dimensões, mantidos em memória no processo.
+    Cada dimensão é lida uma única vez; depois disso só os membros novos vão
+    ao banco (INSERT ... RETURNING). O cache é reaproveitado entre cargas e
+    descartado quando a assinatura do schema muda.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._assinatura = None
+        self.limpar()
+
+    def limpar(self) -> None:
+        self.tipo = {}            # nome_tipo -> id_tipo
+        self.grupo = {}           # (id_tipo, nome_grupo) -> id_grupo
+        self.categoria = {}       # (id_grupo, nome_categoria) -> id_categoria
+        self.classificacao = {}   # nome_classificacao -> id_classificacao
+        self.tempo = {}           # id_tempo (YYYYMM) já existentes
+        self._carregado = False
+
+    def _sincronizar(self, conn: Connection) -> None:
+        """
+        Confere a assinatura do schema e (re)carrega as dimensões se preciso.
+        """
+        assinatura = conn.execute(text(SQL_ASSINATURA), {"tabelas": TABELAS_DIMENSAO}).scalar()
+        if assinatura != self._assinatura:
+            if self._assinatura is not None:
+                logger.info("Schema das dimensões mudou: cache invalidado")
+            self.limpar()
+            self._assinatura = assinatura
+
+        if self._carregado:
+            return
+
+        self.tipo = dict(
+            conn.execute(text("SELECT nome_tipo, id_tipo FROM dim_tipo")).all()
+        )
+        self.classificacao = dict(
+            conn.execute(text("SELECT nome_classificacao, id_classificacao FROM dim_classificacao")).all()
+        )
+        self.grupo = {
+            (id_tipo, nome): id_grupo
+            for id_grupo, id_tipo, nome in conn.execute(
+                text("SELECT id_grupo, id_tipo, nome_grupo FROM dim_grupo")
+            )
+        }
+        self.categoria = {
+            (id_grupo, nome): id_categoria
+            for id_categoria, id_grupo, nome in conn.execute(
+                text("SELECT id_categoria, id_grupo, nome_categoria FROM dim_categoria")
+            )
+        }
+        self.tempo = dict(
+            conn.execute(text("SELECT id_tempo, id_tempo FROM dim_tempo")).all()
+        )
+        self._carregado = True
+        logger.info(
+            f"Cache de dimensões carregado: {len(self.tipo)} tipos, {len(self.grupo)} grupos, "
+            f"{len(self.categoria)} categorias, {len(self.classificacao)} classificações, "
+            f"{len(self.tempo)} meses"
+        )
+
+    def _inserir_tipo(self, conn: Connection, nomes: list) -> None:
+        sql = """
+        INSERT INTO dim_tipo (nome_tipo)
+        SELECT unnest(CAST(:nomes AS TEXT[]))
+        ON CONFLICT (nome_tipo) DO NOTHING
+        RETURNING nome_tipo, id_tipo;
+        """
+        self.tipo.update(conn.execute(text(sql), {"nomes": nomes}).all())
+        # Membros inseridos por outra carga em paralelo não voltam no RETURNING
+        faltando = [n for n in nomes if n not in self.tipo]
+        if faltando:
+            self.tipo.update(conn.execute(
+                text("SELECT nome_tipo, id_tipo FROM dim_tipo WHERE nome_tipo = ANY(:nomes)"),
+                {"nomes": faltando},
+            ).all())
+
+    def _inserir_classificacao(self, conn: Connection, nomes: list) -> None:
+        sql = """
+        INSERT INTO dim_classificacao (nome_classificacao)
+        SELECT unnest(CAST(:nomes AS TEXT[]))
+        ON CONFLICT (nome_classificacao) DO NOTHING
+        RETURNING nome_classificacao, id_classificacao;
+        """
+        self.classificacao.update(conn.execute(text(sql), {"nomes": nomes}).all())
+        faltando = [n for n in nomes if n not in self.classificacao]
+        if faltando:
+            self.classificacao.update(conn.execute(
+                text("SELECT nome_classificacao, id_classificacao FROM dim_classificacao "
+                     "WHERE nome_classificacao = ANY(:nomes)"),
+                {"nomes": faltando},
+            ).all())
+
+    def _inserir_grupo(self, conn: Connection, chaves: list) -> None:
+        sql = """
+        INSERT INTO dim_grupo (id_tipo, nome_grupo)
+        SELECT * FROM unnest(CAST(:ids AS INT[]), CAST(:nomes AS TEXT[]))
+        ON CONFLICT (id_tipo, nome_grupo) DO NOTHING
+        RETURNING id_tipo, nome_grupo, id_grupo;
+        """
+        self._inserir_pares(conn, sql, chaves, self.grupo,
+                            "SELECT id_tipo, nome_grupo, id_grupo FROM dim_grupo "
+                            "WHERE (id_tipo, nome_grupo) IN "
+                            "(SELECT * FROM unnest(CAST(:ids AS INT[]), CAST(:nomes AS TEXT[])))")
+
+    def _inserir_categoria(self, conn: Connection, chaves: list) -> None:
+        sql = """
+        INSERT INTO dim_categoria (id_grupo, nome_categoria)
+        SELECT * FROM unnest(CAST(:ids AS INT[]), CAST(:nomes AS TEXT[]))
+        ON CONFLICT (id_grupo, nome_categoria) DO NOTHING
+        RETURNING id_grupo, nome_categoria, id_categoria;
+        """
+        self._inserir_pares(conn, sql, chaves, self.categoria,
+                            "SELECT id_grupo, nome_categoria, id_categoria FROM dim_categoria "
+                            "WHERE (id_grupo, nome_categoria) IN "
+                            "(SELECT * FROM unnest(CAST(:ids AS INT[]), CAST(:nomes AS TEXT[])))")
+
+    @staticmethod
+    def _inserir_pares(conn: Connection, sql: str, chaves: list, mapa: dict, sql_busca: str) -> None:
+        params = {"ids": [int(k[0]) for k in chaves], "nomes": [k[1] for k in chaves]}
+        for pai, nome, id_ in conn.execute(text(sql), params):
+            mapa[(pai, nome)] = id_
+        faltando = [k for k in chaves if k not in mapa]
+        if faltando:
+            params = {"ids": [int(k[0]) for k in faltando], "nomes": [k[1] for k in faltando]}
+            for pai, nome, id_ in conn.execute(text(sql_busca), params):
+                mapa[(pai, nome)] = id_
+
+    def _inserir_tempo(self, conn: Connection, chaves: list) -> None:
+        """
+        Garante os meses fora do calendário pré-gerado. A chave é YYYYMM,
+        então não há id a descobrir: só é preciso que o mês exista.
+        """
+        sql = """
+        INSERT INTO dim_tempo (id_tempo, ano, mes, semana, data_inicio, data_fim)
+        SELECT m.id_tempo, m.id_tempo / 100, m.id_tempo % 100,
+               EXTRACT(WEEK FROM make_date(m.id_tempo / 100, m.id_tempo % 100, 1))::INT,
+               make_date(m.id_tempo / 100, m.id_tempo % 100, 1),
+               (make_date(m.id_tempo / 100, m.id_tempo % 100, 1) + INTERVAL '1 month - 1 day')::DATE
+        FROM unnest(CAST(:ids AS INT[])) AS m(id_tempo)
+        ON CONFLICT (ano, mes) DO NOTHING;
+        """
+        conn.execute(text(sql), {"ids": [int(k) for k in chaves]})
+        self.tempo.update({int(k): int(k) for k in chaves})
+
+    @staticmethod
+    def _mapear(chaves, mapa: dict, inserir, conn: Connection) -> np.ndarray:
+        """
+        Resolve os ids de uma dimensão para todas as linhas do lote:
+        fatoriza as chaves, insere só os valores distintos ainda ausentes
+        e espalha os ids de volta para as linhas pelos códigos.
+        Os ausentes são inseridos em ordem fixa (não na de aparição no
+        arquivo): cargas simultâneas com membros novos em comum travam as
+        chaves do índice único na mesma ordem e não entram em deadlock.
+        """
+        codigos, unicos = pd.factorize(chaves)
+        unicos = list(unicos)
+        ausentes = sorted((k for k in unicos if k not in mapa), key=str)
+        if ausentes:
+            inserir(conn, ausentes)
+        ids_unicos = np.array([mapa[k] for k in unicos], dtype="int64")
+        return ids_unicos[codigos]
+
+    def resolver(self, df: pd.DataFrame, engine: Engine | Connection) -> pd.DataFrame:
+        """
+        Acrescenta ao lote as colunas id_tipo, id_grupo, id_categoria,
+        id_classificacao e id_tempo, inserindo os membros de dimensão novos.
+        As chaves são resolvidas uma vez por combinação distinta das colunas
+        de dimensão e espalhadas para as linhas pelos códigos da combinação.
+        Recebendo uma Connection, os inserts entram na transação dela; quem
+        a abriu deve chamar limpar() se ela for desfeita.
+        """
+        codigos, primeiras = combinar_codigos(df, COLUNAS_CATEGORICAS)
+        distintas = df.iloc[primeiras][COLUNAS_CATEGORICAS].astype(object).reset_index(drop=True)
+
+        with self._lock:
+            try:
+                if isinstance(engine, Connection):
+                    self._resolver_em(engine, distintas)
+                else:
+                    with engine.begin() as conn:
+                        self._resolver_em(conn, distintas)
+            except Exception:
+                # Ids inseridos numa transação desfeita não podem ficar no cache
+                self.limpar()
+                raise
+
+        for coluna in ["id_tipo", "id_grupo", "id_categoria", "id_classificacao", "id_tempo"]:
+            df[coluna] = distintas[coluna].to_numpy()[codigos]
+        return df
+
+    def _resolver_em(self, conn: Connection, df: pd.DataFrame) -> None:
+        self._sincronizar(conn)
+
+        df["id_tipo"] = self._mapear(df["Tipo"], self.tipo, self._inserir_tipo, conn)
+        df["id_classificacao"] = self._mapear(
+            df["Classificação"], self.classificacao, self._inserir_classificacao, conn
+        )
+        df["id_grupo"] = self._mapear(
+            pd.MultiIndex.from_arrays([df["id_tipo"], df["Grupo"]]),
+            self.grupo, self._inserir_grupo, conn,
+        )
+        df["id_categoria"] = self._mapear(
+            pd.MultiIndex.from_arrays([df["id_grupo"], df["Categoria"]]),
+            self.categoria, self._inserir_categoria, conn,
+        )
+        df["id_tempo"] = self._mapear(chaves_tempo(df["Data"]), self.tempo, self._inserir_tempo, conn)
+
+    def membros_novos(self, df: pd.DataFrame, engine: Engine | Connection) -> dict:
+        """
+        Membros de dimensão que a carga do lote criaria, sem inserir nada:
+        as chaves distintas do lote são comparadas com os mapas do cache
+        (sincronizado com o banco). Grupos de um tipo novo e categorias de
+        um grupo novo também são novos.
+
+        :return: tabela da dimensão -> conjunto de chaves naturais novas
+        """
+        with self._lock:
+            if isinstance(engine, Connection):
+                self._sincronizar(engine)
+            else:
+                with engine.connect() as conn:
+                    self._sincronizar(conn)
+
+            grupos, categorias = set(), set()
+            for tipo, grupo, categoria in df[["Tipo", "Grupo", "Categoria"]].drop_duplicates().itertuples(index=False):
+                id_grupo = self.grupo.get((self.tipo.get(tipo), grupo))
+                if id_grupo is None:
+                    grupos.add((tipo, grupo))
+                if id_grupo is None or (id_grupo, categoria) not in self.categoria:
+                    categorias.add((tipo, grupo, categoria))
+
+            return {
+                "dim_tipo": {t for t in df["Tipo"].unique() if t not in self.tipo},
+                "dim_grupo": grupos,
+                "dim_categoria": categorias,
+                "dim_classificacao": {c for c in df["Classificação"].unique() if c not in self.classificacao},
+                "dim_tempo": {int(k) for k in pd.unique(chaves_tempo(df["Data"])) if int(k) not in self.tempo},
+            }
+
+
+# Cache compartilhado pelo processo (reaproveitado entre reruns do Streamlit)
+cache_dimensoes = CacheDimensoes()
+
+
+def resolver_chaves(df: pd.DataFrame, engine: Engine | Connection) -> pd.DataFrame:
+    """
+    Resolve as chaves substitutas das dimensões para o lote usando o cache do processo.
+    """
+    return cache_dimensoes.resolver(df, engine)
@@ -1,150 +1,790 @@
+"""
+ETL da staging para o DW (dimensões, fato e agregados mensais).
+
+Uso:
+    python etl.py --retomar 42    # retoma a carga 42 (etl_run) que falhou
+
+Fora da transação única, cada etapa e cada lote da fato grava um checkpoint
+(etl_checkpoint) junto com o próprio trabalho; retomar_etl continua a carga
+a partir do primeiro trecho pendente.
+"""
+import argparse
+import io
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+
 import pandas as pd
 
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import Connection, Engine
 from sqlalchemy import text
 from db import get_engine   # 👈 precisa desse import
+from agregados import atualizar_agregados
+from dimensoes import cache_dimensoes, resolver_chaves
+from checkpoints import Checkpoints
+from particoes import criar_particao_nova, garantir_particoes, trocar_particoes
+from metricas import (
+    MetricasExecucao, executar_sql, exportar_prometheus, registrar_inicio, registrar_linhas, salvar
+)
 from logger import get_logger
-from datetime import datetime
+from utils import COLUNAS_CATEGORICAS, chaves_tempo
 
 logger = get_logger(__name__)
 
-def load_staging(df: pd.DataFrame, engine: Engine, table_name: str = "staging_lancamentos") -> None:
+# Quantidade de linhas enviadas por COPY na carga da staging
+STAGING_CHUNK_SIZE = int(os.getenv("STAGING_CHUNK_SIZE", "50000"))
+
+# Tabelas de staging por carga: staging_run_<YYYYmmddHHMMSS>_<id>
+PREFIXO_STAGING = "staging_run_"
+
+# Idade a partir da qual uma staging por carga é considerada órfã
+HORAS_STAGING_ORFA = int(os.getenv("HORAS_STAGING_ORFA", "24"))
+
+# Capturar EXPLAIN (ANALYZE, BUFFERS) das etapas SQL por padrão
+CAPTURAR_PLANOS = os.getenv("ETL_EXPLAIN", "0") == "1"
+
+# Páginas (8 kB) da staging por lote da fato nas cargas com checkpoint;
+# cada lote lê só a sua faixa de ctid (TID Range Scan)
+ETL_LOTE_FATO_PAGINAS = int(os.getenv("ETL_LOTE_FATO_PAGINAS", "4096"))
+
+
+@contextmanager
+def transacao(engine: Engine | Connection):
+    """
+    Abre uma transação na engine ou reaproveita a conexão recebida.
+    Com uma Connection o commit fica a cargo de quem a abriu, o que permite
+    executar vários passos do ETL numa única transação.
+    """
+    if isinstance(engine, Connection):
+        yield engine
+    else:
+        with engine.begin() as conn:
+            yield conn
+
+
+def _tipo_coluna_staging(coluna: str, dtype) -> str:
+    """
+    Define o tipo Postgres de cada coluna da staging.
+    'valor_centavos' (int64) vira BIGINT; um 'Valor' decimal legado mantém
+    NUMERIC(15,2); 'id_hash' (md5 em hex) vira UUID, os 16 bytes do digest,
+    como na fato; demais colunas seguem o dtype do pandas.
+    """
+    if coluna == "Valor":
+        return "NUMERIC(15,2)"
+    if coluna == "id_hash":
+        return "UUID"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "BIGINT"
+    if pd.api.types.is_float_dtype(dtype):
+        return "DOUBLE PRECISION"
+    return "TEXT"
+
+
+def nova_staging() -> str:
+    """
+    Gera o nome de uma tabela de staging exclusiva para uma carga.
+    O prefixo com data e hora permite descartar tabelas órfãs (ver limpar_stagings_orfas).
+    """
+    return f"{PREFIXO_STAGING}{datetime.now():%Y%m%d%H%M%S}_{uuid.uuid4().hex[:8]}"
+
+
+def criar_staging(cur, df: pd.DataFrame, table_name: str = "staging_lancamentos") -> None:
+    """
+    (Re)cria a tabela de staging com as colunas do DataFrame.
+    A tabela é UNLOGGED: é descartável e não precisa passar pelo WAL.
+    """
+    colunas = ", ".join(
+        f'"{coluna}" {_tipo_coluna_staging(coluna, dtype)}'
+        for coluna, dtype in df.dtypes.items()
+    )
+    cur.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+    cur.execute(f'CREATE UNLOGGED TABLE "{table_name}" ({colunas})')
+
+
+def copiar_staging(
+    cur,
+    df: pd.DataFrame,
+    table_name: str = "staging_lancamentos",
+    chunk_size: int = STAGING_CHUNK_SIZE,
+) -> None:
+    """
+    Envia o DataFrame para a staging via COPY FROM STDIN, em blocos de
+    `chunk_size` linhas serializados em CSV num buffer em memória.
+    """
+    nomes = ", ".join(f'"{coluna}"' for coluna in df.columns)
+    copy_sql = f'COPY "{table_name}" ({nomes}) FROM STDIN WITH (FORMAT csv)'
+
+    for inicio in range(0, len(df), chunk_size):
+        buffer = io.StringIO()
+        df.iloc[inicio:inicio + chunk_size].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cur.copy_expert(copy_sql, buffer)
+
+
+def load_staging(
+    df: pd.DataFrame,
+    engine: Engine | Connection,
+    table_name: str = "staging_lancamentos",
+    chunk_size: int = STAGING_CHUNK_SIZE,
+    if_exists: str = "replace",
+) -> None:
     """
-    Carrega DataFrame em tabela de staging no Postgres.
-    Se a tabela não existir, será criada automaticamente.
+    Carrega DataFrame em tabela de staging no Postgres usando COPY FROM STDIN.
+    Com if_exists="replace" a tabela é recriada; com "append" os dados são
+    acrescentados à staging existente. Recebendo uma Connection, a carga
+    entra na transação dela e não é confirmada aqui.
     """
-    df.to_sql(table_name, engine, if_exists="replace", index=False)
+    if isinstance(engine, Connection):
+        with engine.connection.cursor() as cur:
+            if if_exists == "replace":
+                criar_staging(cur, df, table_name)
+            copiar_staging(cur, df, table_name, chunk_size)
+        registrar_linhas(len(df))
+        logger.info(f"{len(df)} registros inseridos na tabela {table_name}")
+        return
+
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            if if_exists == "replace":
+                criar_staging(cur, df, table_name)
+            copiar_staging(cur, df, table_name, chunk_size)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
+    registrar_linhas(len(df))
     logger.info(f"{len(df)} registros inseridos na tabela {table_name}")
 
-def load_dim_tempo(engine: Engine, df: pd.DataFrame):
+
+def sem_nomes_dimensao(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Colunas de um lote já chaveado (dimensoes.resolver_chaves) que vão para
+    a staging: a carga chaveada só lê os ids, a descrição, o valor e o hash,
+    então os nomes das dimensões não precisam ser serializados no COPY.
+    """
+    return df.drop(columns=[coluna for coluna in COLUNAS_CATEGORICAS if coluna in df.columns])
+
+
+def filtrar_novos(cur, df: pd.DataFrame) -> tuple:
     """
-    Popula a dim_tempo a partir da coluna 'data' (MM/YYYY).
+    Detecta, antes da staging, os registros do lote cujo id_hash já está na
+    fato: os hashes vão por COPY para uma tabela temporária e um único join
+    com fato_lancamento (pelo índice único de id_hash em cada partição)
+    devolve os existentes.
+    Só os novos seguem para o ETL; o ON CONFLICT da fato continua garantindo
+    a unicidade (ex.: cargas simultâneas).
+
+    :return: (DataFrame só com os registros novos, quantidade já existente)
     """
-    df_tempo = (
-        df["Data"]
-        .dropna()
-        .drop_duplicates()
-        .apply(lambda x: datetime.strptime(x, "%m/%Y"))
-        .to_frame(name="Data")
+    if df.empty:
+        return df, 0
+
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS hashes_lote (id_hash UUID) ON COMMIT DROP")
+    cur.execute("TRUNCATE hashes_lote")
+    buffer = io.StringIO()
+    df["id_hash"].to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cur.copy_expert("COPY hashes_lote (id_hash) FROM STDIN WITH (FORMAT csv)", buffer)
+    cur.execute("ANALYZE hashes_lote")
+
+    # Devolvidos no mesmo formato do DataFrame (hex sem hífens)
+    cur.execute(
+        "SELECT translate(h.id_hash::text, '-', '') FROM hashes_lote h "
+        "JOIN fato_lancamento f ON f.id_hash = h.id_hash"
     )
-    df_tempo["ano"] = df_tempo["Data"].dt.year
-    df_tempo["mes"] = df_tempo["Data"].dt.month
-    df_tempo["semana"] = df_tempo["Data"].dt.isocalendar().week
-    df_tempo["data_inicio"] = df_tempo["Data"].dt.to_period("M").dt.start_time
-    df_tempo["data_fim"] = df_tempo["Data"].dt.to_period("M").dt.end_time
+    existentes = df["id_hash"].isin([linha[0] for linha in cur.fetchall()])
 
-    df_tempo = df_tempo[["ano", "mes", "semana", "data_inicio", "data_fim"]]
+    total_existentes = int(existentes.sum())
+    if total_existentes:
+        df = df[~existentes].copy()
+    return df, total_existentes
 
-    df_tempo.to_sql("dim_tempo", engine, if_exists="append", index=False)
-    logger.info(f"{len(df_tempo)} registros inseridos em dim_tempo")
+# Chave YYYYMM da dim_tempo calculada a partir do texto 'MM/YYYY', sem TO_DATE
+SQL_CHAVE_TEMPO = """(substr(btrim(sl."Data"), 4, 4) || substr(btrim(sl."Data"), 1, 2))::INT"""
 
 
-def load_dim_tipo(engine: Engine):
+def load_dim_tempo(engine: Engine | Connection, table_name: str = "staging_lancamentos"):
+    """
+    Garante na dim_tempo os meses da staging que estejam fora do calendário
+    pré-gerado. Idempotente: meses existentes são ignorados pela chave (ano, mes).
+    """
+    sql = f"""
+    INSERT INTO dim_tempo (id_tempo, ano, mes, semana, data_inicio, data_fim)
+    SELECT
+        m.id_tempo,
+        m.id_tempo / 100,
+        m.id_tempo % 100,
+        EXTRACT(WEEK FROM make_date(m.id_tempo / 100, m.id_tempo % 100, 1))::INT,
+        make_date(m.id_tempo / 100, m.id_tempo % 100, 1),
+        (make_date(m.id_tempo / 100, m.id_tempo % 100, 1) + INTERVAL '1 month - 1 day')::DATE
+    FROM (
+        SELECT DISTINCT {SQL_CHAVE_TEMPO} AS id_tempo
+        FROM "{table_name}" sl
+        WHERE sl."Data" IS NOT NULL
+    ) m
+    ON CONFLICT (ano, mes) DO NOTHING;
+    """
+    with transacao(engine) as conn:
+        linhas = executar_sql(conn, sql)
+    logger.info(f"{linhas} registros inseridos em dim_tempo")
+    return linhas
+
+
+def load_dim_tipo(engine: Engine | Connection, table_name: str = "staging_lancamentos"):
     """
     Popula a dim_tipo a partir da staging, evitando duplicatas.
     """
-    sql = """
+    sql = f"""
     INSERT INTO dim_tipo (nome_tipo)
     SELECT DISTINCT sl."Tipo"
-    FROM staging_lancamentos sl
+    FROM "{table_name}" sl
     ON CONFLICT (nome_tipo) DO NOTHING;
     """
-    with engine.begin() as conn:
-        conn.execute(text(sql))
-    logger.info("dim_tipo populada com sucesso")
+    with transacao(engine) as conn:
+        linhas = executar_sql(conn, sql)
+    logger.info(f"dim_tipo populada com sucesso ({linhas} registros)")
+    return linhas
 
-def load_dim_classificacao(engine: Engine):
+def load_dim_classificacao(engine: Engine | Connection, table_name: str = "staging_lancamentos"):
     """
     Popula a dim_classificacao a partir da staging, evitando duplicatas.
     """
-    sql = """
+    sql = f"""
           INSERT INTO dim_classificacao (nome_classificacao)
           SELECT DISTINCT sl."Classificação"  -- Corrigido com ç e ã
-          FROM staging_lancamentos sl
+          FROM "{table_name}" sl
           WHERE sl."Classificação" IS NOT NULL -- Corrigido com ç e ã
               ON CONFLICT (nome_classificacao) DO NOTHING; \
           """
-    with engine.begin() as conn:
-        conn.execute(text(sql))
-    logger.info("dim_classificacao populada com sucesso")
+    with transacao(engine) as conn:
+        linhas = executar_sql(conn, sql)
+    logger.info(f"dim_classificacao populada com sucesso ({linhas} registros)")
+    return linhas
 
-def load_dim_grupo(engine: Engine):
+def load_dim_grupo(engine: Engine | Connection, table_name: str = "staging_lancamentos"):
     """
     Popula a dim_grupo vinculada à dim_tipo, evitando duplicatas.
     """
-    sql = """
+    sql = f"""
     INSERT INTO dim_grupo (id_tipo, nome_grupo)
     SELECT dt.id_tipo, sl."Grupo"
-    FROM staging_lancamentos sl
+    FROM "{table_name}" sl
     JOIN dim_tipo dt ON dt.nome_tipo = sl."Tipo"
     ON CONFLICT (id_tipo, nome_grupo) DO NOTHING;
     """
-    with engine.begin() as conn:
-        conn.execute(text(sql))
-    logger.info("dim_grupo populada com sucesso")
+    with transacao(engine) as conn:
+        linhas = executar_sql(conn, sql)
+    logger.info(f"dim_grupo populada com sucesso ({linhas} registros)")
+    return linhas
 
 
-def load_dim_categoria(engine: Engine):
+def load_dim_categoria(engine: Engine | Connection, table_name: str = "staging_lancamentos"):
     """
     Popula a dim_categoria vinculada à dim_grupo, evitando duplicatas.
     """
-    sql = """
+    sql = f"""
     INSERT INTO dim_categoria (id_grupo, nome_categoria)
     SELECT dg.id_grupo, sl."Categoria"
-    FROM staging_lancamentos sl
+    FROM "{table_name}" sl
     JOIN dim_tipo dt ON dt.nome_tipo = sl."Tipo"
     JOIN dim_grupo dg ON dg.nome_grupo = sl."Grupo" AND dg.id_tipo = dt.id_tipo
     ON CONFLICT (id_grupo, nome_categoria) DO NOTHING;
     """
-    with engine.begin() as conn:
-        conn.execute(text(sql))
-    logger.info("dim_categoria populada com sucesso")
+    with transacao(engine) as conn:
+        linhas = executar_sql(conn, sql)
+    logger.info(f"dim_categoria populada com sucesso ({linhas} registros)")
+    return linhas
+
+
+def _filtro_paginas(paginas: tuple | None) -> str:
+    """
+    Restringe a leitura da staging à faixa de páginas [inicial, final).
+    """
+    if paginas is None:
+        return ""
+    inicio, fim = paginas
+    return f"WHERE sl.ctid >= '({int(inicio)},0)'::tid AND sl.ctid < '({int(fim)},0)'::tid"
 
 
-def load_fato_lancamento(engine: Engine):
+def load_fato_lancamento(
+    engine: Engine | Connection,
+    table_name: str = "staging_lancamentos",
+    paginas: tuple | None = None,
+):
     """
     Popula a fato_lancamento usando as dimensões já carregadas.
-    Se já existir, ignora.
+    Se já existir, ignora. Com `paginas`, carrega só essa faixa da staging.
     """
 
-    sql = """
+    sql = f"""
           INSERT INTO fato_lancamento (id_tipo, id_grupo, id_categoria, id_tempo, id_classificacao, descricao, valor, id_hash)
           SELECT
               dt.id_tipo,
               dg.id_grupo,
               dc.id_categoria,
-              dtmp.id_tempo,
+              {SQL_CHAVE_TEMPO},
               cs.id_classificacao,
               sl."Descrição",
-              sl."Valor",
+              (sl.valor_centavos / 100.0)::NUMERIC(15,2),
               sl.id_hash
-          FROM staging_lancamentos sl
+          FROM "{table_name}" sl
                    JOIN dim_tipo dt ON dt.nome_tipo = sl."Tipo"
                    JOIN dim_grupo dg ON dg.nome_grupo = sl."Grupo" AND dg.id_tipo = dt.id_tipo
                    JOIN dim_categoria dc ON dc.nome_categoria = sl."Categoria" AND dc.id_grupo = dg.id_grupo
                    JOIN dim_classificacao cs ON cs.nome_classificacao = sl."Classificação" -- Corrigido com ç e ã
-                   JOIN dim_tempo dtmp ON dtmp.ano = EXTRACT(YEAR FROM TO_DATE(sl."Data", 'MM/YYYY'))
-              AND dtmp.mes = EXTRACT(MONTH FROM TO_DATE(sl."Data", 'MM/YYYY'))
-              ON CONFLICT (id_hash) DO NOTHING; \
+          {_filtro_paginas(paginas)}
+              ON CONFLICT (id_hash, id_tempo) DO NOTHING; \
           """
+    with transacao(engine) as conn:
+        linhas = executar_sql(conn, sql)
+    logger.info(f"fato_lancamento populada com sucesso ({linhas} registros)")
+    return linhas
+
+
+def load_fato_lancamento_chaveado(
+    engine: Engine | Connection,
+    table_name: str = "staging_lancamentos",
+    paginas: tuple | None = None,
+):
+    """
+    Popula a fato_lancamento a partir de uma staging que já traz as chaves
+    das dimensões (resolvidas pelo cache de dimensões), sem joins.
+    Se já existir, ignora. Com `paginas`, carrega só essa faixa da staging.
+    """
+    sql = f"""
+    INSERT INTO fato_lancamento (id_tipo, id_grupo, id_categoria, id_tempo, id_classificacao, descricao, valor, id_hash)
+    SELECT
+        sl.id_tipo,
+        sl.id_grupo,
+        sl.id_categoria,
+        sl.id_tempo,
+        sl.id_classificacao,
+        sl."Descrição",
+        (sl.valor_centavos / 100.0)::NUMERIC(15,2),
+        sl.id_hash
+    FROM "{table_name}" sl
+    {_filtro_paginas(paginas)}
+    ON CONFLICT (id_hash, id_tempo) DO NOTHING;
+    """
+    with transacao(engine) as conn:
+        linhas = executar_sql(conn, sql)
+    logger.info(f"{linhas} registros inseridos em fato_lancamento")
+    return linhas
+
+
+def load_fato_substituindo_meses(
+    engine: Engine | Connection,
+    metricas: MetricasExecucao,
+    table_name: str,
+    meses: list,
+    checkpoints: Checkpoints | None = None,
+) -> list:
+    """
+    Substitui por completo os meses presentes numa staging com chaves:
+    cada mês é carregado numa tabela lateral com a estrutura da partição e,
+    na mesma transação, as partições antigas são trocadas pelas novas
+    (ver particoes.trocar_particoes). Nada é apagado linha a linha. O
+    checkpoint da etapa é gravado junto com a troca.
+
+    :return: meses que já existiam na fato e foram substituídos
+    """
+    novas = {}
+    # Carga e troca na mesma transação: se o processo cair no meio, as tabelas
+    # laterais somem no rollback em vez de ficarem órfãs no banco
+    with transacao(engine) as conn:
+        with metricas.etapa("fato_lancamento"):
+            for mes in meses:
+                novas[mes] = criar_particao_nova(conn, mes)
+                executar_sql(conn, f"""
+                INSERT INTO "{novas[mes]}" (id_tipo, id_grupo, id_categoria, id_tempo, id_classificacao, descricao, valor, id_hash)
+                SELECT
+                    sl.id_tipo,
+                    sl.id_grupo,
+                    sl.id_categoria,
+                    sl.id_tempo,
+                    sl.id_classificacao,
+                    sl."Descrição",
+                    (sl.valor_centavos / 100.0)::NUMERIC(15,2),
+                    sl.id_hash
+                FROM "{table_name}" sl
+                WHERE sl.id_tempo = :mes
+                ON CONFLICT (id_hash, id_tempo) DO NOTHING;
+                """, {"mes": mes})
+                conn.execute(text(f'ANALYZE "{novas[mes]}"'))
+
+        with metricas.etapa("troca_particoes"):
+            substituidos = trocar_particoes(conn, novas)
+            if checkpoints is not None:
+                checkpoints.registrar(conn, "fato_lancamento")
+
+    logger.info(f"{len(meses)} meses carregados por troca de partição ({len(substituidos)} substituídos)")
+    return substituidos
+
+
+def meses_do_lote(df: pd.DataFrame) -> list:
+    """
+    Chaves YYYYMM dos meses de um lote preparado, pela mesma regra de SQL_CHAVE_TEMPO
+    (já calculadas em id_tempo pelo preparar; senão, a partir da Data).
+    """
+    chaves = df["id_tempo"].to_numpy() if "id_tempo" in df.columns else chaves_tempo(df["Data"])
+    return sorted(int(m) for m in pd.unique(chaves))
+
+
+def meses_da_staging(conn: Connection, table_name: str, staging_com_chaves: bool) -> list:
+    """
+    Chaves YYYYMM dos meses presentes na staging (partições e fatias dos agregados).
+    """
+    coluna = "sl.id_tempo" if staging_com_chaves else SQL_CHAVE_TEMPO
+    return list(conn.execute(text(f'SELECT DISTINCT {coluna} FROM "{table_name}" sl')).scalars())
+
+
+def drop_staging(engine: Engine | Connection, table_name: str) -> None:
+    """
+    Remove a tabela de staging de uma carga.
+    """
+    with transacao(engine) as conn:
+        conn.execute(text(f'DROP TABLE IF EXISTS "{table_name}"'))
+    logger.info(f"Staging {table_name} removida")
+
+
+def limpar_stagings_orfas(engine: Engine, horas: int = HORAS_STAGING_ORFA) -> None:
+    """
+    Remove stagings por carga mais antigas que `horas`, deixadas por
+    processos que caíram antes de descartá-las.
+    """
+    limite = f"{PREFIXO_STAGING}{datetime.now() - timedelta(hours=horas):%Y%m%d%H%M%S}"
     with engine.begin() as conn:
-        conn.execute(text(sql))
-    logger.info("fato_lancamento populada com sucesso")
+        tabelas = conn.execute(
+            text("SELECT tablename FROM pg_tables WHERE schemaname = current_schema() "
+                 "AND tablename LIKE :prefixo AND tablename < :limite"),
+            {"prefixo": PREFIXO_STAGING + "%", "limite": limite},
+        ).scalars().all()
+        for tabela in tabelas:
+            conn.execute(text(f'DROP TABLE IF EXISTS "{tabela}"'))
+    if tabelas:
+        logger.info(f"{len(tabelas)} stagings órfãs removidas")
+
+
+def _pular(metricas: MetricasExecucao, nome: str) -> None:
+    metricas.etapas_puladas.append(nome)
+    logger.info(f"Etapa {nome}: já concluída (checkpoint), pulada")
+
+
+def _executar_etapa(conn: Engine | Connection, metricas: MetricasExecucao, checkpoints: Checkpoints | None,
+                    nome: str, funcao, linhas: int | None = None) -> None:
+    """
+    Executa `funcao(conexao)` como uma etapa medida. Com checkpoints, uma
+    etapa já concluída é pulada e a conclusão (com `linhas`, se informado)
+    é gravada na mesma transação do trabalho da etapa.
+    """
+    if checkpoints is not None and checkpoints.concluida(nome):
+        _pular(metricas, nome)
+        return
+    with metricas.etapa(nome), transacao(conn) as c:
+        funcao(c)
+        if checkpoints is not None:
+            checkpoints.registrar(c, nome, linhas=linhas)
+
+
+def contar_staging(conn: Engine | Connection, table_name: str) -> int:
+    """
+    Linhas da staging (count(*)), guardadas no checkpoint "staging".
+    """
+    with transacao(conn) as c:
+        return c.execute(text(f'SELECT count(*) FROM "{table_name}"')).scalar()
+
+
+def _carregar_fato_em_lotes(conn: Engine | Connection, metricas: MetricasExecucao,
+                            checkpoints: Checkpoints | None, table_name: str, carregar) -> None:
+    """
+    Carrega a fato com `carregar(conexao, table_name, paginas)`. Com
+    checkpoints, a staging é percorrida em lotes de ETL_LOTE_FATO_PAGINAS
+    páginas, cada um na sua transação e com o seu checkpoint; numa retomada
+    os lotes concluídos não são lidos de novo.
+    """
+    if checkpoints is None:
+        with metricas.etapa("fato_lancamento"):
+            carregar(conn, table_name)
+        return
+    if checkpoints.concluida("fato_lancamento"):
+        _pular(metricas, "fato_lancamento")
+        return
+
+    with metricas.etapa("fato_lancamento"):
+        with transacao(conn) as c:
+            total = c.execute(
+                text("SELECT pg_relation_size(CAST(:tabela AS regclass)) / current_setting('block_size')::INT"),
+                {"tabela": f'"{table_name}"'},
+            ).scalar()
+        tamanho = checkpoints.paginas_por_lote("fato_lancamento", ETL_LOTE_FATO_PAGINAS)
+        lotes = list(enumerate(range(0, max(total, 1), tamanho), start=1))
+        pendentes = [(lote, inicio) for lote, inicio in lotes if not checkpoints.concluida("fato_lancamento", lote)]
+        if len(pendentes) < len(lotes):
+            logger.info(f"fato_lancamento: {len(lotes) - len(pendentes)} de {len(lotes)} lotes já concluídos")
+
+        for lote, inicio in pendentes:
+            paginas = (inicio, inicio + tamanho)
+            with transacao(conn) as c:
+                linhas = carregar(c, table_name, paginas)
+                checkpoints.registrar(c, "fato_lancamento", lote, paginas, linhas)
+        with transacao(conn) as c:
+            checkpoints.registrar(c, "fato_lancamento")
+
+
+def _executar_etapas(
+    conn: Engine | Connection,
+    metricas: MetricasExecucao,
+    df: pd.DataFrame | None,
+    staging_com_chaves: bool,
+    table_name: str,
+    deduplicar: bool = True,
+    substituir_meses: bool = False,
+    checkpoints: Checkpoints | None = None,
+) -> None:
+    if substituir_meses and df is None and not staging_com_chaves:
+        raise ValueError("substituir_meses exige uma staging com chaves (df ou staging_com_chaves=True)")
+
+    # Staging recebida pronta: o checkpoint guarda quantas linhas ela tem, para
+    # que retomar_etl perceba uma staging esvaziada (ex.: UNLOGGED após queda)
+    if checkpoints is not None and df is None and not checkpoints.concluida("staging"):
+        with transacao(conn) as c:
+            checkpoints.registrar(c, "staging", linhas=contar_staging(c, table_name))
+
+    # Na substituição o mês inteiro é recarregado, inclusive o que já existia
+    if df is not None and deduplicar and not substituir_meses:
+        with metricas.etapa("deduplicacao"), transacao(conn) as c, c.connection.cursor() as cur:
+            total = len(df)
+            df, metricas.registros_existentes = filtrar_novos(cur, df)
+            registrar_linhas(total)
+        metricas.registros_novos = len(df)
+        logger.info(f"{metricas.registros_novos} registros novos, {metricas.registros_existentes} já carregados")
+        if df.empty:
+            return
+
+    # Partições antes de qualquer insert nas dimensões (ver garantir_particoes)
+    with metricas.etapa("particoes"), transacao(conn) as c:
+        meses = meses_do_lote(df) if df is not None else meses_da_staging(c, table_name, staging_com_chaves)
+        if not substituir_meses:
+            registrar_linhas(len(garantir_particoes(c, meses)))
 
+    if df is not None:
+        with metricas.etapa("resolver_chaves"):
+            resolver_chaves(df, conn)
+            registrar_linhas(len(df))
+        _executar_etapa(conn, metricas, checkpoints, "staging",
+                        lambda c: load_staging(sem_nomes_dimensao(df), c, table_name), linhas=len(df))
+        staging_com_chaves = True
 
-def run_etl():
+    if substituir_meses:
+        if checkpoints is not None and checkpoints.concluida("fato_lancamento"):
+            _pular(metricas, "fato_lancamento")
+        else:
+            metricas.meses_substituidos = load_fato_substituindo_meses(
+                conn, metricas, table_name, meses, checkpoints
+            )
+    elif staging_com_chaves:
+        _carregar_fato_em_lotes(conn, metricas, checkpoints, table_name, load_fato_lancamento_chaveado)
+    else:
+        for nome, carregar_dimensao in [
+            ("dim_tempo", load_dim_tempo),
+            ("dim_tipo", load_dim_tipo),
+            ("dim_grupo", load_dim_grupo),
+            ("dim_categoria", load_dim_categoria),
+            ("dim_classificacao", load_dim_classificacao),
+        ]:
+            _executar_etapa(conn, metricas, checkpoints, nome, lambda c, f=carregar_dimensao: f(c, table_name))
+        _carregar_fato_em_lotes(conn, metricas, checkpoints, table_name, load_fato_lancamento)
+
+    # Só os meses desta carga; na transação única, junto com a fato
+    _executar_etapa(conn, metricas, checkpoints, "agregados_mensais", lambda c: atualizar_agregados(c, meses))
+
+
+def run_etl(
+    staging_com_chaves: bool = False,
+    df: pd.DataFrame | None = None,
+    transacao_unica: bool = False,
+    table_name: str | None = None,
+    descartar_staging: bool = False,
+    capturar_planos: bool = CAPTURAR_PLANOS,
+    deduplicar: bool = True,
+    substituir_meses: bool = False,
+    progresso=None,
+    retomada_de: int | None = None,
+) -> MetricasExecucao:
+    """
+    Executa o ETL a partir de uma tabela de staging.
+    - staging_com_chaves=True: as dimensões já foram resolvidas pelo cache
+      (dimensoes.resolver_chaves) e só a fato é carregada.
+    - df: lote já preparado; as chaves são resolvidas e uma staging exclusiva
+      desta carga é criada aqui mesmo, e descartada ao final.
+    - transacao_unica=True: staging, dimensões e fato rodam numa só conexão
+      e numa só transação; uma falha desfaz tudo. Sem ela, cada etapa e cada
+      lote da fato gravam checkpoint, e uma carga que falhou pode ser
+      retomada (retomar_etl); a staging é mantida para isso.
+    - table_name: staging a usar (padrão: staging_lancamentos); com
+      descartar_staging=True ela é removida ao final.
+    - capturar_planos=True: guarda o EXPLAIN (ANALYZE, BUFFERS) das etapas SQL.
+    - deduplicar=True: com df, descarta antes da staging os registros cujo
+      id_hash já está na fato (ver filtrar_novos).
+    - substituir_meses=True: os meses presentes no lote passam a conter
+      exatamente os registros dele (correções de valor não geram duplicatas);
+      a troca é atômica, por partição (ver load_fato_substituindo_meses).
+    - progresso: função chamada com (etapa, linhas) no início e no fim de
+      cada etapa (ex.: jobs em segundo plano).
+    - retomada_de: execução original cujos checkpoints devem ser seguidos
+      (use retomar_etl).
+
+    A execução é gravada em etl_run/etl_run_stage e exportada para o
+    arquivo do Prometheus, com ou sem sucesso.
+
+    :return: métricas da execução (tempo, linhas e pico de memória por etapa)
+    """
     engine = get_engine()
-    df = pd.read_sql("SELECT * FROM staging_lancamentos", engine)
 
-    logger.info("Iniciando ETL...")
+    if table_name is None:
+        if df is not None:
+            table_name, descartar_staging = nova_staging(), True
+        else:
+            table_name = "staging_lancamentos"
+
+    if df is not None:
+        modo = "lote"
+    elif staging_com_chaves:
+        modo = "staging_chaveada"
+    else:
+        modo = "staging"
+    if substituir_meses:
+        modo += "_substituicao"
+    if retomada_de is not None:
+        modo += "_retomada"
+    metricas = MetricasExecucao(
+        staging=table_name,
+        modo=modo + ("_transacao_unica" if transacao_unica else ""),
+        explain=capturar_planos,
+        progresso=progresso,
+        retomada_de=retomada_de,
+    )
+
+    checkpoints = None
+    if not transacao_unica:
+        registrar_inicio(metricas, engine)
+        checkpoints = (
+            Checkpoints.carregar(engine, retomada_de) if retomada_de is not None
+            else Checkpoints(metricas.id_run)
+        )
+
+    logger.info(f"Iniciando ETL (staging {table_name})...")
+
+    try:
+        if transacao_unica:
+            with engine.begin() as conn:
+                _executar_etapas(conn, metricas, df, staging_com_chaves, table_name, deduplicar, substituir_meses)
+        else:
+            _executar_etapas(engine, metricas, df, staging_com_chaves, table_name, deduplicar, substituir_meses,
+                             checkpoints)
+        metricas.sucesso = True
+    except Exception as e:
+        # Membros de dimensão de uma transação desfeita não podem ficar no cache
+        cache_dimensoes.limpar()
+        metricas.erro = str(e)
+        raise
+    finally:
+        # Com checkpoints, a staging já gravada fica para a retomada (ou para limpar_stagings_orfas)
+        retomavel = (
+            checkpoints is not None and not metricas.sucesso
+            and (df is None or checkpoints.concluida("staging"))
+        )
+        if descartar_staging and not retomavel:
+            drop_staging(engine, table_name)
+        elif retomavel:
+            logger.warning(f"Staging {table_name} mantida: retome com retomar_etl({checkpoints.id_run})")
+        metricas.finalizado_em = datetime.now()
+        salvar(metricas, engine)
+        exportar_prometheus(metricas)
+
+    logger.info(f"ETL concluído com sucesso em {metricas.total_segundos:.2f}s!")
+    return metricas
+
+
+def retomar_etl(id_run: int, descartar_staging: bool | None = None, progresso=None) -> MetricasExecucao:
+    """
+    Retoma uma carga que falhou fora da transação única: as etapas e os lotes
+    da fato com checkpoint são pulados e a execução continua no primeiro
+    trecho pendente, com a mesma staging. O que for refeito é idempotente
+    (dimensões e fato com ON CONFLICT). Aceita o id da execução original ou
+    de qualquer retomada dela; não retome uma execução ainda em andamento.
+    Por padrão, ao final só são descartadas as stagings exclusivas da carga
+    (staging_run_*), não a staging_lancamentos compartilhada.
+    """
+    engine = get_engine()
+    with engine.connect() as conn:
+        execucao = conn.execute(
+            text("""
+            SELECT r.status, o.id_run AS original, o.modo, o.staging,
+                   to_regclass(quote_ident(o.staging)) IS NOT NULL AS staging_existe,
+                   EXISTS (SELECT 1 FROM etl_checkpoint c
+                           WHERE c.id_run = o.id_run AND c.etapa = 'staging') AS staging_gravada,
+                   (SELECT c.linhas FROM etl_checkpoint c
+                    WHERE c.id_run = o.id_run AND c.etapa = 'staging' AND c.lote = 0) AS linhas_staging,
+                   EXISTS (SELECT 1 FROM etl_run x
+                           WHERE COALESCE(x.retomada_de, x.id_run) = o.id_run AND x.status = 'sucesso') AS concluida
+            FROM etl_run r
+            JOIN etl_run o ON o.id_run = COALESCE(r.retomada_de, r.id_run)
+            WHERE r.id_run = :id_run
+            """),
+            {"id_run": id_run},
+        ).mappings().first()
+
+    if execucao is None:
+        raise ValueError(f"Execução {id_run} não encontrada")
+    if execucao["concluida"]:
+        raise ValueError(f"A carga {execucao['original']} já terminou com sucesso: nada a retomar")
+    modo = execucao["modo"]
+    if modo.endswith("_transacao_unica"):
+        raise ValueError(f"A execução {id_run} rodou numa transação única, desfeita na falha: carregue de novo")
+    if modo.startswith("lote") and not execucao["staging_gravada"]:
+        raise ValueError(f"A execução {id_run} falhou antes de gravar a staging: carregue o arquivo de novo")
+    if not execucao["staging_existe"]:
+        raise ValueError(f"A staging {execucao['staging']} da execução {id_run} não existe mais")
+    # Tabelas UNLOGGED continuam existindo, mas vazias, após a recuperação de uma queda do Postgres
+    if execucao["linhas_staging"] is not None:
+        linhas = contar_staging(engine, execucao["staging"])
+        if linhas != execucao["linhas_staging"]:
+            raise ValueError(
+                f"A staging {execucao['staging']} tem {linhas} linhas, mas a execução {id_run} gravou "
+                f"{execucao['linhas_staging']} (esvaziada numa queda do banco?): carregue o arquivo de novo"
+            )
+
+    logger.info(f"Retomando a execução {execucao['original']} (staging {execucao['staging']})")
+    return run_etl(
+        staging_com_chaves=modo != "staging",
+        table_name=execucao["staging"],
+        descartar_staging=(
+            execucao["staging"].startswith(PREFIXO_STAGING) if descartar_staging is None else descartar_staging
+        ),
+        substituir_meses="_substituicao" in modo,
+        progresso=progresso,
+        retomada_de=execucao["original"],
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="ETL da staging para o DW.")
+    parser.add_argument("--retomar", type=int, metavar="ID_RUN", required=True,
+                        help="retoma uma carga que falhou (id_run em etl_run)")
+    args = parser.parse_args(argv)
 
-    load_dim_tempo(engine, df)   # precisa do df
-    load_dim_tipo(engine)        # não precisa
-    load_dim_grupo(engine)       # não precisa
-    load_dim_categoria(engine)   # não precisa
-    load_dim_classificacao(engine)
-    load_fato_lancamento(engine) # não precisa
+    metricas = retomar_etl(args.retomar)
+    puladas = ", ".join(metricas.etapas_puladas) or "nenhuma"
+    print(f"Carga retomada em {metricas.total_segundos:.2f}s (etapas já concluídas: {puladas})")
+    return 0
 
-    logger.info("ETL concluído com sucesso!")
 
+if __name__ == "__main__":
+    sys.exit(main())
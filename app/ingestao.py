@@ -0,0 +1,290 @@
+import io
+import os
+from dataclasses import dataclass, field
+from datetime import date
+
+import pandas as pd
+from openpyxl import load_workbook
+from sqlalchemy.engine import Engine
+
+from dimensoes import resolver_chaves
+from etl import criar_staging, copiar_staging, filtrar_novos, nova_staging, sem_nomes_dimensao
+from logger import get_logger
+from utils import COLUNAS_CATEGORICAS, chaves_tempo, compactar, normalize_valor, gerar_hashes, valor_canonico
+from validacao import CAMPOS_OBRIGATORIOS, ResultadoValidacao, validar
+
+logger = get_logger(__name__)
+
+# Linhas lidas do CSV (ou da planilha) por bloco no modo streaming
+INGESTAO_CHUNK_SIZE = int(os.getenv("INGESTAO_CHUNK_SIZE", "100000"))
+
+# Formatos de upload aceitos, pela extensão do arquivo
+FORMATOS = {".csv": "csv", ".xlsx": "xlsx"}
+
+# Colunas de nomes: sempre texto, mesmo quando a planilha guarda um número
+COLUNAS_TEXTO = ["Descrição", "Tipo", "Grupo", "Categoria", "Classificação"]
+
+
+@dataclass
+class ResultadoIngestao:
+    registros: int = 0
+    existentes: int = 0   # já carregados na fato, descartados antes da staging
+    blocos: int = 0
+    tabela_staging: str = ""
+    campos_faltando: list = field(default_factory=list)
+    validacao: ResultadoValidacao = field(default_factory=ResultadoValidacao)
+
+    @property
+    def ok(self) -> bool:
+        return not self.campos_faltando and self.validacao.ok
+
+
+def ler_csv(arquivo, **kwargs):
+    """
+    Lê o CSV de upload (tratando decimal brasileiro), com as colunas de
+    baixa cardinalidade já categóricas (ver utils.compactar).
+    Valor é sempre lido como texto: sem isso o pandas infere o tipo da
+    coluna por bloco, e o mesmo lançamento teria id_hash (e validação)
+    diferentes lido inteiro ou em chunks.
+    Repassa kwargs ao pd.read_csv, por exemplo chunksize ou nrows.
+    """
+    dtype = {coluna: "category" for coluna in COLUNAS_CATEGORICAS}
+    dtype["Valor"] = str
+    dtype.update(kwargs.pop("dtype", {}))
+    return pd.read_csv(arquivo, sep=",", quotechar='"', decimal=",", dtype=dtype, **kwargs)
+
+
+def _texto_celula(valor):
+    """
+    Célula como o CSV a traria em texto: 10.0 vira "10"; vazias continuam vazias.
+    """
+    if valor is None or isinstance(valor, str) or pd.isna(valor):
+        return valor
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+
+def _tipar_bloco_xlsx(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Ajusta as células tipadas da planilha ao que a validação espera: datas
+    viram "MM/AAAA", os nomes (Tipo, Grupo, ...) viram texto mesmo em
+    células numéricas (Grupo 10 é "10", como no CSV) e uma coluna Valor só
+    com números vira numérica (os centavos saem direto do número).
+    As colunas de baixa cardinalidade ficam categóricas, como no ler_csv.
+    """
+    if "Data" in df.columns:
+        datas = df["Data"]
+        if pd.api.types.is_datetime64_any_dtype(datas):
+            df["Data"] = datas.dt.strftime("%m/%Y")
+        elif any(isinstance(v, date) for v in datas):
+            df["Data"] = [f"{v.month:02d}/{v.year}" if isinstance(v, date) else v for v in datas]
+    for coluna in COLUNAS_TEXTO:
+        if coluna in df.columns:
+            df[coluna] = [_texto_celula(v) for v in df[coluna]]
+    if "Valor" in df.columns and not any(isinstance(v, str) for v in df["Valor"]):
+        df["Valor"] = pd.to_numeric(df["Valor"])
+    return compactar(df)
+
+
+def _blocos_xlsx(arquivo, chunksize: int, nrows: int | None = None):
+    """
+    Lê as abas da planilha em modo somente leitura (streaming do openpyxl),
+    devolvendo DataFrames de até `chunksize` linhas. Abas sem os campos
+    obrigatórios no cabeçalho (resumos, gráficos) são ignoradas; linhas
+    totalmente vazias também. O índice segue contínuo entre blocos e abas,
+    como no read_csv em chunks.
+    """
+    planilha = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        inicio = 0
+        primeiro_cabecalho = None
+        for aba in planilha.worksheets:
+            linhas = aba.iter_rows(values_only=True)
+            cabecalho = next(linhas, None)
+            if cabecalho is None:
+                continue
+            cabecalho = ["" if c is None else str(c).strip() for c in cabecalho]
+            if primeiro_cabecalho is None:
+                primeiro_cabecalho = cabecalho
+            if verificar_campos(cabecalho):
+                logger.info(f"Aba '{aba.title}' ignorada: sem os campos obrigatórios")
+                continue
+
+            bloco = []
+            for linha in linhas:
+                if all(c is None for c in linha):
+                    continue
+                bloco.append(linha[:len(cabecalho)])
+                if len(bloco) == chunksize or (nrows is not None and inicio + len(bloco) == nrows):
+                    yield _tipar_bloco_xlsx(pd.DataFrame(bloco, columns=cabecalho,
+                                                         index=range(inicio, inicio + len(bloco))))
+                    inicio += len(bloco)
+                    bloco = []
+                    if nrows is not None and inicio == nrows:
+                        return
+            if bloco:
+                yield _tipar_bloco_xlsx(pd.DataFrame(bloco, columns=cabecalho,
+                                                     index=range(inicio, inicio + len(bloco))))
+                inicio += len(bloco)
+
+        # Nenhuma aba com dados válidos: devolve o cabeçalho para a verificação de campos
+        if inicio == 0:
+            yield pd.DataFrame(columns=primeiro_cabecalho or [])
+    finally:
+        planilha.close()
+
+
+def ler_xlsx(arquivo, chunksize: int | None = None, nrows: int | None = None):
+    """
+    Lê a planilha .xlsx de upload sem carregá-la inteira na memória.
+    Como no ler_csv: com chunksize devolve um iterador de blocos; sem ele,
+    um único DataFrame (limitado a nrows linhas, se informado).
+    """
+    if chunksize is not None:
+        return _blocos_xlsx(arquivo, chunksize, nrows)
+    if nrows == 0:
+        return next(_blocos_xlsx(arquivo, 1, 1)).iloc[0:0]
+    blocos = list(_blocos_xlsx(arquivo, INGESTAO_CHUNK_SIZE, nrows))
+    # Categorias diferentes entre blocos viram object no concat: recompacta
+    return blocos[0] if len(blocos) == 1 else compactar(pd.concat(blocos))
+
+
+def formato_arquivo(nome: str) -> str:
+    """
+    Formato do upload ("csv" ou "xlsx") pela extensão; CSV na dúvida.
+    """
+    return FORMATOS.get(os.path.splitext(nome.lower())[1], "csv")
+
+
+def ler_arquivo(arquivo, formato: str = "csv", **kwargs):
+    """
+    Lê um upload no formato informado; kwargs como em ler_csv (chunksize, nrows).
+    """
+    if formato == "xlsx":
+        return ler_xlsx(arquivo, **kwargs)
+    return ler_csv(arquivo, **kwargs)
+
+
+def verificar_campos(colunas) -> list:
+    """
+    Retorna os campos obrigatórios que não existem no arquivo.
+    """
+    return [campo for campo in CAMPOS_OBRIGATORIOS if campo not in colunas]
+
+
+def preparar(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Calcula o id_hash, a chave do mês (id_tempo, YYYYMM) e normaliza o Valor
+    de um bloco já validado. O Valor entra no hash no formato do CSV
+    exportado (ver valor_canonico), para que o mesmo lançamento tenha o
+    mesmo id_hash vindo de CSV ou de planilha.
+    """
+    compactar(df)
+    df["Valor"] = valores = df["Valor"].fillna("0")
+    df = normalize_valor(df)
+    df["id_hash"] = gerar_hashes(df, valor_canonico(valores, df["valor_centavos"]))
+    df["id_tempo"] = chaves_tempo(df["Data"])
+    return df
+
+
+def preparar_upload(conteudo: bytes, formato: str = "csv") -> tuple:
+    """
+    Lê, valida e (se válido) prepara um upload inteiro a partir dos bytes.
+    Usada como função de preparo do cache de uploads.
+
+    :return: (ResultadoValidacao, DataFrame preparado ou None se inválido)
+    """
+    df = ler_arquivo(io.BytesIO(conteudo), formato)
+    validacao = validar(df)
+    return validacao, (preparar(df) if validacao.ok else None)
+
+
+def estimar_linhas(conteudo: bytes, formato: str = "csv") -> int:
+    """
+    Número aproximado de registros do upload (para barras de progresso):
+    linhas do CSV ou, na planilha, as dimensões declaradas de cada aba.
+    """
+    if formato != "xlsx":
+        return max(conteudo.count(b"\n") - 1, 0)
+    planilha = load_workbook(io.BytesIO(conteudo), read_only=True)
+    try:
+        return sum(max((aba.max_row or 1) - 1, 0) for aba in planilha.worksheets)
+    finally:
+        planilha.close()
+
+
+def ingerir_em_blocos(
+    arquivo,
+    engine: Engine,
+    chunk_size: int = INGESTAO_CHUNK_SIZE,
+    table_name: str | None = None,
+    deduplicar: bool = True,
+    progresso=None,
+    formato: str = "csv",
+) -> ResultadoIngestao:
+    """
+    Lê o CSV (ou a planilha .xlsx, em modo somente leitura) em blocos de
+    `chunk_size` linhas e, para cada bloco, valida,
+    gera o hash, normaliza o valor, descarta os registros já carregados,
+    resolve as chaves das dimensões e envia para a staging via COPY (pronta para run_etl(staging_com_chaves=True)).
+    Sem `table_name`, cada chamada usa uma staging exclusiva, informada em
+    resultado.tabela_staging, para que cargas simultâneas não se misturem.
+    Com deduplicar=False todos os registros vão para a staging (necessário
+    para run_etl(substituir_meses=True)). Apenas um bloco fica em memória
+    por vez; toda a carga ocorre numa única transação, desfeita se algum
+    bloco tiver registros inválidos. `progresso`, se informada, é chamada
+    com ("ingestao", linhas lidas) a cada bloco.
+    """
+    resultado = ResultadoIngestao(tabela_staging=table_name or nova_staging())
+    table_name = resultado.tabela_staging
+    staging_criada = False
+
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            for bloco in ler_arquivo(arquivo, formato, chunksize=chunk_size):
+                resultado.blocos += 1
+
+                if resultado.blocos == 1:
+                    resultado.campos_faltando = verificar_campos(bloco.columns)
+                    if resultado.campos_faltando:
+                        break
+
+                validar(bloco, resultado.validacao)
+                if progresso is not None:
+                    progresso("ingestao", resultado.validacao.registros)
+                # Com algum erro a carga será desfeita: só continua validando
+                if not resultado.validacao.ok:
+                    continue
+
+                bloco = preparar(bloco)
+                if deduplicar:
+                    bloco, existentes = filtrar_novos(cur, bloco)
+                    resultado.existentes += existentes
+                if bloco.empty:
+                    continue
+
+                bloco = sem_nomes_dimensao(resolver_chaves(bloco, engine))
+                if not staging_criada:
+                    criar_staging(cur, bloco, table_name)
+                    staging_criada = True
+                copiar_staging(cur, bloco, table_name)
+                resultado.registros += len(bloco)
+
+        if resultado.ok:
+            conn.commit()
+        else:
+            conn.rollback()
+            resultado.registros = 0
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    logger.info(
+        f"Ingestão em blocos: {resultado.registros} registros novos em {resultado.blocos} blocos "
+        f"({resultado.existentes} já carregados, {resultado.validacao.registros_invalidos} com erro)"
+    )
+    return resultado
@@ -0,0 +1,159 @@
+"""
+Ingestão em lote, sem o Streamlit.
+
+Uso:
+    python ingestao_lote.py dados/2023/            # todos os .csv e .xlsx do diretório
+    python ingestao_lote.py "dados/*/2024-*.csv" --workers 4
+    python ingestao_lote.py dados/2024-03.csv --substituir-meses   # reenvio com correções
+
+Os arquivos são lidos, validados, têm o hash gerado e o valor normalizado em
+paralelo num pool de processos. Os lotes prontos passam por um único estágio
+de carga (staging exclusiva + run_etl) com no máximo --fila lotes aguardando.
+Termina com status 1 se algum arquivo falhar.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def listar_arquivos(entradas: list) -> list:
+    """
+    Expande diretórios (todos os .csv e .xlsx dentro deles) e padrões glob.
+    """
+    arquivos = []
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            arquivos.extend(glob.glob(os.path.join(entrada, "*.csv")))
+            arquivos.extend(glob.glob(os.path.join(entrada, "*.xlsx")))
+        else:
+            arquivos.extend(glob.glob(entrada))
+    return sorted(set(arquivos))
+
+
+def preparar_arquivo(caminho: str) -> dict:
+    """
+    Executado nos processos do pool: lê, valida e prepara um arquivo.
+    Nunca lança exceção; o erro volta no resultado.
+    """
+    # Import local: o trabalho pesado (pandas) fica nos processos filhos
+    from ingestao import formato_arquivo, ler_arquivo, verificar_campos, preparar
+    from validacao import validar
+
+    inicio = time.perf_counter()
+    try:
+        formato = formato_arquivo(caminho)
+        df = ler_arquivo(caminho, formato)
+        campos_faltando = verificar_campos(df.columns)
+        if campos_faltando:
+            raise ValueError(f"campos obrigatórios não encontrados: {', '.join(campos_faltando)}")
+
+        validacao = validar(df)
+        if not validacao.ok:
+            regras = ", ".join(f"{r.regra}:{r.coluna}={r.registros}" for r in validacao.resumo().itertuples())
+            linhas = ", ".join(str(i) for i in validacao.amostra["registro"].head(10))
+            raise ValueError(f"{validacao.registros_invalidos} registros inválidos ({regras}; linhas {linhas}...)")
+
+        df = preparar(df)
+        return {"arquivo": caminho, "df": df, "erro": None, "preparo": time.perf_counter() - inicio}
+    except Exception as e:
+        return {"arquivo": caminho, "df": None, "erro": str(e), "preparo": time.perf_counter() - inicio}
+
+
+def carregar(resultado: dict, substituir_meses: bool = False) -> dict:
+    """
+    Estágio de carga, no processo principal: staging exclusiva + ETL numa transação.
+    """
+    from etl import run_etl
+
+    df = resultado.pop("df")
+    inicio = time.perf_counter()
+    try:
+        metricas = run_etl(df=df, transacao_unica=True, substituir_meses=substituir_meses)
+        resultado["registros"] = len(df)
+        resultado["novos"] = len(df) if substituir_meses else metricas.registros_novos
+    except Exception as e:
+        logger.exception(f"Erro ao carregar {resultado['arquivo']}")
+        resultado["erro"] = str(e)
+    resultado["carga"] = time.perf_counter() - inicio
+    return resultado
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ingestão em lote de planilhas CSV no DW.")
+    parser.add_argument("entradas", nargs="+", help="diretórios ou padrões glob de arquivos CSV")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2,
+                        help="processos de leitura/validação (padrão: número de CPUs)")
+    parser.add_argument("--fila", type=int, default=2,
+                        help="máximo de arquivos preparados aguardando a carga (limita a memória)")
+    parser.add_argument("--substituir-meses", action="store_true",
+                        help="recarrega por inteiro os meses de cada arquivo (troca de partição)")
+    args = parser.parse_args(argv)
+
+    arquivos = listar_arquivos(args.entradas)
+    if not arquivos:
+        logger.error("Nenhum arquivo CSV encontrado")
+        return 1
+
+    logger.info(f"{len(arquivos)} arquivos, {args.workers} workers")
+    inicio = time.perf_counter()
+    resultados = []
+    pendentes = iter(arquivos)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        # Mantém no máximo workers + fila arquivos em voo: preparados que
+        # ainda não foram carregados não se acumulam na memória
+        em_voo = set()
+        limite = args.workers + args.fila
+        for caminho in pendentes:
+            em_voo.add(pool.submit(preparar_arquivo, caminho))
+            if len(em_voo) >= limite:
+                break
+
+        while em_voo:
+            prontos, em_voo = wait(em_voo, return_when=FIRST_COMPLETED)
+            for futuro in prontos:
+                resultado = futuro.result()
+                proximo = next(pendentes, None)
+                if proximo is not None:
+                    em_voo.add(pool.submit(preparar_arquivo, proximo))
+
+                if resultado["erro"] is None:
+                    resultado = carregar(resultado, args.substituir_meses)
+                else:
+                    resultado.pop("df")
+                resultados.append(resultado)
+
+                if resultado["erro"] is None:
+                    tempo = resultado["preparo"] + resultado["carga"]
+                    logger.info(
+                        f"{resultado['arquivo']}: {resultado['registros']} registros "
+                        f"({resultado['novos']} novos), "
+                        f"preparo {resultado['preparo']:.2f}s, carga {resultado['carga']:.2f}s "
+                        f"({resultado['registros'] / tempo:,.0f} registros/s)"
+                    )
+                else:
+                    logger.error(f"{resultado['arquivo']}: {resultado['erro']}")
+
+    total = time.perf_counter() - inicio
+    registros = sum(r.get("registros", 0) for r in resultados)
+    falhas = [r for r in resultados if r["erro"] is not None]
+
+    print(f"\n{len(resultados) - len(falhas)}/{len(resultados)} arquivos carregados, "
+          f"{registros} registros em {total:.2f}s ({registros / total:,.0f} registros/s)")
+    if falhas:
+        print("Arquivos com falha:")
+        for r in falhas:
+            print(f"  {r['arquivo']}: {r['erro']}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
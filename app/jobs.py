@@ -0,0 +1,409 @@
+"""
+Fila de jobs do ETL, executados fora da thread do Streamlit.
+
+Uso:
+    python jobs.py                   # worker dedicado (roda até Ctrl+C)
+    python jobs.py --concorrencia 1
+
+Cada upload confirmado vira uma linha em etl_job e uma cópia do arquivo em
+ETL_JOBS_DIR. Um worker (thread dentro do Streamlit ou este script) reserva
+jobs pendentes com FOR UPDATE SKIP LOCKED, executa ingestão + run_etl e grava
+etapa e linhas processadas, que a página consulta para mostrar o progresso.
+Um job cujo upload já está preparado no cache do processo que o enfileirou
+só é reservado por esse processo durante CACHE_UPLOADS_TTL; depois disso
+(ou se ele cair), qualquer worker o executa lendo o arquivo.
+ETL_JOBS_CONCORRENCIA limita os jobs em execução ao mesmo tempo no banco,
+somando todos os workers. Jobs de um worker que caiu (sem heartbeat há mais
+de ETL_JOBS_TIMEOUT segundos) voltam para a fila, até ETL_JOBS_TENTATIVAS vezes.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from cache_uploads import CACHE_UPLOADS_TTL, cache_uploads, chave_conteudo
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Diretório das cópias dos uploads enquanto o job não termina
+ETL_JOBS_DIR = os.getenv("ETL_JOBS_DIR", "/tmp/loretto_jobs")
+
+# Jobs executando ao mesmo tempo, somando todos os workers
+ETL_JOBS_CONCORRENCIA = int(os.getenv("ETL_JOBS_CONCORRENCIA", "2"))
+
+# Intervalo (s) entre buscas por jobs pendentes e entre heartbeats
+ETL_JOBS_INTERVALO = float(os.getenv("ETL_JOBS_INTERVALO", "2"))
+
+# Sem heartbeat há mais que isto (s), o job é considerado abandonado
+ETL_JOBS_TIMEOUT = int(os.getenv("ETL_JOBS_TIMEOUT", "120"))
+
+# Execuções de um mesmo job antes de desistir
+ETL_JOBS_TENTATIVAS = int(os.getenv("ETL_JOBS_TENTATIVAS", "3"))
+
+COLUNAS_JOB = """
+    id_job, status, criado_em, iniciado_em, finalizado_em, arquivo, chave_conteudo, parametros,
+    tentativas, etapa, linhas_processadas, linhas_total, resultado, erro, id_run, enfileirado_por
+"""
+
+
+def nome_processo() -> str:
+    """
+    Identifica o processo nos jobs: worker que executa e processo que enfileirou.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enfileirar(engine: Engine, conteudo: bytes, substituir_meses: bool = False, formato: str = "csv") -> int:
+    """
+    Guarda o upload (CSV ou .xlsx) em ETL_JOBS_DIR e cria o job pendente.
+    Se o upload está preparado no cache deste processo, o job fica com este
+    processo (enfileirado_por) para reaproveitar o DataFrame.
+
+    :return: id do job
+    """
+    from ingestao import estimar_linhas
+
+    chave = chave_conteudo(conteudo)
+    os.makedirs(ETL_JOBS_DIR, exist_ok=True)
+    arquivo = os.path.join(ETL_JOBS_DIR, f"{chave}.{formato}")
+    if not os.path.exists(arquivo):
+        temporario = f"{arquivo}.{os.getpid()}.tmp"
+        with open(temporario, "wb") as f:
+            f.write(conteudo)
+        os.replace(temporario, arquivo)
+
+    upload = cache_uploads.obter(chave)
+    with engine.begin() as conn:
+        id_job = conn.execute(
+            text("""
+            INSERT INTO etl_job (arquivo, chave_conteudo, parametros, linhas_total, enfileirado_por)
+            VALUES (:arquivo, :chave, CAST(:parametros AS JSONB), :linhas_total, :enfileirado_por)
+            RETURNING id_job
+            """),
+            {
+                "arquivo": arquivo,
+                "chave": chave,
+                "enfileirado_por": nome_processo() if upload is not None and upload.df is not None else None,
+                "parametros": json.dumps({"substituir_meses": substituir_meses, "formato": formato}),
+                # Estimativa para a barra de progresso
+                "linhas_total": estimar_linhas(conteudo, formato),
+            },
+        ).scalar()
+    logger.info(f"Job {id_job} enfileirado ({arquivo})")
+    return id_job
+
+
+def obter_job(engine: Engine, id_job: int) -> dict | None:
+    """
+    Estado atual do job (consultado pela página para mostrar o progresso).
+    """
+    with engine.connect() as conn:
+        linha = conn.execute(text(f"SELECT {COLUNAS_JOB} FROM etl_job WHERE id_job = :id"), {"id": id_job})
+        linha = linha.mappings().first()
+    return dict(linha) if linha else None
+
+
+def recuperar_abandonados(engine: Engine, timeout: int = ETL_JOBS_TIMEOUT) -> int:
+    """
+    Devolve à fila os jobs cujo worker parou de dar sinal de vida; os que já
+    esgotaram as tentativas são marcados com erro. Como a carga é idempotente
+    (id_hash), reexecutar um job interrompido é seguro.
+
+    :return: jobs recolocados na fila
+    """
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+            UPDATE etl_job
+            SET status = 'erro', finalizado_em = now(),
+                erro = 'Job abandonado pelo worker após ' || tentativas || ' tentativas'
+            WHERE status = 'executando'
+              AND heartbeat_em < now() - make_interval(secs => :timeout)
+              AND tentativas >= :tentativas
+            """),
+            {"timeout": timeout, "tentativas": ETL_JOBS_TENTATIVAS},
+        )
+        recolocados = conn.execute(
+            text("""
+            UPDATE etl_job
+            SET status = 'pendente', worker = NULL, etapa = NULL, linhas_processadas = NULL,
+                enfileirado_por = NULL   -- o cache do processo que caiu se perdeu com ele
+            WHERE status = 'executando'
+              AND heartbeat_em < now() - make_interval(secs => :timeout)
+            """),
+            {"timeout": timeout},
+        ).rowcount
+    if recolocados:
+        logger.warning(f"{recolocados} jobs abandonados voltaram para a fila")
+    return recolocados
+
+
+def reservar(
+    engine: Engine,
+    worker: str,
+    concorrencia: int = ETL_JOBS_CONCORRENCIA,
+    ttl_cache: float = CACHE_UPLOADS_TTL,
+) -> dict | None:
+    """
+    Reserva o job pendente mais antigo, se houver vaga no limite de concorrência.
+    O lock consultivo serializa as reservas de todos os workers, para que a
+    contagem de jobs em execução não fique desatualizada entre eles.
+    Jobs enfileirados por outro processo há menos de `ttl_cache` segundos
+    ficam para ele, que tem o upload preparado no cache.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('etl_job_reserva'))"))
+        executando = conn.execute(text("SELECT count(*) FROM etl_job WHERE status = 'executando'")).scalar()
+        if executando >= concorrencia:
+            return None
+        job = conn.execute(
+            text(f"""
+            UPDATE etl_job
+            SET status = 'executando', worker = :worker, tentativas = tentativas + 1,
+                iniciado_em = now(), heartbeat_em = now(), erro = NULL
+            WHERE id_job = (
+                SELECT id_job FROM etl_job
+                WHERE status = 'pendente'
+                  AND (enfileirado_por IS NULL OR enfileirado_por = :worker
+                       OR criado_em < now() - make_interval(secs => :ttl_cache))
+                ORDER BY id_job
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING {COLUNAS_JOB}
+            """),
+            {"worker": worker, "ttl_cache": ttl_cache},
+        ).mappings().first()
+    return dict(job) if job else None
+
+
+def _atualizar(engine: Engine, id_job: int, finalizar: bool = False, **campos) -> None:
+    if "resultado" in campos:
+        campos["resultado"] = json.dumps(campos["resultado"])
+    atribuicoes = ", ".join(
+        f"{c} = CAST(:{c} AS JSONB)" if c == "resultado" else f"{c} = :{c}" for c in campos
+    )
+    if finalizar:
+        atribuicoes += ", finalizado_em = now()"
+    with engine.begin() as conn:
+        conn.execute(
+            text(f"UPDATE etl_job SET {atribuicoes}, heartbeat_em = now() WHERE id_job = :id_job"),
+            {**campos, "id_job": id_job},
+        )
+
+
+def _registrar_invalidos(engine: Engine, id_job: int, validacao) -> None:
+    """
+    Encerra o job com erro de validação, guardando o resumo por regra e o
+    CSV completo dos registros inválidos para download na página.
+    """
+    arquivo_erros = os.path.join(ETL_JOBS_DIR, f"job_{id_job}_erros.csv")
+    with open(arquivo_erros, "wb") as f:
+        f.write(validacao.csv_erros())
+    resumo = validacao.resumo()
+    regras = ", ".join(f"{r.regra}:{r.coluna}={r.registros}" for r in resumo.itertuples())
+    _atualizar(
+        engine, id_job, finalizar=True, status="erro",
+        erro=f"{validacao.registros_invalidos} registros inválidos ({regras})",
+        resultado={"resumo_validacao": resumo.to_dict("records"), "arquivo_erros": arquivo_erros},
+    )
+
+
+def executar_job(engine: Engine, job: dict) -> None:
+    """
+    Executa um job reservado. Se o upload ainda está preparado no cache
+    deste processo, o DataFrame é carregado direto numa transação; senão o
+    arquivo é lido em blocos (ingerir_em_blocos) e a staging vai para o ETL.
+    """
+    from etl import run_etl
+    from ingestao import ingerir_em_blocos
+
+    id_job = job["id_job"]
+    substituir_meses = bool(job["parametros"].get("substituir_meses"))
+
+    def progresso(etapa, linhas):
+        try:
+            campos = {"etapa": etapa}
+            # Só a ingestão conta linhas do arquivo; nas etapas do ETL vale o nome
+            if etapa == "ingestao" and linhas is not None:
+                campos["linhas_processadas"] = linhas
+            _atualizar(engine, id_job, **campos)
+        except Exception:
+            # Progresso nunca derruba a carga
+            logger.exception(f"Não foi possível atualizar o progresso do job {id_job}")
+
+    try:
+        upload = cache_uploads.obter(job["chave_conteudo"]) if job["chave_conteudo"] else None
+        if upload is not None and upload.df is not None:
+            # Já validado e preparado na página: todas as linhas estão prontas
+            _atualizar(engine, id_job, linhas_processadas=len(upload.df), linhas_total=len(upload.df))
+            metricas = run_etl(
+                df=upload.df.copy(deep=False),
+                transacao_unica=True,
+                substituir_meses=substituir_meses,
+                progresso=progresso,
+            )
+            resultado = {"registros": len(upload.df)}
+        else:
+            ingestao = ingerir_em_blocos(
+                job["arquivo"], engine, deduplicar=not substituir_meses, progresso=progresso,
+                formato=job["parametros"].get("formato", "csv"),
+            )
+            if ingestao.campos_faltando:
+                raise ValueError(f"campos obrigatórios não encontrados: {', '.join(ingestao.campos_faltando)}")
+            if not ingestao.validacao.ok:
+                _registrar_invalidos(engine, id_job, ingestao.validacao)
+                _remover_arquivo(engine, job["arquivo"])
+                return
+
+            resultado = {"registros": ingestao.registros, "existentes": ingestao.existentes}
+            metricas = None
+            if ingestao.registros:
+                metricas = run_etl(
+                    staging_com_chaves=True,
+                    table_name=ingestao.tabela_staging,
+                    descartar_staging=True,
+                    substituir_meses=substituir_meses,
+                    progresso=progresso,
+                )
+
+        if metricas is not None:
+            resultado["etapas"] = metricas.tempos
+            resultado["meses_substituidos"] = metricas.meses_substituidos
+            # Sem deduplicação no ETL (já feita na ingestão), as contagens ficam None
+            if metricas.registros_novos is not None:
+                resultado["registros_novos"] = metricas.registros_novos
+                resultado["registros_existentes"] = metricas.registros_existentes
+        if job["chave_conteudo"]:
+            cache_uploads.marcar_carregado(job["chave_conteudo"])
+        _atualizar(
+            engine, id_job, finalizar=True, status="sucesso", etapa="concluido",
+            resultado=resultado, id_run=metricas.id_run if metricas is not None else None,
+        )
+        logger.info(f"Job {id_job} concluído")
+        _remover_arquivo(engine, job["arquivo"])
+    except Exception as e:
+        logger.exception(f"Erro no job {id_job}")
+        _atualizar(engine, id_job, finalizar=True, status="erro", erro=str(e))
+
+
+def _remover_arquivo(engine: Engine, arquivo: str) -> None:
+    # A mesma cópia pode servir a outro job (upload idêntico) ainda não concluído
+    with engine.connect() as conn:
+        em_uso = conn.execute(
+            text("SELECT 1 FROM etl_job WHERE arquivo = :arquivo AND status IN ('pendente', 'executando') LIMIT 1"),
+            {"arquivo": arquivo},
+        ).first()
+    if not em_uso:
+        try:
+            os.remove(arquivo)
+        except OSError:
+            pass
+
+
+class WorkerJobs:
+    """
+    Worker em segundo plano: uma thread busca jobs pendentes e os executa
+    num pool de threads, mantendo o heartbeat dos jobs em andamento.
+    """
+
+    def __init__(self, engine: Engine, concorrencia: int = ETL_JOBS_CONCORRENCIA,
+                 intervalo: float = ETL_JOBS_INTERVALO):
+        self.engine = engine
+        self.concorrencia = concorrencia
+        self.intervalo = intervalo
+        self.nome = nome_processo()
+        self._pool = ThreadPoolExecutor(max_workers=concorrencia, thread_name_prefix="etl-job")
+        self._em_execucao = set()
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._laco, name="etl-job-worker", daemon=True)
+
+    def iniciar(self) -> "WorkerJobs":
+        self._thread.start()
+        logger.info(f"Worker de jobs {self.nome} iniciado (concorrência {self.concorrencia})")
+        return self
+
+    def parar(self, aguardar: bool = True) -> None:
+        self._parar.set()
+        self._thread.join()
+        self._pool.shutdown(wait=aguardar)
+
+    def _executar(self, job: dict) -> None:
+        try:
+            executar_job(self.engine, job)
+        finally:
+            with self._lock:
+                self._em_execucao.discard(job["id_job"])
+
+    def _heartbeat(self) -> None:
+        with self._lock:
+            ids = list(self._em_execucao)
+        if ids:
+            with self.engine.begin() as conn:
+                conn.execute(
+                    text("UPDATE etl_job SET heartbeat_em = now() WHERE id_job = ANY(:ids)"), {"ids": ids}
+                )
+
+    def _laco(self) -> None:
+        while not self._parar.is_set():
+            try:
+                self._heartbeat()
+                recuperar_abandonados(self.engine)
+                while True:
+                    with self._lock:
+                        if len(self._em_execucao) >= self.concorrencia:
+                            break
+                    job = reservar(self.engine, self.nome, self.concorrencia)
+                    if job is None:
+                        break
+                    with self._lock:
+                        self._em_execucao.add(job["id_job"])
+                    self._pool.submit(self._executar, job)
+            except Exception:
+                logger.exception("Erro no laço do worker de jobs")
+            self._parar.wait(self.intervalo)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def iniciar_worker(engine: Engine) -> WorkerJobs:
+    """
+    Worker único por processo (o Streamlit chama a cada rerun).
+    """
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = WorkerJobs(engine).iniciar()
+        return _worker
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Worker da fila de jobs do ETL.")
+    parser.add_argument("--concorrencia", type=int, default=ETL_JOBS_CONCORRENCIA,
+                        help="jobs executando ao mesmo tempo no banco (todos os workers)")
+    args = parser.parse_args(argv)
+
+    from db import get_engine
+    worker = WorkerJobs(get_engine(), concorrencia=args.concorrencia).iniciar()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        logger.info("Encerrando worker: aguardando jobs em andamento...")
+        worker.parar()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
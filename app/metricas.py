@@ -0,0 +1,400 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable
+from uuid import uuid4
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Arquivo no formato texto do Prometheus (node_exporter textfile collector)
+PROMETHEUS_ARQUIVO = os.getenv("ETL_PROMETHEUS_ARQUIVO", "/tmp/loretto_etl.prom")
+
+# Pico de memória por etapa:
+# - "rss": pico de memória residente do processo (Linux, custo desprezível)
+# - "tracemalloc": pico de alocações Python (mais preciso, deixa etapas pandas bem mais lentas)
+# - "0": não mede
+MEDIR_MEMORIA = os.getenv("ETL_MEDIR_MEMORIA", "rss")
+
+# Etapa em execução, para que o SQL executado registre linhas e planos nela
+_etapa_atual: ContextVar = ContextVar("etapa_atual", default=None)
+
+
+def _reiniciar_pico_rss() -> bool:
+    """
+    Zera o pico de RSS do processo (VmHWM). Disponível no Linux.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _pico_rss() -> int | None:
+    try:
+        with open("/proc/self/status") as f:
+            for linha in f:
+                if linha.startswith("VmHWM:"):
+                    return int(linha.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+# O pico (VmHWM ou o do tracemalloc) é um só para o processo inteiro. Com
+# etapas simultâneas (worker de jobs com ETL_JOBS_CONCORRENCIA > 1), ele só é
+# zerado quando nenhuma outra medição está em andamento; as demais não o
+# zeram, e o tracemalloc só é desligado ao fim da última medição.
+_lock_memoria = threading.Lock()
+_medicoes_ativas = 0
+_tracemalloc_nosso = False
+
+
+class _MedidorMemoria:
+    """
+    Mede o pico de memória de um trecho conforme ETL_MEDIR_MEMORIA. Com
+    outras etapas medindo ao mesmo tempo no processo, o valor é o pico do
+    processo desde o início da medição mais antiga ainda ativa (inclui a
+    memória das etapas concorrentes).
+    """
+
+    def __init__(self, modo: str = MEDIR_MEMORIA):
+        self.modo = modo
+        self._ativo = False
+
+    def iniciar(self) -> None:
+        global _medicoes_ativas, _tracemalloc_nosso
+        if self.modo not in ("rss", "tracemalloc"):
+            return
+        with _lock_memoria:
+            if _medicoes_ativas == 0:
+                if self.modo == "rss":
+                    if not _reiniciar_pico_rss():
+                        self.modo = "0"
+                        return
+                else:
+                    if not tracemalloc.is_tracing():
+                        tracemalloc.start()
+                        _tracemalloc_nosso = True
+                    tracemalloc.reset_peak()
+            elif self.modo == "tracemalloc" and not tracemalloc.is_tracing():
+                # Medição concorrente em modo rss: o tracemalloc não está ligado
+                tracemalloc.start()
+                _tracemalloc_nosso = True
+            _medicoes_ativas += 1
+            self._ativo = True
+
+    def pico(self) -> int | None:
+        global _medicoes_ativas, _tracemalloc_nosso
+        if not self._ativo:
+            return None
+        with _lock_memoria:
+            pico = _pico_rss() if self.modo == "rss" else tracemalloc.get_traced_memory()[1]
+            _medicoes_ativas -= 1
+            self._ativo = False
+            if _medicoes_ativas == 0 and _tracemalloc_nosso:
+                tracemalloc.stop()
+                _tracemalloc_nosso = False
+        return pico
+
+
+@dataclass
+class Etapa:
+    nome: str
+    segundos: float = 0.0
+    linhas: int | None = None
+    memoria_pico_bytes: int | None = None
+    planos: list = field(default_factory=list)
+    explain: bool = False
+
+    def somar_linhas(self, linhas: int) -> None:
+        if linhas is not None and linhas >= 0:
+            self.linhas = (self.linhas or 0) + linhas
+
+
+@dataclass
+class MetricasExecucao:
+    staging: str = ""
+    modo: str = ""
+    explain: bool = False
+    iniciado_em: datetime = field(default_factory=datetime.now)
+    finalizado_em: datetime | None = None
+    sucesso: bool = False
+    erro: str | None = None
+    etapas: list = field(default_factory=list)
+    id_run: int | None = None
+    registros_novos: int | None = None        # lote após a deduplicação prévia
+    registros_existentes: int | None = None   # já carregados antes, descartados
+    meses_substituidos: list = field(default_factory=list)   # YYYYMM trocados por inteiro
+    retomada_de: int | None = None            # execução original, quando esta é uma retomada
+    etapas_puladas: list = field(default_factory=list)       # já concluídas (checkpoint)
+    # Chamado com (etapa, linhas) no início (linhas=None) e no fim de cada etapa
+    progresso: Callable | None = field(default=None, repr=False)
+
+    @property
+    def total_segundos(self) -> float:
+        return sum(e.segundos for e in self.etapas)
+
+    @property
+    def tempos(self) -> dict:
+        """
+        Tempo em segundos de cada etapa (e do total).
+        """
+        tempos = {e.nome: e.segundos for e in self.etapas}
+        tempos["total"] = self.total_segundos
+        return tempos
+
+    def como_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            "etapa": [e.nome for e in self.etapas],
+            "segundos": [round(e.segundos, 3) for e in self.etapas],
+            "linhas": [e.linhas for e in self.etapas],
+            "memoria_pico_mb": [
+                None if e.memoria_pico_bytes is None else round(e.memoria_pico_bytes / 1024 ** 2, 1)
+                for e in self.etapas
+            ],
+        })
+
+    @contextmanager
+    def etapa(self, nome: str):
+        """
+        Mede tempo e pico de memória de uma etapa. Linhas afetadas e planos
+        (EXPLAIN) são registrados por executar_sql enquanto ela roda.
+        """
+        etapa = Etapa(nome=nome, explain=self.explain)
+        self.etapas.append(etapa)
+
+        memoria = _MedidorMemoria()
+        memoria.iniciar()
+
+        if self.progresso is not None:
+            self.progresso(nome, None)
+
+        token = _etapa_atual.set(etapa)
+        inicio = time.perf_counter()
+        try:
+            yield etapa
+        finally:
+            etapa.segundos = time.perf_counter() - inicio
+            _etapa_atual.reset(token)
+            etapa.memoria_pico_bytes = memoria.pico()
+            linhas = "" if etapa.linhas is None else f", {etapa.linhas} linhas"
+            logger.info(f"Etapa {nome}: {etapa.segundos:.2f}s{linhas}")
+            if self.progresso is not None:
+                self.progresso(nome, etapa.linhas)
+
+
+def _linhas_do_plano(plano: dict) -> int | None:
+    """
+    Linhas afetadas segundo o EXPLAIN ANALYZE em JSON. Para INSERT ... ON
+    CONFLICT o Postgres informa 'Tuples Inserted'; nos demais casos usa-se
+    a quantidade de linhas produzidas para o nó de modificação.
+    """
+    raiz = plano.get("Plan", {})
+    if "Tuples Inserted" in raiz:
+        return int(raiz["Tuples Inserted"])
+    filhos = raiz.get("Plans") or []
+    if raiz.get("Node Type") == "ModifyTable" and filhos:
+        return int(filhos[0].get("Actual Rows", 0) * filhos[0].get("Actual Loops", 1))
+    return None
+
+
+def executar_sql(conn: Connection, sql: str, params: dict | None = None) -> int:
+    """
+    Executa um comando do ETL e registra as linhas afetadas na etapa atual.
+    Se a etapa pede EXPLAIN, o comando roda (uma única vez) via
+    EXPLAIN (ANALYZE, BUFFERS) e o plano fica guardado na etapa.
+
+    :return: linhas afetadas (rowcount do cursor)
+    """
+    etapa = _etapa_atual.get()
+
+    if etapa is not None and etapa.explain:
+        plano = conn.execute(text("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql), params or {}).scalar()
+        plano = plano[0] if isinstance(plano, list) else json.loads(plano)[0]
+        etapa.planos.append(plano)
+        linhas = _linhas_do_plano(plano)
+    else:
+        linhas = conn.execute(text(sql), params or {}).rowcount
+
+    if etapa is not None:
+        etapa.somar_linhas(linhas)
+    return linhas
+
+
+def registrar_linhas(linhas: int) -> None:
+    """
+    Soma linhas à etapa atual, para passos que não passam por executar_sql (ex.: COPY).
+    """
+    etapa = _etapa_atual.get()
+    if etapa is not None:
+        etapa.somar_linhas(linhas)
+
+
+def registrar_inicio(metricas: MetricasExecucao, engine: Engine) -> int:
+    """
+    Cria já no início a linha da execução em etl_run (status 'executando'),
+    para que os checkpoints das etapas tenham a que se referir. salvar()
+    completa a mesma linha ao final.
+    """
+    with engine.begin() as conn:
+        metricas.id_run = conn.execute(
+            text("""
+            INSERT INTO etl_run (iniciado_em, status, modo, staging, retomada_de)
+            VALUES (:iniciado_em, 'executando', :modo, :staging, :retomada_de)
+            RETURNING id_run
+            """),
+            {
+                "iniciado_em": metricas.iniciado_em,
+                "modo": metricas.modo,
+                "staging": metricas.staging,
+                "retomada_de": metricas.retomada_de,
+            },
+        ).scalar()
+    return metricas.id_run
+
+
+def salvar(metricas: MetricasExecucao, engine: Engine) -> None:
+    """
+    Grava a execução em etl_run/etl_run_stage, numa transação própria
+    (a execução é registrada mesmo quando o ETL falha).
+    """
+    parametros = {
+        "iniciado_em": metricas.iniciado_em,
+        "finalizado_em": metricas.finalizado_em,
+        "status": "sucesso" if metricas.sucesso else "erro",
+        "modo": metricas.modo,
+        "staging": metricas.staging,
+        "total": metricas.total_segundos,
+        "erro": metricas.erro,
+        "retomada_de": metricas.retomada_de,
+    }
+    try:
+        with engine.begin() as conn:
+            if metricas.id_run is None:
+                metricas.id_run = conn.execute(
+                    text("""
+                    INSERT INTO etl_run (iniciado_em, finalizado_em, status, modo, staging, total_segundos, erro,
+                                         retomada_de)
+                    VALUES (:iniciado_em, :finalizado_em, :status, :modo, :staging, :total, :erro, :retomada_de)
+                    RETURNING id_run
+                    """),
+                    parametros,
+                ).scalar()
+            else:
+                conn.execute(
+                    text("""
+                    UPDATE etl_run
+                    SET finalizado_em = :finalizado_em, status = :status, total_segundos = :total, erro = :erro
+                    WHERE id_run = :id_run
+                    """),
+                    {**parametros, "id_run": metricas.id_run},
+                )
+            if metricas.etapas:
+                conn.execute(
+                    text("""
+                    INSERT INTO etl_run_stage (id_run, ordem, etapa, segundos, linhas, memoria_pico_bytes, plano)
+                    VALUES (:id_run, :ordem, :etapa, :segundos, :linhas, :memoria, CAST(:plano AS JSONB))
+                    """),
+                    [
+                        {
+                            "id_run": metricas.id_run,
+                            "ordem": ordem,
+                            "etapa": e.nome,
+                            "segundos": e.segundos,
+                            "linhas": e.linhas,
+                            "memoria": e.memoria_pico_bytes,
+                            "plano": json.dumps(e.planos) if e.planos else None,
+                        }
+                        for ordem, e in enumerate(metricas.etapas, start=1)
+                    ],
+                )
+    except Exception:
+        # Métricas nunca derrubam a carga
+        logger.exception("Não foi possível gravar as métricas da execução")
+
+
+def carregar_etapas(engine: Engine, id_run: int) -> pd.DataFrame:
+    """
+    Etapas gravadas de uma execução, nas mesmas colunas de como_dataframe().
+    """
+    with engine.connect() as conn:
+        linhas = conn.execute(
+            text("""
+            SELECT etapa, round(segundos::NUMERIC, 3)::FLOAT AS segundos, linhas,
+                   round(memoria_pico_bytes / 1024.0 ^ 2, 1)::FLOAT AS memoria_pico_mb
+            FROM etl_run_stage WHERE id_run = :id_run ORDER BY ordem
+            """),
+            {"id_run": id_run},
+        ).all()
+    return pd.DataFrame(linhas, columns=["etapa", "segundos", "linhas", "memoria_pico_mb"])
+
+
+def _escapar(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def exportar_prometheus(metricas: MetricasExecucao, caminho: str = PROMETHEUS_ARQUIVO) -> None:
+    """
+    Escreve as métricas da última execução no formato texto do Prometheus.
+    O arquivo é substituído de forma atômica.
+    """
+    if not caminho:
+        return
+
+    linhas = [
+        "# HELP loretto_etl_run_duration_seconds Duração total da última execução do ETL.",
+        "# TYPE loretto_etl_run_duration_seconds gauge",
+        f'loretto_etl_run_duration_seconds{{modo="{_escapar(metricas.modo)}"}} {metricas.total_segundos:.6f}',
+        "# HELP loretto_etl_run_success 1 se a última execução terminou com sucesso.",
+        "# TYPE loretto_etl_run_success gauge",
+        f"loretto_etl_run_success {int(metricas.sucesso)}",
+        "# HELP loretto_etl_run_timestamp_seconds Fim da última execução (epoch).",
+        "# TYPE loretto_etl_run_timestamp_seconds gauge",
+        f"loretto_etl_run_timestamp_seconds {(metricas.finalizado_em or datetime.now()).timestamp():.0f}",
+        "# HELP loretto_etl_stage_duration_seconds Duração de cada etapa da última execução.",
+        "# TYPE loretto_etl_stage_duration_seconds gauge",
+    ]
+    linhas += [
+        f'loretto_etl_stage_duration_seconds{{etapa="{_escapar(e.nome)}"}} {e.segundos:.6f}'
+        for e in metricas.etapas
+    ]
+    linhas += [
+        "# HELP loretto_etl_stage_rows Linhas afetadas por etapa na última execução.",
+        "# TYPE loretto_etl_stage_rows gauge",
+    ]
+    linhas += [
+        f'loretto_etl_stage_rows{{etapa="{_escapar(e.nome)}"}} {e.linhas}'
+        for e in metricas.etapas if e.linhas is not None
+    ]
+    linhas += [
+        "# HELP loretto_etl_stage_peak_memory_bytes Pico de memória por etapa na última execução.",
+        "# TYPE loretto_etl_stage_peak_memory_bytes gauge",
+    ]
+    linhas += [
+        f'loretto_etl_stage_peak_memory_bytes{{etapa="{_escapar(e.nome)}"}} {e.memoria_pico_bytes}'
+        for e in metricas.etapas if e.memoria_pico_bytes is not None
+    ]
+
+    try:
+        # Nome único por chamada: exportações de threads do mesmo processo
+        # não podem escrever no mesmo temporário
+        temporario = f"{caminho}.{uuid4().hex}.tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            f.write("\n".join(linhas) + "\n")
+        os.replace(temporario, caminho)
+    except OSError:
+        logger.exception(f"Não foi possível exportar as métricas para {caminho}")
@@ -0,0 +1,113 @@
+import uuid
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Partições mensais da fato: fato_lancamento_<YYYYMM>
+PREFIXO_PARTICAO = "fato_lancamento_"
+
+
+def nome_particao(mes: int) -> str:
+    return f"{PREFIXO_PARTICAO}{mes}"
+
+
+def proximo_mes(mes: int) -> int:
+    """
+    Chave YYYYMM do mês seguinte (limite superior da partição).
+    """
+    return mes + 89 if mes % 100 == 12 else mes + 1
+
+
+def particoes_existentes(conn: Connection) -> set:
+    """
+    Meses (YYYYMM) que já têm partição na fato.
+    """
+    nomes = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'fato_lancamento'::regclass
+    """)).scalars()
+    return {int(nome[len(PREFIXO_PARTICAO):]) for nome in nomes if nome[len(PREFIXO_PARTICAO):].isdigit()}
+
+
+def garantir_particoes(conn: Connection, meses: list) -> list:
+    """
+    Cria as partições mensais que faltam para `meses` (chaves YYYYMM).
+    Cada partição é criada como tabela comum e anexada com ATTACH PARTITION:
+    o ATTACH pede só SHARE UPDATE EXCLUSIVE na fato, então leituras dos
+    dashboards e inserts de outras cargas não ficam bloqueados.
+
+    :return: meses cujas partições foram criadas
+    """
+    meses = sorted({int(m) for m in meses})
+    if not meses or set(meses) <= particoes_existentes(conn):
+        return []
+
+    # Serializa a criação entre cargas simultâneas (liberado no fim da transação)
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('fato_lancamento_particoes'))"))
+    faltando = [m for m in meses if m not in particoes_existentes(conn)]
+    for mes in faltando:
+        nome = nome_particao(mes)
+        # O CHECK com os mesmos limites dispensa a varredura de validação do ATTACH
+        conn.execute(text(f"""
+            CREATE TABLE "{nome}" (LIKE fato_lancamento INCLUDING DEFAULTS,
+                CONSTRAINT "ck_{nome}" CHECK (id_tempo >= {mes} AND id_tempo < {proximo_mes(mes)}))
+        """))
+        conn.execute(text(
+            f'ALTER TABLE fato_lancamento ATTACH PARTITION "{nome}" '
+            f"FOR VALUES FROM ({mes}) TO ({proximo_mes(mes)})"
+        ))
+
+    if faltando:
+        logger.info(f"Partições criadas na fato_lancamento: {', '.join(map(str, faltando))}")
+    return faltando
+
+
+def criar_particao_nova(conn: Connection, mes: int) -> str:
+    """
+    Cria a tabela lateral que vai substituir a partição de `mes`: mesma
+    estrutura e índices da fato, com o CHECK dos limites do mês para que o
+    ATTACH não precise varrê-la.
+
+    :return: nome da tabela criada
+    """
+    nome = f"{nome_particao(mes)}_nova_{uuid.uuid4().hex[:8]}"
+    conn.execute(text(f"""
+        CREATE TABLE "{nome}" (LIKE fato_lancamento INCLUDING DEFAULTS INCLUDING INDEXES,
+            CONSTRAINT "ck_{nome}" CHECK (id_tempo >= {mes} AND id_tempo < {proximo_mes(mes)}))
+    """))
+    return nome
+
+
+def trocar_particoes(conn: Connection, novas: dict) -> list:
+    """
+    Troca, na transação de `conn`, a partição de cada mês pela tabela lateral
+    já carregada (novas: mês YYYYMM -> tabela). A partição antiga é
+    desanexada e removida; a nova é anexada e recebe o nome canônico.
+    Os dashboards veem o mês antigo ou o novo completo, nunca um meio-termo,
+    e não há DELETE em massa (nem o inchaço que ele deixa).
+
+    :return: meses que já tinham partição (e foram substituídos)
+    """
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('fato_lancamento_particoes'))"))
+    existentes = particoes_existentes(conn)
+    substituidos = []
+    for mes, nome in sorted(novas.items()):
+        antiga = nome_particao(mes)
+        if mes in existentes:
+            conn.execute(text(f'ALTER TABLE fato_lancamento DETACH PARTITION "{antiga}"'))
+            conn.execute(text(f'DROP TABLE "{antiga}"'))
+            substituidos.append(mes)
+        conn.execute(text(
+            f'ALTER TABLE fato_lancamento ATTACH PARTITION "{nome}" '
+            f"FOR VALUES FROM ({mes}) TO ({proximo_mes(mes)})"
+        ))
+        conn.execute(text(f'ALTER TABLE "{nome}" RENAME TO "{antiga}"'))
+
+    logger.info(f"Partições trocadas: {', '.join(map(str, sorted(novas)))}")
+    return substituidos
@@ -0,0 +1,148 @@
+"""
+Simulação (dry-run) de uma carga: o que run_etl faria com o lote, sem gravar.
+
+Os membros de dimensão novos saem da comparação das chaves do lote com os
+mapas do cache de dimensões; os lançamentos novos e já carregados, do mesmo
+anti-join por id_hash que a carga usa (filtrar_novos), numa transação que é
+sempre desfeita. Nenhuma staging é criada e nenhum insert é feito.
+"""
+import time
+from dataclasses import dataclass, field
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from dimensoes import cache_dimensoes
+from etl import filtrar_novos, meses_do_lote
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Rótulos exibidos no resumo, na ordem das dimensões
+DIMENSOES = {
+    "dim_tipo": "Tipos",
+    "dim_grupo": "Grupos",
+    "dim_categoria": "Categorias",
+    "dim_classificacao": "Classificações",
+    "dim_tempo": "Meses",
+}
+
+
+@dataclass
+class ResultadoSimulacao:
+    registros: int = 0
+    registros_novos: int = 0
+    registros_existentes: int = 0          # id_hash já presente na fato
+    duplicados_no_lote: int = 0            # mesmo id_hash repetido entre os novos
+    membros_novos: dict = field(default_factory=lambda: {d: set() for d in DIMENSOES})
+    meses: set = field(default_factory=set)
+    substituir_meses: bool = False
+    registros_substituidos: dict = field(default_factory=dict)   # mês -> lançamentos hoje na fato
+    segundos: float = 0.0
+
+    def resumo(self) -> pd.DataFrame:
+        """
+        Impacto da carga em linhas (item, quantidade), para exibição.
+        """
+        linhas = [(f"{rotulo} novos", len(self.membros_novos[d])) for d, rotulo in DIMENSOES.items()]
+        if self.substituir_meses:
+            linhas += [
+                ("Lançamentos removidos (meses substituídos)", sum(self.registros_substituidos.values())),
+                ("Lançamentos inseridos", self.registros - self.duplicados_no_lote),
+            ]
+        else:
+            linhas += [
+                ("Lançamentos novos", self.registros_novos - self.duplicados_no_lote),
+                ("Lançamentos já carregados (ignorados)", self.registros_existentes),
+            ]
+        if self.duplicados_no_lote:
+            linhas.append(("Lançamentos repetidos no arquivo (ignorados)", self.duplicados_no_lote))
+        return pd.DataFrame(linhas, columns=["item", "quantidade"])
+
+    def exemplos(self, dimensao: str, limite: int = 20) -> list:
+        """
+        Alguns membros novos da dimensão, em texto, para conferência.
+        """
+        membros = sorted(self.membros_novos[dimensao], key=str)[:limite]
+        return [" / ".join(map(str, m)) if isinstance(m, tuple) else str(m) for m in membros]
+
+
+def simular_carga(
+    df: pd.DataFrame,
+    engine: Engine,
+    substituir_meses: bool = False,
+    resultado: ResultadoSimulacao | None = None,
+) -> ResultadoSimulacao:
+    """
+    Calcula o impacto de carregar `df` (já preparado, com id_hash) sem
+    alterar o banco. Como validar, pode ser chamada bloco a bloco com o mesmo
+    `resultado` para acumular a simulação de um arquivo lido em partes.
+    """
+    inicio = time.perf_counter()
+    resultado = resultado or ResultadoSimulacao(substituir_meses=substituir_meses)
+    resultado.registros += len(df)
+    if df.empty:
+        return resultado
+
+    for dimensao, membros in cache_dimensoes.membros_novos(df, engine).items():
+        resultado.membros_novos[dimensao] |= membros
+    meses = meses_do_lote(df)
+    resultado.meses.update(meses)
+
+    with engine.connect() as conn:
+        transacao = conn.begin()
+        try:
+            if substituir_meses:
+                # Meses substituídos por inteiro: o que hoje está na fato sai
+                contagens = conn.execute(
+                    text("SELECT id_tempo, count(*) FROM fato_lancamento "
+                         "WHERE id_tempo = ANY(:meses) GROUP BY id_tempo"),
+                    {"meses": [int(m) for m in meses]},
+                ).all()
+                for mes, n in contagens:
+                    resultado.registros_substituidos[mes] = resultado.registros_substituidos.get(mes, 0) + n
+                novos = df
+            else:
+                with conn.connection.cursor() as cur:
+                    novos, existentes = filtrar_novos(cur, df)
+                resultado.registros_existentes += existentes
+            resultado.registros_novos += len(novos)
+            resultado.duplicados_no_lote += int(novos["id_hash"].duplicated().sum())
+        finally:
+            # Dry-run: nada do que foi feito aqui (tabela temporária inclusive) fica
+            transacao.rollback()
+
+    resultado.segundos += time.perf_counter() - inicio
+    logger.info(
+        f"Simulação: {resultado.registros_novos} novos, {resultado.registros_existentes} já carregados, "
+        f"{sum(len(m) for m in resultado.membros_novos.values())} membros de dimensão novos "
+        f"({resultado.segundos:.2f}s)"
+    )
+    return resultado
+
+
+def simular_arquivo(
+    arquivo,
+    engine: Engine,
+    formato: str = "csv",
+    substituir_meses: bool = False,
+    chunk_size: int | None = None,
+) -> tuple:
+    """
+    Simulação de um arquivo grande, lido em blocos como em ingerir_em_blocos
+    (um bloco em memória por vez). A simulação só é acumulada enquanto todos
+    os blocos forem válidos.
+
+    :return: (ResultadoValidacao, ResultadoSimulacao ou None se houver registros inválidos)
+    """
+    from ingestao import INGESTAO_CHUNK_SIZE, ler_arquivo, preparar
+    from validacao import ResultadoValidacao, validar
+
+    validacao = ResultadoValidacao()
+    simulacao = ResultadoSimulacao(substituir_meses=substituir_meses)
+    for bloco in ler_arquivo(arquivo, formato, chunksize=chunk_size or INGESTAO_CHUNK_SIZE):
+        validar(bloco, validacao)
+        if validacao.ok:
+            simular_carga(preparar(bloco), engine, substituir_meses, simulacao)
+    return validacao, (simulacao if validacao.ok else None)
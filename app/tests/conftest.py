@@ -0,0 +1,8 @@
+"""
+Os módulos do app importam uns aos outros pelo nome (from utils import ...),
+como quando executados de dentro de app/; os testes fazem o mesmo.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,97 @@
+"""
+Eviction LRU, limite de memória, expiração e reaproveitamento do CacheUploads.
+"""
+import numpy as np
+import pandas as pd
+
+from cache_uploads import CacheUploads, UploadPreparado, chave_conteudo
+from validacao import ResultadoValidacao
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 0.0
+
+    def __call__(self) -> float:
+        return self.agora
+
+
+def _df(linhas: int = 1000) -> pd.DataFrame:
+    return pd.DataFrame({"valor_centavos": np.zeros(linhas, dtype="int64")})
+
+
+TAMANHO = int(_df().memory_usage(deep=True).sum())
+
+
+def _cache(itens: int, ttl: float = 60, relogio=None) -> CacheUploads:
+    # Cabem exatamente `itens` DataFrames de _df()
+    return CacheUploads(limite_mb=itens * TAMANHO / 1024 ** 2, ttl=ttl, relogio=relogio or Relogio())
+
+
+def _guardar(cache: CacheUploads, chave: str) -> UploadPreparado:
+    return cache.guardar(UploadPreparado(chave=chave, validacao=ResultadoValidacao(), df=_df(),
+                                         criado_em=cache._relogio()))
+
+
+def test_remove_o_menos_usado_recentemente():
+    cache = _cache(itens=2)
+    _guardar(cache, "a")
+    _guardar(cache, "b")
+    assert cache.obter("a") is not None   # "a" passa a ser o mais recente
+    _guardar(cache, "c")
+    assert cache.obter("b") is None
+    assert cache.obter("a") is not None
+    assert cache.obter("c") is not None
+
+
+def test_respeita_o_limite_de_memoria():
+    cache = _cache(itens=3)
+    for chave in "abcde":
+        _guardar(cache, chave)
+        assert cache._ocupado <= cache.limite_bytes
+    assert list(cache._itens) == ["c", "d", "e"]
+    assert cache._ocupado == 3 * TAMANHO
+
+
+def test_nao_guarda_upload_maior_que_o_cache():
+    cache = _cache(itens=1)
+    _guardar(cache, "a")
+    grande = UploadPreparado(chave="b", validacao=ResultadoValidacao(), df=_df(5000))
+    cache.guardar(grande)
+    assert cache.obter("b") is None
+    assert cache.obter("a") is not None
+
+
+def test_expira_pelo_ttl():
+    relogio = Relogio()
+    cache = _cache(itens=2, ttl=60, relogio=relogio)
+    _guardar(cache, "a")
+    relogio.agora = 30
+    _guardar(cache, "b")
+    relogio.agora = 61
+    assert cache.obter("a") is None
+    assert cache.obter("b") is not None
+    assert cache._ocupado == TAMANHO
+    relogio.agora = 91
+    assert cache.obter("b") is None
+    assert cache._ocupado == 0
+
+
+def test_reaproveita_pelo_conteudo():
+    cache = _cache(itens=2)
+    preparados = []
+
+    def preparar_df(conteudo: bytes):
+        preparados.append(conteudo)
+        return ResultadoValidacao(), _df()
+
+    primeiro, reaproveitado = cache.preparar(b"Descricao;Valor\n", preparar_df)
+    assert not reaproveitado
+    assert primeiro.chave == chave_conteudo(b"Descricao;Valor\n")
+
+    segundo, reaproveitado = cache.preparar(b"Descricao;Valor\n", preparar_df)
+    assert reaproveitado and segundo is primeiro
+
+    _, reaproveitado = cache.preparar(b"Outro;Arquivo\n", preparar_df)
+    assert not reaproveitado
+    assert preparados == [b"Descricao;Valor\n", b"Outro;Arquivo\n"]
@@ -0,0 +1,74 @@
+"""
+Leitura e preparo dos uploads (CSV e .xlsx).
+"""
+import io
+
+import pandas as pd
+from openpyxl import Workbook
+
+from ingestao import ler_csv, ler_xlsx, preparar
+from utils import gerar_hashes
+
+CABECALHO = "Descrição,Tipo,Grupo,Categoria,Classificação,Data,Valor\n"
+
+
+def _csv(valores: list) -> bytes:
+    linhas = [f'Lanc {i},Despesa,Fixas,Casa,A,01/2024,"{v}"\n' for i, v in enumerate(valores)]
+    return (CABECALHO + "".join(linhas)).encode("utf-8")
+
+
+def test_valor_lido_como_texto():
+    df = ler_csv(io.BytesIO(_csv(["50,00", "10"])))
+    assert list(df["Valor"]) == ["50,00", "10"]
+
+
+def test_mesmo_hash_lido_inteiro_ou_em_blocos():
+    # Só o último bloco tem milhar: antes, os primeiros viravam float
+    conteudo = _csv(["50,00", "10,5", "7", "0,99", "1.234,56"])
+    inteiro = preparar(ler_csv(io.BytesIO(conteudo)))
+    blocos = pd.concat(preparar(b) for b in ler_csv(io.BytesIO(conteudo), chunksize=2))
+    assert list(blocos["id_hash"]) == list(inteiro["id_hash"])
+    assert list(blocos["valor_centavos"]) == list(inteiro["valor_centavos"]) == [5000, 1050, 700, 99, 123456]
+
+
+def _xlsx(linhas: list) -> bytes:
+    planilha = Workbook()
+    aba = planilha.active
+    aba.append(CABECALHO.strip().split(","))
+    for linha in linhas:
+        aba.append(linha)
+    buffer = io.BytesIO()
+    planilha.save(buffer)
+    return buffer.getvalue()
+
+
+def test_nomes_numericos_da_planilha_viram_texto():
+    conteudo = _xlsx([
+        [101, "Despesa", 10, 20, 3, "01/2024", 50],
+        ["Lanc", 1, 10.0, "Casa", None, "01/2024", 7.5],
+    ])
+    df = ler_xlsx(io.BytesIO(conteudo))
+    assert list(df["Descrição"]) == ["101", "Lanc"]
+    assert list(df["Tipo"]) == ["Despesa", "1"]
+    assert list(df["Grupo"]) == ["10", "10"]
+    assert list(df["Categoria"]) == ["20", "Casa"]
+    assert df["Classificação"].iloc[0] == "3" and pd.isna(df["Classificação"].iloc[1])
+
+
+def test_mesmo_hash_no_csv_e_na_planilha():
+    # Texto fora do formato exportado ("1234,5", "7") e números da planilha
+    # entram no hash como "1.234,50" e "7,00"
+    textos = ["1.234,50", "1234,5", "7", "-0,99", "1.000.000,00"]
+    numeros = [1234.5, 1234.5, 7, -0.99, 1_000_000]
+    csv = preparar(ler_csv(io.BytesIO(_csv(textos))))
+    xlsx = preparar(ler_xlsx(io.BytesIO(_xlsx(
+        [[f"Lanc {i}", "Despesa", "Fixas", "Casa", "A", "01/2024", v] for i, v in enumerate(numeros)]
+    ))))
+    assert list(xlsx["valor_centavos"]) == list(csv["valor_centavos"]) == [123450, 123450, 700, -99, 100000000]
+    assert list(xlsx["id_hash"]) == list(csv["id_hash"])
+
+
+def test_valor_canonico_mantem_hash_do_csv_exportado():
+    df = ler_csv(io.BytesIO(_csv(["1.234,56", "-7,00"])))
+    esperado = gerar_hashes(df.copy())
+    assert list(preparar(df)["id_hash"]) == list(esperado)
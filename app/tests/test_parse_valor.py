@@ -0,0 +1,58 @@
+"""
+Regras de parse_valor_centavos para texto (CSV) e células numéricas (xlsx).
+"""
+import pandas as pd
+
+from utils import LIMITE_CENTAVOS, parse_valor_centavos
+
+
+def _parse(valores) -> tuple[list, list]:
+    centavos, invalidos = parse_valor_centavos(pd.Series(valores))
+    return centavos.tolist(), invalidos.tolist()
+
+
+def test_texto_com_separador_de_milhar():
+    assert _parse(["1.234,56", "1.234.567,89", "1234,5", "7"]) == (
+        [123456, 123456789, 123450, 700], [False] * 4,
+    )
+
+
+def test_texto_negativo():
+    assert _parse(["-1.234,56", "-0,99", "-7"]) == ([-123456, -99, -700], [False] * 3)
+
+
+def test_texto_com_ponto_decimal_e_invalido():
+    # "1.5" não é milhar ("1.500") nem decimal brasileiro ("1,5")
+    assert _parse(["1.5"]) == ([0], [True])
+
+
+def test_texto_com_tres_casas_e_invalido():
+    assert _parse(["1,234", "0,001"]) == ([0, 0], [True, True])
+
+
+def test_texto_fora_do_limite_e_invalido():
+    assert _parse(["9.999.999.999.999,99", "10.000.000.000.000,00"]) == (
+        [LIMITE_CENTAVOS - 1, 0], [False, True],
+    )
+
+
+def test_vazio_vira_zero():
+    assert _parse([None, "10,00"]) == ([0, 1000], [False, False])
+
+
+def test_celulas_numericas():
+    assert _parse([1.1, 1234.56, -0.99, 7, 0.07]) == (
+        [110, 123456, -99, 700, 7], [False] * 5,
+    )
+
+
+def test_celula_numerica_com_tres_casas_e_invalida():
+    assert _parse([0.285, 1.001, 2.5]) == ([0, 0, 250], [True, True, False])
+
+
+def test_celula_numerica_fora_do_limite_e_invalida():
+    assert _parse([1e13, 9_999_999_999_999.99]) == ([0, LIMITE_CENTAVOS - 1], [True, False])
+
+
+def test_celula_nao_numerica_e_invalida():
+    assert _parse([10, object()]) == ([1000, 0], [False, True])
@@ -0,0 +1,108 @@
+"""
+Equivalência e desempenho de gerar_hashes frente ao gerar_hash linha a linha.
+
+Uso:
+    python -m pytest app/tests -s                      # -s mostra a comparação de tempo
+    RODAR_BENCHMARK=1 python -m pytest app/tests -s    # também exige o ganho de tempo
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import compactar, gerar_hash, gerar_hashes
+
+
+def _legado(df: pd.DataFrame) -> list:
+    return list(df.apply(gerar_hash, axis=1))
+
+
+def _lote(linhas: int, semente: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(semente)
+    return pd.DataFrame({
+        "Descrição": [f"Lanc {i}" for i in rng.integers(0, 5_000, linhas)],
+        "Tipo": rng.choice(["Receita", "Despesa"], linhas),
+        "Grupo": [f"G{i}" for i in rng.integers(0, 10, linhas)],
+        "Categoria": [f"Cat {i}" for i in rng.integers(0, 20, linhas)],
+        "Classificação": [f"Class {i}" for i in rng.integers(0, 5, linhas)],
+        "Data": [f"{m:02d}/2024" for m in rng.integers(1, 13, linhas)],
+        "Valor": [f"{v // 100},{v % 100:02d}" for v in rng.integers(0, 10 ** 7, linhas)],
+    })
+
+
+@pytest.fixture
+def irregular() -> pd.DataFrame:
+    """
+    Células vazias, espaços nas bordas, caixa mista e Valor numérico (float).
+    """
+    return pd.DataFrame({
+        "Descrição": [" Aluguel ", "aluguel", np.nan, "Energia", "ÁGUA "],
+        "Tipo": ["Despesa ", "despesa", "DESPESA", np.nan, "Despesa"],
+        "Grupo": [" Fixas", "fixas", "Fixas", "Fixas", np.nan],
+        "Categoria": ["Casa", np.nan, " casa ", "Casa", "Casa"],
+        "Classificação": ["A", "A", "B", np.nan, "A"],
+        "Data": [" 01/2024", "01/2024 ", np.nan, "02/2024", "02/2024"],
+        "Valor": [1234.5, -10.0, np.nan, 0.1, 3.0],
+    })
+
+
+def test_igual_ao_legado_com_vazios_espacos_e_caixa(irregular):
+    assert list(gerar_hashes(irregular)) == _legado(irregular)
+
+
+def test_igual_ao_legado_com_valor_em_texto(irregular):
+    irregular["Valor"] = ["1.234,50", "-10,00", np.nan, "0,10", " 3 "]
+    assert list(gerar_hashes(irregular)) == _legado(irregular)
+
+
+def test_igual_ao_legado_com_colunas_categoricas(irregular):
+    esperado = _legado(irregular)
+    assert list(gerar_hashes(compactar(irregular.copy()))) == esperado
+
+
+def test_igual_ao_legado_com_parte_das_colunas_categoricas(irregular):
+    esperado = _legado(irregular)
+    misto = compactar(irregular.copy())
+    misto["Grupo"] = misto["Grupo"].astype(object)
+    assert list(gerar_hashes(misto)) == esperado
+
+
+def test_valores_substituem_o_texto_do_valor(irregular):
+    valores = pd.Series(["1", "2", "3", "4", "5"], index=irregular.index)
+    esperado = _legado(irregular.assign(Valor=valores))
+    assert list(gerar_hashes(irregular, valores)) == esperado
+
+
+def test_mantem_o_indice(irregular):
+    irregular.index = [10, 20, 30, 40, 50]
+    assert list(gerar_hashes(irregular).index) == [10, 20, 30, 40, 50]
+
+
+def test_mais_rapido_que_o_legado():
+    df = _lote(50_000)
+
+    inicio = time.perf_counter()
+    legado = _legado(df)
+    tempo_legado = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    vetorizado = list(gerar_hashes(df))
+    tempo_vetorizado = time.perf_counter() - inicio
+
+    categorico = compactar(df.copy())
+    inicio = time.perf_counter()
+    vetorizado_categorico = list(gerar_hashes(categorico))
+    tempo_categorico = time.perf_counter() - inicio
+
+    print(
+        f"\n50k linhas: apply {tempo_legado:.3f}s, gerar_hashes {tempo_vetorizado:.3f}s "
+        f"({tempo_legado / tempo_vetorizado:.1f}x), categóricas {tempo_categorico:.3f}s "
+        f"({tempo_legado / tempo_categorico:.1f}x)"
+    )
+    assert vetorizado == legado == vetorizado_categorico
+    # Tempo só é cobrado sob demanda: em CI compartilhado ele só informa
+    if os.getenv("RODAR_BENCHMARK"):
+        assert tempo_vetorizado < tempo_legado / 2
+        assert tempo_categorico < tempo_legado / 2
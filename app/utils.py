@@ -1,17 +1,82 @@
-from decimal import Decimal
+import numpy as np
 import pandas as pd
 import hashlib
 
+# Valor no formato brasileiro: sinal opcional, milhar com ponto e até 2 casas após a vírgula
+REGEX_VALOR = r"^\s*(?P<sinal>-)?\s*(?:R\$\s*)?(?P<inteiro>\d{1,3}(?:\.\d{3})+|\d+)(?:,(?P<decimal>\d{1,2}))?\s*$"
+
+# Formato do CSV exportado pelo financeiro; "-0,00" é reescrito como "0,00"
+REGEX_VALOR_CANONICO = r"(?!-0,00$)-?(?:0|[1-9]\d{0,2}(?:\.\d{3})*),\d{2}"
+
+# Maior valor absoluto (em centavos) aceito por NUMERIC(15,2)
+LIMITE_CENTAVOS = 10 ** 15
+
+def parse_valor_centavos(valores: pd.Series) -> tuple[pd.Series, pd.Series]:
+    """
+    Converte valores no formato brasileiro ("-1.234,56") para centavos em int64,
+    de forma vetorizada. Células numéricas (de planilhas .xlsx) são aceitas
+    se tiverem no máximo 2 casas decimais, como no texto; células vazias
+    viram 0.
+
+    :return: (centavos int64, máscara booleana das células inválidas)
+    """
+    centavos = pd.Series(0, index=valores.index, dtype="int64")
+    invalidos = pd.Series(False, index=valores.index)
+
+    if pd.api.types.is_numeric_dtype(valores):
+        eh_texto = pd.Series(False, index=valores.index)
+    else:
+        eh_texto = valores.str.len().notna()
+
+    # Células de texto: formato brasileiro
+    texto = valores[eh_texto]
+    if len(texto):
+        partes = texto.str.extract(REGEX_VALOR)
+        ok = partes["inteiro"].notna()
+        inteiro = partes.loc[ok, "inteiro"].str.replace(".", "", regex=False)
+        decimal = partes.loc[ok, "decimal"].fillna("").str.ljust(2, "0")
+        # Inteiros com mais de 13 dígitos não cabem em NUMERIC(15,2)
+        cabe = inteiro.str.lstrip("0").str.len() <= 13
+        ok.loc[ok] = cabe
+        inteiro, decimal = inteiro[cabe], decimal[cabe]
+        valor = inteiro.astype("int64") * 100 + decimal.astype("int64")
+        sinal = partes.loc[ok, "sinal"].notna()
+        centavos.loc[valor.index] = valor.where(~sinal, -valor)
+        invalidos.loc[texto.index] = ~ok
+
+    # Células numéricas (planilhas): como no texto, no máximo 2 casas decimais.
+    # A tolerância só absorve o erro de representação do float (1.1 * 100)
+    numeros = pd.to_numeric(valores[~eh_texto], errors="coerce")
+    if len(numeros):
+        preenchidos = numeros.notna()
+        nao_numericos = valores[~eh_texto].notna() & ~preenchidos
+        em_centavos = numeros[preenchidos] * 100
+        arredondados = em_centavos.round()
+        fracionados = ~pd.Series(
+            np.isclose(em_centavos, arredondados, rtol=1e-14, atol=1e-6), index=em_centavos.index
+        )
+        fora_limite = arredondados.abs() >= LIMITE_CENTAVOS
+        ok = ~(fracionados | fora_limite)
+        centavos.loc[arredondados[ok].index] = arredondados[ok].astype("int64")
+        invalidos.loc[nao_numericos[nao_numericos].index] = True
+        invalidos.loc[ok[~ok].index] = True
+
+    return centavos, invalidos
+
 def normalize_valor(df: pd.DataFrame) -> pd.DataFrame:
-    df["Valor"] = df["Valor"].fillna("0")
-    df["Valor"] = (
-        df["Valor"]
-        .astype(str)
-        .str.replace(".", "", regex=False)   # remove milhar
-        .str.replace(",", ".", regex=False)  # vírgula -> ponto
-    )
-    df["Valor"] = df["Valor"].apply(lambda x: Decimal(x))
-    return df
+    """
+    Substitui a coluna 'Valor' por 'valor_centavos' (int64).
+    A conversão para NUMERIC(15,2) acontece somente no banco.
+    Lança ValueError listando as linhas cujo valor não pôde ser interpretado.
+    """
+    centavos, invalidos = parse_valor_centavos(df["Valor"])
+    if invalidos.any():
+        amostra = df.loc[invalidos, "Valor"].head(10)
+        detalhes = ", ".join(f"linha {idx + 1}: {valor!r}" for idx, valor in amostra.items())
+        raise ValueError(f"{int(invalidos.sum())} valores inválidos na coluna Valor ({detalhes})")
+
+    df["valor_centavos"] = centavos
+    return df.drop(columns="Valor")
 
 def gerar_hash(row):
     base = (
@@ -22,4 +87,143 @@ def gerar_hash(row):
             str(row["Descrição"]).strip().lower() + "-" +
             str(row['Valor'])
     )
-    return hashlib.md5(base.encode("utf-8")).hexdigest()
\ No newline at end of file
+    return hashlib.md5(base.encode("utf-8")).hexdigest()
+
+
+# Colunas que compõem o fingerprint, na ordem usada por gerar_hash.
+# O booleano indica se o campo é convertido para minúsculas.
+COLUNAS_HASH = [
+    ("Tipo", True),
+    ("Grupo", True),
+    ("Categoria", True),
+    ("Data", False),
+    ("Descrição", True),
+]
+
+def formatar_centavos(centavos: pd.Series) -> pd.Series:
+    """
+    Centavos no formato em que o financeiro exporta o CSV ("-1.234,56").
+    """
+    separadores = str.maketrans(",.", ".,")
+    return pd.Series(
+        [(f"-{-c // 100:,}.{-c % 100:02d}" if c < 0 else f"{c // 100:,}.{c % 100:02d}").translate(separadores)
+         for c in centavos.tolist()],
+        index=centavos.index,
+        dtype=object,
+    )
+
+
+def valor_canonico(valores: pd.Series, centavos: pd.Series) -> pd.Series:
+    """
+    Texto do Valor que entra no id_hash: o do CSV exportado ("-1.234,56"),
+    qualquer que seja a origem. Assim "1234,5", "1.234,50" e a célula
+    numérica 1234.5 de uma planilha geram o mesmo id_hash. Texto que já
+    está no formato (o caso comum) é usado como veio; só o restante é
+    reformatado a partir dos centavos.
+    """
+    if pd.api.types.is_numeric_dtype(valores):
+        return formatar_centavos(centavos)
+    canonico = valores.str.fullmatch(REGEX_VALOR_CANONICO).fillna(False).astype(bool)
+    if canonico.all():
+        return valores
+    texto = valores.astype(object).copy()
+    texto[~canonico] = formatar_centavos(centavos[~canonico])
+    return texto
+
+# Colunas de baixa cardinalidade mantidas como categóricas (dicionário de
+# valores distintos + código inteiro por linha) desde a leitura do upload
+COLUNAS_CATEGORICAS = ["Tipo", "Grupo", "Categoria", "Classificação", "Data"]
+
+def compactar(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converte para category as COLUNAS_CATEGORICAS presentes no DataFrame que
+    ainda não forem categóricas (o read_csv do upload já as lê assim).
+    """
+    for coluna in COLUNAS_CATEGORICAS:
+        if coluna in df.columns and not isinstance(df[coluna].dtype, pd.CategoricalDtype):
+            df[coluna] = df[coluna].astype("category")
+    return df
+
+def por_categoria(serie: pd.Series, funcao) -> pd.Series:
+    """
+    Aplica `funcao` (Series -> Series) uma vez por valor distinto de uma
+    coluna categórica e espalha o resultado para as linhas pelos códigos.
+    Células vazias (código -1) recebem o resultado de `funcao` para NaN.
+    Em colunas comuns a função é aplicada linha a linha, como antes.
+    """
+    if not isinstance(serie.dtype, pd.CategoricalDtype):
+        return funcao(serie)
+    valores = pd.Series(list(serie.cat.categories) + [np.nan], dtype=object)
+    resultado = funcao(valores).to_numpy()
+    return pd.Series(resultado[serie.cat.codes.to_numpy()], index=serie.index)
+
+def chaves_tempo(datas: pd.Series) -> np.ndarray:
+    """
+    Chave YYYYMM (ano * 100 + mês) de cada data 'MM/AAAA' já validada,
+    interpretada uma vez por mês distinto.
+    """
+    def interpretar(texto: pd.Series) -> pd.Series:
+        texto = texto.astype(str).str.strip()
+        ano = pd.to_numeric(texto.str.slice(3, 7), errors="coerce")
+        mes = pd.to_numeric(texto.str.slice(0, 2), errors="coerce")
+        return (ano * 100 + mes).fillna(0).astype("int32")
+
+    return por_categoria(datas, interpretar).to_numpy(dtype="int32")
+
+def combinar_codigos(df: pd.DataFrame, colunas: list) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Identifica as combinações distintas dos valores de `colunas`: os códigos
+    de cada coluna (os da própria categórica, quando for o caso) são
+    compostos numa chave int64, fatorizada uma única vez.
+
+    :return: (código da combinação de cada linha, posição da primeira linha de cada combinação)
+    """
+    chave = np.zeros(len(df), dtype="int64")
+    for coluna in colunas:
+        codigos, unicos = pd.factorize(df[coluna])
+        chave = chave * (len(unicos) + 1) + (codigos + 1)
+    codigos, _ = pd.factorize(chave)
+    _, primeiras = np.unique(codigos, return_index=True)
+    return codigos, primeiras
+
+def _normalizar_hash(valores: pd.Series, minusculo: bool) -> pd.Series:
+    texto = valores.astype(str).str.strip()
+    return texto.str.lower() if minusculo else texto
+
+def gerar_hashes(df: pd.DataFrame, valores: pd.Series | None = None) -> pd.Series:
+    """
+    Versão vetorizada de gerar_hash: normaliza as colunas-chave com
+    operações de string do pandas, concatena coluna a coluna e calcula
+    o md5 do lote inteiro de uma vez.
+    Produz exatamente os mesmos digests de df.apply(gerar_hash, axis=1).
+    `valores`, se informada, substitui o texto da coluna Valor no hash.
+
+    Com as colunas categóricas (ver compactar), o trecho Tipo-Grupo-
+    Categoria-Data é montado uma vez por combinação distinta e espalhado
+    para as linhas; só Descrição e Valor são tratados linha a linha.
+    """
+    # Colunas categóricas iniciais de COLUNAS_HASH: formam o prefixo da base
+    lideres = 0
+    while lideres < len(COLUNAS_HASH) and isinstance(df[COLUNAS_HASH[lideres][0]].dtype, pd.CategoricalDtype):
+        lideres += 1
+
+    base = None
+    if lideres:
+        codigos, primeiras = combinar_codigos(df, [coluna for coluna, _ in COLUNAS_HASH[:lideres]])
+        distintas = df.iloc[primeiras]
+        for coluna, minusculo in COLUNAS_HASH[:lideres]:
+            parte = _normalizar_hash(distintas[coluna].astype(object), minusculo)
+            base = parte if base is None else base + "-" + parte
+        base = pd.Series(base.to_numpy()[codigos], index=df.index)
+
+    for coluna, minusculo in COLUNAS_HASH[lideres:]:
+        parte = por_categoria(df[coluna], lambda v: _normalizar_hash(v, minusculo))
+        base = parte if base is None else base + "-" + parte
+    base = base + "-" + (df["Valor"] if valores is None else valores).astype(str)
+
+    md5 = hashlib.md5
+    return pd.Series(
+        [md5(b.encode("utf-8")).hexdigest() for b in base],
+        index=df.index,
+        dtype=object,
+    )
@@ -0,0 +1,131 @@
+import tempfile
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from utils import parse_valor_centavos, por_categoria
+
+CAMPOS_OBRIGATORIOS = ["Descrição", "Tipo", "Grupo", "Categoria", "Classificação", "Data", "Valor"]
+
+# Tamanho máximo de cada campo, conforme os VARCHAR de initdb/01_schema.sql
+LIMITES_TAMANHO = {
+    "Tipo": 100,            # dim_tipo.nome_tipo
+    "Grupo": 150,           # dim_grupo.nome_grupo
+    "Categoria": 150,       # dim_categoria.nome_categoria
+    "Classificação": 256,   # dim_classificacao.nome_classificacao
+    "Descrição": 255,       # fato_lancamento.descricao
+}
+
+REGEX_DATA = r"^\s*(?:0[1-9]|1[0-2])/\d{4}\s*$"
+
+# Registros com problema guardados para exibição na tela
+LIMITE_AMOSTRA = 100
+
+# Acima deste tamanho o CSV completo de erros vai para disco
+LIMITE_ERROS_EM_MEMORIA = 16 * 1024 ** 2
+
+
+@dataclass
+class ResultadoValidacao:
+    registros: int = 0
+    registros_invalidos: int = 0
+    contagens: dict = field(default_factory=dict)   # (regra, coluna) -> registros
+    amostra: pd.DataFrame = field(default_factory=pd.DataFrame)
+    _erros: tempfile.SpooledTemporaryFile = field(
+        default_factory=lambda: tempfile.SpooledTemporaryFile(max_size=LIMITE_ERROS_EM_MEMORIA, mode="w+b")
+    )
+
+    @property
+    def ok(self) -> bool:
+        return self.registros_invalidos == 0
+
+    def resumo(self) -> pd.DataFrame:
+        """
+        Quantidade de registros por regra e coluna.
+        """
+        return pd.DataFrame(
+            [(regra, coluna, n) for (regra, coluna), n in self.contagens.items()],
+            columns=["regra", "coluna", "registros"],
+        )
+
+    def csv_erros(self) -> bytes:
+        """
+        Todos os registros inválidos, com a lista de erros de cada um, em CSV.
+        """
+        self._erros.seek(0)
+        return self._erros.read()
+
+
+def _vazio(valores: pd.Series) -> pd.Series:
+    return valores.isna() | valores.astype(str).str.strip().eq("")
+
+
+def _regras(df: pd.DataFrame) -> dict:
+    """
+    Máscaras booleanas (uma por regra e coluna), calculadas coluna a coluna.
+    Regras de formato e tamanho só valem para células preenchidas, para não
+    contar o mesmo problema duas vezes. Nas colunas categóricas cada regra é
+    avaliada uma vez por valor distinto (utils.por_categoria).
+    """
+    mascaras = {}
+    preenchido = {}
+    for campo in CAMPOS_OBRIGATORIOS:
+        vazio = por_categoria(df[campo], _vazio)
+        preenchido[campo] = ~vazio
+        mascaras[("obrigatorio", campo)] = vazio
+
+    data_invalida = por_categoria(df["Data"], lambda v: ~v.astype(str).str.match(REGEX_DATA))
+    mascaras[("formato_data", "Data")] = preenchido["Data"] & data_invalida
+
+    _, valor_invalido = parse_valor_centavos(df["Valor"])
+    mascaras[("formato_valor", "Valor")] = preenchido["Valor"] & valor_invalido
+
+    for campo, limite in LIMITES_TAMANHO.items():
+        longo = por_categoria(df[campo], lambda v: v.astype(str).str.len() > limite)
+        mascaras[("tamanho", campo)] = preenchido[campo] & longo
+
+    return mascaras
+
+
+def validar(df: pd.DataFrame, resultado: ResultadoValidacao | None = None) -> ResultadoValidacao:
+    """
+    Aplica todas as regras numa única passada vetorizada. Pode ser chamada
+    bloco a bloco com o mesmo `resultado` para acumular contagens, amostra e
+    o CSV de erros de um arquivo lido em partes.
+    """
+    resultado = resultado or ResultadoValidacao()
+    mascaras = _regras(df)
+
+    invalido = np.zeros(len(df), dtype=bool)
+    for chave, mascara in mascaras.items():
+        n = int(mascara.sum())
+        if n:
+            resultado.contagens[chave] = resultado.contagens.get(chave, 0) + n
+            invalido |= mascara.to_numpy()
+
+    resultado.registros += len(df)
+    if not invalido.any():
+        return resultado
+
+    # Descrição dos erros só para as linhas inválidas
+    erros = pd.Series("", index=df.index[invalido])
+    for (regra, coluna), mascara in mascaras.items():
+        marcadas = mascara.to_numpy()[invalido]
+        if marcadas.any():
+            erros[marcadas] = erros[marcadas] + f"{regra}:{coluna}; "
+
+    invalidos = df[invalido].copy()
+    invalidos.insert(0, "registro", invalidos.index + 1)
+    invalidos.insert(1, "erros", erros.str.rstrip("; "))
+
+    invalidos.to_csv(resultado._erros, index=False, header=resultado.registros_invalidos == 0, encoding="utf-8")
+    resultado.registros_invalidos += len(invalidos)
+
+    faltam = LIMITE_AMOSTRA - len(resultado.amostra)
+    if faltam > 0 and resultado.amostra.empty:
+        resultado.amostra = invalidos.head(faltam).reset_index(drop=True)
+    elif faltam > 0:
+        resultado.amostra = pd.concat([resultado.amostra, invalidos.head(faltam)], ignore_index=True)
+
+    return resultado
@@ -0,0 +1,214 @@
+"""
+Benchmark reprodutível do pipeline de ingestão, etapa por etapa.
+
+Uso:
+    python bench/benchmark.py --linhas 100000 --saida bench/resultados/100k.json
+    python bench/benchmark.py --linhas 1000000 --comparar bench/resultados/anterior.json
+
+Gera um CSV sintético (bench/gerar_dados.py), cria um banco descartável
+(--banco, padrão loretto_bench) a partir de initdb/*.sql no mesmo servidor das
+variáveis DB_*, mede cada etapa separadamente e grava o resultado em JSON.
+O banco é removido ao final, a menos que se use --manter-banco.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(RAIZ, "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.pool import NullPool  # noqa: E402
+
+import gerar_dados  # noqa: E402
+from db import dispose_engine, montar_url  # noqa: E402
+
+
+def conectar(banco: str):
+    """
+    Conexão em autocommit com o banco indicado, no servidor das variáveis DB_*.
+    """
+    engine = create_engine(montar_url(banco), poolclass=NullPool)
+    return engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+
+
+def criar_banco(banco: str) -> None:
+    """
+    Recria o banco descartável e aplica initdb/*.sql em ordem, ignorando o
+    CREATE DATABASE/\\c de cada script (que apontam para o banco de produção).
+    """
+    with conectar("postgres") as conn:
+        conn.exec_driver_sql(f'DROP DATABASE IF EXISTS "{banco}"')
+        conn.exec_driver_sql(f'CREATE DATABASE "{banco}"')
+
+    with conectar(banco) as conn, conn.connection.cursor() as cur:
+        for script in sorted(glob.glob(os.path.join(RAIZ, "initdb", "*.sql"))):
+            sql = open(script, encoding="utf-8").read()
+            if "\\c " in sql:
+                sql = sql[sql.rindex("\\c "):].split("\n", 1)[1]
+            cur.execute(sql)
+
+
+def remover_banco(banco: str) -> None:
+    dispose_engine()
+    with conectar("postgres") as conn:
+        conn.exec_driver_sql(f'DROP DATABASE IF EXISTS "{banco}"')
+
+
+def medir(resultados: dict, etapa: str, funcao, *args):
+    inicio = time.perf_counter()
+    retorno = funcao(*args)
+    resultados[etapa] = round(time.perf_counter() - inicio, 4)
+    print(f"  {etapa:<30} {resultados[etapa]:>9.3f}s")
+    return retorno
+
+
+def memoria_mb(df: pd.DataFrame) -> float:
+    return round(df.memory_usage(deep=True).sum() / 1024 ** 2, 1)
+
+
+def executar(csv: str, legado: bool) -> tuple:
+    """
+    Mede cada etapa do pipeline sobre o CSV, no banco configurado em DB_NAME.
+
+    :return: (tempos por etapa, memória do DataFrame em MB após cada fase)
+    """
+    from db import get_engine
+    from dimensoes import resolver_chaves
+    from ingestao import ler_csv
+    from particoes import garantir_particoes
+    from sqlalchemy import text
+    from utils import gerar_hash, gerar_hashes, normalize_valor
+    from validacao import validar
+    import etl
+
+    engine = get_engine()
+    tempos = {}
+    memoria = {}
+    tabela = etl.nova_staging()
+
+    df = medir(tempos, "read_csv", ler_csv, csv)
+    memoria["lido"] = memoria_mb(df)
+    medir(tempos, "validacao", validar, df)
+    df["Valor"] = df["Valor"].fillna("0")
+    if legado:
+        medir(tempos, "gerar_hash_apply", lambda d: d.apply(gerar_hash, axis=1), df)
+    df["id_hash"] = medir(tempos, "gerar_hash", gerar_hashes, df)
+    df = medir(tempos, "normalize_valor", normalize_valor, df)
+    memoria["preparado"] = memoria_mb(df)
+
+    medir(tempos, "load_staging", etl.load_staging, df, engine, tabela)
+    with engine.begin() as conn:
+        medir(tempos, "particoes", garantir_particoes, conn, etl.meses_do_lote(df))
+    medir(tempos, "load_dim_tempo", etl.load_dim_tempo, engine, tabela)
+    medir(tempos, "load_dim_tipo", etl.load_dim_tipo, engine, tabela)
+    medir(tempos, "load_dim_grupo", etl.load_dim_grupo, engine, tabela)
+    medir(tempos, "load_dim_categoria", etl.load_dim_categoria, engine, tabela)
+    medir(tempos, "load_dim_classificacao", etl.load_dim_classificacao, engine, tabela)
+    medir(tempos, "load_fato_lancamento", etl.load_fato_lancamento, engine, tabela)
+
+    # Caminho com cache de dimensões: mesma carga, fato vazia e dimensões prontas
+    with engine.begin() as conn:
+        conn.execute(text("TRUNCATE fato_lancamento"))
+    df = df.drop(columns=[c for c in df.columns if c.startswith("id_") and c != "id_hash"])
+    medir(tempos, "resolver_chaves", resolver_chaves, df, engine)
+    memoria["chaveado"] = memoria_mb(df)
+    medir(tempos, "load_staging_chaveada", etl.load_staging, etl.sem_nomes_dimensao(df), engine, tabela)
+    medir(tempos, "load_fato_lancamento_chaveado", etl.load_fato_lancamento_chaveado, engine, tabela)
+    etl.drop_staging(engine, tabela)
+
+    for fase, mb in memoria.items():
+        print(f"  memória ({fase}){'':<{21 - len(fase)}} {mb:>8.1f} MB")
+    return tempos, memoria
+
+
+def versao_git() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def comparar(atual: dict, caminho_anterior: str) -> None:
+    anterior = json.load(open(caminho_anterior, encoding="utf-8"))
+    print(f"\nComparação com {caminho_anterior} ({anterior.get('commit', '?')}):")
+    for etapa, tempo in atual["etapas"].items():
+        antes = anterior.get("etapas", {}).get(etapa)
+        if antes:
+            print(f"  {etapa:<30} {antes:>9.3f}s -> {tempo:>9.3f}s ({(tempo - antes) / antes:+.0%})")
+    for fase, mb in atual.get("memoria_mb", {}).items():
+        antes = anterior.get("memoria_mb", {}).get(fase)
+        if antes:
+            print(f"  memória ({fase}){'':<{21 - len(fase)}} {antes:>8.1f} MB -> {mb:>8.1f} MB ({(mb - antes) / antes:+.0%})")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline de ingestão.")
+    gerar_dados.adicionar_argumentos(parser)
+    parser.add_argument("--saida", default=None, help="arquivo JSON de resultado")
+    parser.add_argument("--csv", default=None, help="usa um CSV existente em vez de gerar")
+    parser.add_argument("--banco", default="loretto_bench", help="banco descartável criado para o benchmark")
+    parser.add_argument("--manter-banco", action="store_true")
+    parser.add_argument("--legado", action="store_true", help="mede também gerar_hash via df.apply")
+    parser.add_argument("--comparar", default=None, help="JSON de uma execução anterior")
+    args = parser.parse_args(argv)
+
+    if args.banco in ("loretto_dw", "metabase", "postgres"):
+        parser.error(f"o banco {args.banco} não é descartável")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = args.csv
+        if csv is None:
+            csv = os.path.join(tmp, "bench.csv")
+            print(f"Gerando {args.linhas} linhas...")
+            gerar_dados.gerar(csv, args)
+
+        criar_banco(args.banco)
+        os.environ["DB_NAME"] = args.banco
+        try:
+            print(f"Executando benchmark no banco {args.banco}:")
+            etapas, memoria = executar(csv, args.legado)
+        finally:
+            if not args.manter_banco:
+                remover_banco(args.banco)
+
+    resultado = {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "commit": versao_git(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "parametros": {
+            "linhas": args.linhas, "tipos": args.tipos, "grupos": args.grupos,
+            "categorias": args.categorias, "classificacoes": args.classificacoes,
+            "descricoes": args.descricoes, "meses": args.meses, "semente": args.semente,
+            "csv": args.csv,
+        },
+        "etapas": etapas,
+        "total": round(sum(etapas.values()), 4),
+        "memoria_mb": memoria,
+    }
+
+    saida = args.saida or os.path.join(RAIZ, "bench", "resultados", f"{datetime.now():%Y%m%d%H%M%S}_{args.linhas}.json")
+    os.makedirs(os.path.dirname(saida), exist_ok=True)
+    with open(saida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"\nResultado gravado em {saida}")
+
+    if args.comparar:
+        comparar(resultado, args.comparar)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Gerador de planilhas sintéticas no formato exato do upload.
+
+Uso:
+    python bench/gerar_dados.py saida.csv --linhas 1000000
+    python bench/gerar_dados.py saida.csv --linhas 100000 --grupos 20 --categorias 50 --meses 36
+
+Colunas: Descrição, Tipo, Grupo, Categoria, Classificação, Data (MM/YYYY) e
+Valor no formato brasileiro ("-1.234,56"). O arquivo é escrito em blocos,
+então 10 milhões de linhas não precisam caber na memória. Com a mesma
+semente o arquivo gerado é sempre o mesmo.
+"""
+import argparse
+import csv
+
+import numpy as np
+import pandas as pd
+
+BLOCO = 200_000
+
+
+def formatar_valores(centavos: np.ndarray) -> list:
+    """
+    Formata centavos como valor brasileiro: milhar com ponto, decimal com vírgula.
+    """
+    return [
+        ("-" if c < 0 else "") + f"{abs(c) // 100:,}".replace(",", ".") + f",{abs(c) % 100:02d}"
+        for c in centavos.tolist()
+    ]
+
+
+def gerar_bloco(rng: np.random.Generator, n: int, args) -> pd.DataFrame:
+    """
+    Gera `n` linhas respeitando as cardinalidades pedidas. Grupos pertencem
+    a um tipo e categorias a um grupo, como na hierarquia das dimensões.
+    """
+    tipo = rng.integers(0, args.tipos, n)
+    grupo = rng.integers(0, args.grupos, n)
+    categoria = rng.integers(0, args.categorias, n)
+    classificacao = rng.integers(0, args.classificacoes, n)
+
+    # Meses consecutivos a partir de --inicio (MM/YYYY)
+    mes_inicio, ano_inicio = (int(p) for p in args.inicio.split("/"))
+    deslocamento = rng.integers(0, args.meses, n) + (ano_inicio * 12 + mes_inicio - 1)
+    anos, meses = deslocamento // 12, deslocamento % 12 + 1
+
+    # Valores com cauda longa e ~20% de lançamentos negativos
+    centavos = np.round(rng.lognormal(9, 2, n)).astype("int64").clip(1, 10 ** 11)
+    centavos[rng.random(n) < 0.2] *= -1
+
+    return pd.DataFrame({
+        "Descrição": np.char.add("Lançamento ", rng.integers(0, args.descricoes, n).astype(str)),
+        "Tipo": np.char.add("Tipo ", tipo.astype(str)),
+        "Grupo": np.char.add(np.char.add(np.char.add("Grupo ", tipo.astype(str)), "."), grupo.astype(str)),
+        "Categoria": np.char.add(
+            np.char.add(np.char.add("Categoria ", tipo.astype(str)), "."),
+            np.char.add(np.char.add(grupo.astype(str), "."), categoria.astype(str)),
+        ),
+        "Classificação": np.char.add("Classificação ", classificacao.astype(str)),
+        "Data": [f"{m:02d}/{a}" for m, a in zip(meses.tolist(), anos.tolist())],
+        "Valor": formatar_valores(centavos),
+    })
+
+
+def gerar(caminho: str, args) -> None:
+    rng = np.random.default_rng(args.semente)
+    escritas = 0
+    with open(caminho, "w", encoding="utf-8", newline="") as f:
+        while escritas < args.linhas:
+            n = min(BLOCO, args.linhas - escritas)
+            gerar_bloco(rng, n, args).to_csv(
+                f, index=False, header=escritas == 0, quoting=csv.QUOTE_MINIMAL
+            )
+            escritas += n
+
+
+def adicionar_argumentos(parser: argparse.ArgumentParser) -> None:
+    """
+    Parâmetros de volume e cardinalidade, compartilhados com o benchmark.
+    """
+    parser.add_argument("--linhas", type=int, default=10_000, help="quantidade de linhas (10k a 10M)")
+    parser.add_argument("--tipos", type=int, default=2)
+    parser.add_argument("--grupos", type=int, default=10, help="grupos por tipo")
+    parser.add_argument("--categorias", type=int, default=20, help="categorias por grupo")
+    parser.add_argument("--classificacoes", type=int, default=5)
+    parser.add_argument("--descricoes", type=int, default=5_000, help="descrições distintas")
+    parser.add_argument("--meses", type=int, default=24, help="meses distintos")
+    parser.add_argument("--inicio", default="01/2023", help="primeiro mês (MM/YYYY)")
+    parser.add_argument("--semente", type=int, default=42)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera CSV sintético no formato do upload.")
+    parser.add_argument("saida", help="arquivo CSV a gerar")
+    adicionar_argumentos(parser)
+    argumentos = parser.parse_args()
+    gerar(argumentos.saida, argumentos)
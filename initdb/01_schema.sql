@@ -51,20 +51,34 @@ CREATE TABLE IF NOT EXISTS dim_categoria (
 -- Dimensão Tempo
 --------------------------------------------------------------------------------
 CREATE TABLE IF NOT EXISTS dim_tempo (
-                                         id_tempo SERIAL PRIMARY KEY,
+                                         id_tempo INT PRIMARY KEY,       -- 👈 chave determinística YYYYMM
                                          ano INT NOT NULL,
                                          mes INT NOT NULL,
                                          semana INT,
                                          data_inicio DATE NOT NULL,
-                                         data_fim DATE NOT NULL
-
+                                         data_fim DATE NOT NULL,
+    CONSTRAINT uq_tempo_ano_mes UNIQUE (ano, mes),  -- 👈 um registro por mês
+    CONSTRAINT ck_tempo_chave CHECK (id_tempo = ano * 100 + mes AND mes BETWEEN 1 AND 12)
     );
 
+-- Calendário pré-gerado: meses fora do intervalo são criados pelo ETL sob demanda
+INSERT INTO dim_tempo (id_tempo, ano, mes, semana, data_inicio, data_fim)
+SELECT
+    EXTRACT(YEAR FROM m)::INT * 100 + EXTRACT(MONTH FROM m)::INT,
+    EXTRACT(YEAR FROM m)::INT,
+    EXTRACT(MONTH FROM m)::INT,
+    EXTRACT(WEEK FROM m)::INT,
+    m::DATE,
+    (m + INTERVAL '1 month - 1 day')::DATE
+FROM generate_series('2000-01-01'::DATE, '2040-12-01'::DATE, INTERVAL '1 month') AS m
+ON CONFLICT (ano, mes) DO NOTHING;
+
 --------------------------------------------------------------------------------
--- Fato Lançamento
+-- Fato Lançamento (particionada por mês: uma partição por id_tempo YYYYMM,
+-- criada pelo ETL quando um mês novo aparece, ver app/particoes.py)
 --------------------------------------------------------------------------------
 CREATE TABLE IF NOT EXISTS fato_lancamento (
-                                               id_lancamento SERIAL PRIMARY KEY,
+                                               id_lancamento SERIAL,
                                                id_tipo INT NOT NULL,
                                                id_grupo INT NOT NULL,
                                                id_categoria INT NOT NULL,
@@ -72,7 +86,12 @@ CREATE TABLE IF NOT EXISTS fato_lancamento (
                                                id_classificacao INT NOT NULL,
                                                descricao VARCHAR(255),
     valor NUMERIC(15,2) NOT NULL,
-    id_hash TEXT NOT NULL UNIQUE,
+    -- md5 do registro (utils.gerar_hashes) guardado como os 16 bytes do digest
+    id_hash UUID NOT NULL,
+    CONSTRAINT pk_fato_lancamento PRIMARY KEY (id_lancamento, id_tempo),
+    -- A Data entra no id_hash, então o mesmo hash é sempre do mesmo mês:
+    -- (id_hash, id_tempo) único equivale a id_hash único em todas as partições
+    CONSTRAINT uq_fato_hash UNIQUE (id_hash, id_tempo),
     CONSTRAINT fk_fato_tipo FOREIGN KEY (id_tipo)
     REFERENCES dim_tipo (id_tipo),
     CONSTRAINT fk_fato_grupo FOREIGN KEY (id_grupo)
@@ -83,5 +102,113 @@ CREATE TABLE IF NOT EXISTS fato_lancamento (
     REFERENCES dim_categoria (id_categoria),
     CONSTRAINT fk_fato_tempo FOREIGN KEY (id_tempo)
     REFERENCES dim_tempo (id_tempo)
+    ) PARTITION BY RANGE (id_tempo);
+
+-- Índices das chaves estrangeiras (filtros e joins dos dashboards)
+CREATE INDEX IF NOT EXISTS ix_fato_tipo ON fato_lancamento (id_tipo);
+CREATE INDEX IF NOT EXISTS ix_fato_grupo ON fato_lancamento (id_grupo);
+CREATE INDEX IF NOT EXISTS ix_fato_categoria ON fato_lancamento (id_categoria);
+CREATE INDEX IF NOT EXISTS ix_fato_classificacao ON fato_lancamento (id_classificacao);
+
+
+--------------------------------------------------------------------------------
+-- Agregado mensal da fato (mantido pelo ETL, ver app/agregados.py)
+--------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS agg_lancamento_mensal (
+                                                     id_tempo INT NOT NULL,
+                                                     id_tipo INT NOT NULL,
+                                                     id_grupo INT NOT NULL,
+                                                     id_categoria INT NOT NULL,
+                                                     id_classificacao INT NOT NULL,
+                                                     valor_total NUMERIC(18,2) NOT NULL,
+                                                     quantidade BIGINT NOT NULL,
+    CONSTRAINT pk_agg_lancamento_mensal PRIMARY KEY (id_tempo, id_tipo, id_grupo, id_categoria, id_classificacao)
+    );
+
+-- Agregado com os nomes das dimensões, para consultas do Metabase
+CREATE OR REPLACE VIEW vw_lancamento_mensal AS
+SELECT
+    t.ano,
+    t.mes,
+    t.data_inicio,
+    dt.nome_tipo,
+    dg.nome_grupo,
+    dc.nome_categoria,
+    cs.nome_classificacao,
+    a.valor_total,
+    a.quantidade
+FROM agg_lancamento_mensal a
+JOIN dim_tempo t ON t.id_tempo = a.id_tempo
+JOIN dim_tipo dt ON dt.id_tipo = a.id_tipo
+JOIN dim_grupo dg ON dg.id_grupo = a.id_grupo
+JOIN dim_categoria dc ON dc.id_categoria = a.id_categoria
+JOIN dim_classificacao cs ON cs.id_classificacao = a.id_classificacao;
+
+--------------------------------------------------------------------------------
+-- Métricas de execução do ETL
+--------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS etl_run (
+                                       id_run BIGSERIAL PRIMARY KEY,
+                                       iniciado_em TIMESTAMP NOT NULL,
+                                       finalizado_em TIMESTAMP,
+                                       status VARCHAR(20) NOT NULL,      -- executando | sucesso | erro
+                                       modo VARCHAR(50),
+                                       staging VARCHAR(63),
+                                       total_segundos DOUBLE PRECISION,
+                                       erro TEXT,
+                                       retomada_de BIGINT                -- execução original, nas retomadas
+    );
+
+CREATE TABLE IF NOT EXISTS etl_run_stage (
+                                             id_run BIGINT NOT NULL,
+                                             ordem INT NOT NULL,
+                                             etapa VARCHAR(50) NOT NULL,
+                                             segundos DOUBLE PRECISION NOT NULL,
+                                             linhas BIGINT,
+                                             memoria_pico_bytes BIGINT,
+                                             plano JSONB,                 -- EXPLAIN (ANALYZE, BUFFERS), quando capturado
+    CONSTRAINT pk_etl_run_stage PRIMARY KEY (id_run, ordem),
+    CONSTRAINT fk_etl_run_stage_run FOREIGN KEY (id_run)
+    REFERENCES etl_run (id_run) ON DELETE CASCADE
+    );
+
+-- Etapas e lotes da fato já concluídos de cada carga (ver app/checkpoints.py).
+-- lote 0 = etapa inteira; lotes da fato cobrem faixas de páginas da staging.
+CREATE TABLE IF NOT EXISTS etl_checkpoint (
+                                              id_run BIGINT NOT NULL,
+                                              etapa VARCHAR(50) NOT NULL,
+                                              lote INT NOT NULL DEFAULT 0,
+                                              pagina_inicial INT,
+                                              pagina_final INT,
+                                              linhas BIGINT,
+                                              concluido_em TIMESTAMP NOT NULL DEFAULT now(),
+    CONSTRAINT pk_etl_checkpoint PRIMARY KEY (id_run, etapa, lote),
+    CONSTRAINT fk_etl_checkpoint_run FOREIGN KEY (id_run)
+    REFERENCES etl_run (id_run) ON DELETE CASCADE
+    );
+
+--------------------------------------------------------------------------------
+-- Fila de jobs do ETL (ver app/jobs.py)
+--------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS etl_job (
+                                       id_job BIGSERIAL PRIMARY KEY,
+                                       criado_em TIMESTAMP NOT NULL DEFAULT now(),
+                                       iniciado_em TIMESTAMP,
+                                       finalizado_em TIMESTAMP,
+                                       heartbeat_em TIMESTAMP,            -- atualizado enquanto um worker executa o job
+                                       status VARCHAR(20) NOT NULL DEFAULT 'pendente',  -- pendente | executando | sucesso | erro
+                                       arquivo TEXT NOT NULL,             -- cópia do upload no diretório de jobs
+                                       chave_conteudo VARCHAR(64),        -- SHA-256 do upload (cache de uploads)
+                                       parametros JSONB NOT NULL DEFAULT '{}',
+                                       tentativas INT NOT NULL DEFAULT 0,
+                                       worker VARCHAR(100),
+                                       enfileirado_por VARCHAR(100),      -- processo com o upload no cache, se houver
+                                       etapa VARCHAR(50),
+                                       linhas_processadas BIGINT,
+                                       linhas_total BIGINT,
+                                       resultado JSONB,
+                                       erro TEXT,
+                                       id_run BIGINT
     );
 
+CREATE INDEX IF NOT EXISTS ix_etl_job_status ON etl_job (status, id_job);
@@ -0,0 +1,59 @@
+-- Migração: dim_tempo como calendário com chave YYYYMM e unicidade por (ano, mes).
+-- Remove meses duplicados, reaponta a fato_lancamento e pré-gera o calendário.
+-- Idempotente: pode ser executada em bancos novos ou já migrados.
+\c loretto_dw
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_tempo_ano_mes') THEN
+        ALTER TABLE fato_lancamento DROP CONSTRAINT IF EXISTS fk_fato_tempo;
+
+        -- Reaponta os fatos para a chave YYYYMM (meses duplicados convergem)
+        UPDATE fato_lancamento f
+        SET id_tempo = dt.ano * 100 + dt.mes
+        FROM dim_tempo dt
+        WHERE dt.id_tempo = f.id_tempo;
+
+        -- Recria a dimensão com um registro por mês
+        CREATE TABLE dim_tempo_nova (
+            id_tempo INT PRIMARY KEY,
+            ano INT NOT NULL,
+            mes INT NOT NULL,
+            semana INT,
+            data_inicio DATE NOT NULL,
+            data_fim DATE NOT NULL
+        );
+
+        INSERT INTO dim_tempo_nova (id_tempo, ano, mes, semana, data_inicio, data_fim)
+        SELECT DISTINCT ON (ano, mes)
+            ano * 100 + mes, ano, mes, semana, data_inicio, data_fim
+        FROM dim_tempo
+        ORDER BY ano, mes, id_tempo;
+
+        DROP TABLE dim_tempo;
+        ALTER TABLE dim_tempo_nova RENAME TO dim_tempo;
+        ALTER TABLE dim_tempo RENAME CONSTRAINT dim_tempo_nova_pkey TO dim_tempo_pkey;
+        ALTER TABLE dim_tempo ADD CONSTRAINT uq_tempo_ano_mes UNIQUE (ano, mes);
+        ALTER TABLE dim_tempo ADD CONSTRAINT ck_tempo_chave
+            CHECK (id_tempo = ano * 100 + mes AND mes BETWEEN 1 AND 12);
+
+        ALTER TABLE fato_lancamento ADD CONSTRAINT fk_fato_tempo
+            FOREIGN KEY (id_tempo) REFERENCES dim_tempo (id_tempo);
+    END IF;
+END
+$$;
+
+INSERT INTO dim_tempo (id_tempo, ano, mes, semana, data_inicio, data_fim)
+SELECT
+    EXTRACT(YEAR FROM m)::INT * 100 + EXTRACT(MONTH FROM m)::INT,
+    EXTRACT(YEAR FROM m)::INT,
+    EXTRACT(MONTH FROM m)::INT,
+    EXTRACT(WEEK FROM m)::INT,
+    m::DATE,
+    (m + INTERVAL '1 month - 1 day')::DATE
+FROM generate_series('2000-01-01'::DATE, '2040-12-01'::DATE, INTERVAL '1 month') AS m
+ON CONFLICT (ano, mes) DO NOTHING;
+
+COMMIT;
@@ -0,0 +1,27 @@
+-- Migração: tabelas de métricas das execuções do ETL (etl_run / etl_run_stage).
+-- Idempotente: pode ser executada em bancos novos ou já migrados.
+\c loretto_dw
+
+CREATE TABLE IF NOT EXISTS etl_run (
+    id_run BIGSERIAL PRIMARY KEY,
+    iniciado_em TIMESTAMP NOT NULL,
+    finalizado_em TIMESTAMP,
+    status VARCHAR(20) NOT NULL,
+    modo VARCHAR(50),
+    staging VARCHAR(63),
+    total_segundos DOUBLE PRECISION,
+    erro TEXT
+);
+
+CREATE TABLE IF NOT EXISTS etl_run_stage (
+    id_run BIGINT NOT NULL,
+    ordem INT NOT NULL,
+    etapa VARCHAR(50) NOT NULL,
+    segundos DOUBLE PRECISION NOT NULL,
+    linhas BIGINT,
+    memoria_pico_bytes BIGINT,
+    plano JSONB,
+    CONSTRAINT pk_etl_run_stage PRIMARY KEY (id_run, ordem),
+    CONSTRAINT fk_etl_run_stage_run FOREIGN KEY (id_run)
+        REFERENCES etl_run (id_run) ON DELETE CASCADE
+);
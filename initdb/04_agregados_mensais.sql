@@ -0,0 +1,44 @@
+-- Migração: agregado mensal da fato (agg_lancamento_mensal) e view com nomes.
+-- Idempotente: recalcula o agregado a partir da fato já existente.
+\c loretto_dw
+
+CREATE TABLE IF NOT EXISTS agg_lancamento_mensal (
+    id_tempo INT NOT NULL,
+    id_tipo INT NOT NULL,
+    id_grupo INT NOT NULL,
+    id_categoria INT NOT NULL,
+    id_classificacao INT NOT NULL,
+    valor_total NUMERIC(18,2) NOT NULL,
+    quantidade BIGINT NOT NULL,
+    CONSTRAINT pk_agg_lancamento_mensal PRIMARY KEY (id_tempo, id_tipo, id_grupo, id_categoria, id_classificacao)
+);
+
+-- Agregado com os nomes das dimensões, para consultas do Metabase
+CREATE OR REPLACE VIEW vw_lancamento_mensal AS
+SELECT
+    t.ano,
+    t.mes,
+    t.data_inicio,
+    dt.nome_tipo,
+    dg.nome_grupo,
+    dc.nome_categoria,
+    cs.nome_classificacao,
+    a.valor_total,
+    a.quantidade
+FROM agg_lancamento_mensal a
+JOIN dim_tempo t ON t.id_tempo = a.id_tempo
+JOIN dim_tipo dt ON dt.id_tipo = a.id_tipo
+JOIN dim_grupo dg ON dg.id_grupo = a.id_grupo
+JOIN dim_categoria dc ON dc.id_categoria = a.id_categoria
+JOIN dim_classificacao cs ON cs.id_classificacao = a.id_classificacao;
+
+-- Carga inicial (ou reconstrução) a partir do histórico
+BEGIN;
+LOCK TABLE agg_lancamento_mensal IN EXCLUSIVE MODE;
+DELETE FROM agg_lancamento_mensal;
+INSERT INTO agg_lancamento_mensal
+    (id_tempo, id_tipo, id_grupo, id_categoria, id_classificacao, valor_total, quantidade)
+SELECT id_tempo, id_tipo, id_grupo, id_categoria, id_classificacao, SUM(valor), COUNT(*)
+FROM fato_lancamento
+GROUP BY id_tempo, id_tipo, id_grupo, id_categoria, id_classificacao;
+COMMIT;
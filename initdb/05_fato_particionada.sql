@@ -0,0 +1,67 @@
+-- Migração: fato_lancamento particionada por mês (RANGE em id_tempo YYYYMM),
+-- com índices nas chaves estrangeiras. Bancos com a fato antiga (tabela
+-- comum) têm os dados copiados para a nova estrutura, uma partição por mês.
+-- Idempotente: pode ser executada em bancos novos ou já migrados.
+\c loretto_dw
+
+BEGIN;
+
+DO $$
+DECLARE
+    mes INT;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'fato_lancamento'::regclass) = 'r' THEN
+        ALTER TABLE fato_lancamento RENAME TO fato_lancamento_legado;
+
+        CREATE TABLE fato_lancamento (
+            id_lancamento INT NOT NULL DEFAULT nextval('fato_lancamento_id_lancamento_seq'),
+            id_tipo INT NOT NULL,
+            id_grupo INT NOT NULL,
+            id_categoria INT NOT NULL,
+            id_tempo INT NOT NULL,
+            id_classificacao INT NOT NULL,
+            descricao VARCHAR(255),
+            valor NUMERIC(15,2) NOT NULL,
+            id_hash TEXT NOT NULL,
+            CONSTRAINT pk_fato_lancamento PRIMARY KEY (id_lancamento, id_tempo),
+            CONSTRAINT uq_fato_hash UNIQUE (id_hash, id_tempo)
+        ) PARTITION BY RANGE (id_tempo);
+
+        ALTER SEQUENCE fato_lancamento_id_lancamento_seq OWNED BY fato_lancamento.id_lancamento;
+
+        FOR mes IN SELECT DISTINCT id_tempo FROM fato_lancamento_legado ORDER BY 1 LOOP
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF fato_lancamento FOR VALUES FROM (%s) TO (%s)',
+                'fato_lancamento_' || mes, mes,
+                CASE WHEN mes % 100 = 12 THEN mes + 89 ELSE mes + 1 END
+            );
+        END LOOP;
+
+        INSERT INTO fato_lancamento (id_lancamento, id_tipo, id_grupo, id_categoria, id_tempo,
+                                     id_classificacao, descricao, valor, id_hash)
+        SELECT id_lancamento, id_tipo, id_grupo, id_categoria, id_tempo,
+               id_classificacao, descricao, valor, id_hash
+        FROM fato_lancamento_legado;
+
+        DROP TABLE fato_lancamento_legado;
+
+        -- Chaves estrangeiras depois da cópia: validadas uma vez, em bloco
+        ALTER TABLE fato_lancamento
+            ADD CONSTRAINT fk_fato_tipo FOREIGN KEY (id_tipo) REFERENCES dim_tipo (id_tipo),
+            ADD CONSTRAINT fk_fato_grupo FOREIGN KEY (id_grupo) REFERENCES dim_grupo (id_grupo),
+            ADD CONSTRAINT fk_fato_classificacao FOREIGN KEY (id_classificacao)
+                REFERENCES dim_classificacao (id_classificacao),
+            ADD CONSTRAINT fk_fato_categoria FOREIGN KEY (id_categoria) REFERENCES dim_categoria (id_categoria),
+            ADD CONSTRAINT fk_fato_tempo FOREIGN KEY (id_tempo) REFERENCES dim_tempo (id_tempo);
+    END IF;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS ix_fato_tipo ON fato_lancamento (id_tipo);
+CREATE INDEX IF NOT EXISTS ix_fato_grupo ON fato_lancamento (id_grupo);
+CREATE INDEX IF NOT EXISTS ix_fato_categoria ON fato_lancamento (id_categoria);
+CREATE INDEX IF NOT EXISTS ix_fato_classificacao ON fato_lancamento (id_classificacao);
+
+COMMIT;
+
+ANALYZE fato_lancamento;
@@ -0,0 +1,25 @@
+-- Migração: fila de jobs do ETL (etl_job), executados em segundo plano por app/jobs.py.
+-- Idempotente: pode ser executada em bancos novos ou já migrados.
+\c loretto_dw
+
+CREATE TABLE IF NOT EXISTS etl_job (
+    id_job BIGSERIAL PRIMARY KEY,
+    criado_em TIMESTAMP NOT NULL DEFAULT now(),
+    iniciado_em TIMESTAMP,
+    finalizado_em TIMESTAMP,
+    heartbeat_em TIMESTAMP,
+    status VARCHAR(20) NOT NULL DEFAULT 'pendente',
+    arquivo TEXT NOT NULL,
+    chave_conteudo VARCHAR(64),
+    parametros JSONB NOT NULL DEFAULT '{}',
+    tentativas INT NOT NULL DEFAULT 0,
+    worker VARCHAR(100),
+    etapa VARCHAR(50),
+    linhas_processadas BIGINT,
+    linhas_total BIGINT,
+    resultado JSONB,
+    erro TEXT,
+    id_run BIGINT
+);
+
+CREATE INDEX IF NOT EXISTS ix_etl_job_status ON etl_job (status, id_job);
@@ -0,0 +1,18 @@
+-- Migração: fato_lancamento.id_hash de TEXT (md5 em 32 caracteres hex) para
+-- UUID (os 16 bytes do digest). O índice único (id_hash, id_tempo), sondado
+-- a cada insert e ON CONFLICT, fica com cerca de metade do tamanho.
+-- A conversão é feita no lugar (ALTER ... TYPE, que percorre as partições e
+-- reconstrói os índices); os hashes existentes continuam os mesmos.
+-- Idempotente: pode ser executada em bancos novos ou já migrados.
+\c loretto_dw
+
+DO $$
+BEGIN
+    IF (SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+        WHERE attrelid = 'fato_lancamento'::regclass AND attname = 'id_hash') <> 'uuid' THEN
+        ALTER TABLE fato_lancamento ALTER COLUMN id_hash TYPE UUID USING id_hash::uuid;
+    END IF;
+END
+$$;
+
+ANALYZE fato_lancamento;
@@ -0,0 +1,19 @@
+-- Migração: checkpoints das etapas do ETL (etl_checkpoint), para retomar uma
+-- carga que falhou a partir da primeira etapa ou lote da fato pendente.
+-- Idempotente: pode ser executada em bancos novos ou já migrados.
+\c loretto_dw
+
+ALTER TABLE etl_run ADD COLUMN IF NOT EXISTS retomada_de BIGINT;
+
+CREATE TABLE IF NOT EXISTS etl_checkpoint (
+    id_run BIGINT NOT NULL,
+    etapa VARCHAR(50) NOT NULL,
+    lote INT NOT NULL DEFAULT 0,
+    pagina_inicial INT,
+    pagina_final INT,
+    linhas BIGINT,
+    concluido_em TIMESTAMP NOT NULL DEFAULT now(),
+    CONSTRAINT pk_etl_checkpoint PRIMARY KEY (id_run, etapa, lote),
+    CONSTRAINT fk_etl_checkpoint_run FOREIGN KEY (id_run)
+        REFERENCES etl_run (id_run) ON DELETE CASCADE
+);
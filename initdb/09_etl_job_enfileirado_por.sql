@@ -0,0 +1,7 @@
+-- Migração: processo que enfileirou cada job (etl_job.enfileirado_por). Jobs
+-- cujo upload está preparado no cache desse processo só são reservados por
+-- ele enquanto o cache vale (CACHE_UPLOADS_TTL).
+-- Idempotente: pode ser executada em bancos novos ou já migrados.
+\c loretto_dw
+
+ALTER TABLE etl_job ADD COLUMN IF NOT EXISTS enfileirado_por VARCHAR(100);